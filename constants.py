@@ -3,6 +3,13 @@ SEED_FOLDER_NAME = 'seed'
 SEED_FILE_NAME = 'items.json'
 DATE_FORMAT = "%Y/%m/%d"
 
+# data files can be plain csv files or compressed ones
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.xz')
+DATA_FILE_EXTENSIONS = ('.csv',) + tuple(f'.csv{ext}' for ext in COMPRESSED_EXTENSIONS)
+
+# a field in quotes can hold the separator, a quote inside it is written twice (RFC 4180)
+QUOTE_CHAR = '"'
+
 
 # column_names - generated data (big, small, test)
 class SeedDataColNames:
@@ -1,5 +1,6 @@
 import json
 import random
+import csv
 from tqdm import tqdm
 
 from global_utils import make_dir, human_readable
@@ -87,24 +88,26 @@ def generate_file(data_gen_obj, file_details):
                              file_details['file_name'])
     make_dir(directory=os.path.join(CURRENT_FOLDER, constants.DATA_FOLDER_NAME, file_details['folder_name']))
 
-    with open(file_path, 'w') as f:
-        f.write(",".join([constants.OutDataColNames.STOCK_CODE, constants.OutDataColNames.DESCRIPTION,
-                          constants.OutDataColNames.UNIT_PRICE, constants.OutDataColNames.QUANTITY,
-                          constants.OutDataColNames.TOTAL_PRICE, constants.OutDataColNames.COUNTRY,
-                          constants.OutDataColNames.INVOICE_NO, constants.OutDataColNames.DATE]))
-        f.write("\n")
+    # descriptions keep their commas, csv quotes the fields holding one
+    with open(file_path, 'w', newline='') as f:
+        csv.writer(f, lineterminator="\n").writerow([
+            constants.OutDataColNames.STOCK_CODE, constants.OutDataColNames.DESCRIPTION,
+            constants.OutDataColNames.UNIT_PRICE, constants.OutDataColNames.QUANTITY,
+            constants.OutDataColNames.TOTAL_PRICE, constants.OutDataColNames.COUNTRY,
+            constants.OutDataColNames.INVOICE_NO, constants.OutDataColNames.DATE])
 
-    with open(file_path, 'a') as f:
+    with open(file_path, 'a', newline='') as f:
+        writer = csv.writer(f, lineterminator="")
         for n_row in tqdm(range(file_details['n_datapoints'])):
             row = data_gen_obj.generate_data(start_date=file_details['start_date'],
                                              end_date=file_details['end_date'])
-            f.write(",".join([str(row[constants.SeedDataColNames.STOCK_NO]),
-                              str(row[constants.SeedDataColNames.DESCRIPTION]).replace(',', ''),
-                              str(row[constants.SeedDataColNames.UNIT_PRICE]),
-                              str(row[constants.SeedDataColNames.UNITS]),
-                              str(row[constants.SeedDataColNames.TOTAL]), str(row[constants.SeedDataColNames.COUNTRY]),
-                              str(row[constants.SeedDataColNames.INVOICE_NO]),
-                              str(row[constants.SeedDataColNames.DATE])]))
+            writer.writerow([str(row[constants.SeedDataColNames.STOCK_NO]),
+                             str(row[constants.SeedDataColNames.DESCRIPTION]),
+                             str(row[constants.SeedDataColNames.UNIT_PRICE]),
+                             str(row[constants.SeedDataColNames.UNITS]),
+                             str(row[constants.SeedDataColNames.TOTAL]), str(row[constants.SeedDataColNames.COUNTRY]),
+                             str(row[constants.SeedDataColNames.INVOICE_NO]),
+                             str(row[constants.SeedDataColNames.DATE])])
 
             total_units += row[constants.SeedDataColNames.UNITS]
             total_price += row[constants.SeedDataColNames.TOTAL]
@@ -2,6 +2,7 @@ import os
 import math
 import sys
 import matplotlib.pyplot as plt
+import constants
 
 
 def get_file_name(file_path):
@@ -12,7 +13,11 @@ def get_file_name(file_path):
     file_name_ext = os.path.basename(file_path)
 
     # file name without extension
-    file_name = os.path.splitext(file_name_ext)[0]
+    file_name, ext = os.path.splitext(file_name_ext)
+
+    # compressed files have two extensions - 2015.csv.gz
+    if ext in constants.COMPRESSED_EXTENSIONS:
+        file_name = os.path.splitext(file_name)[0]
 
     return file_name
 
@@ -0,0 +1,120 @@
+"""
+Parsing speed of `DataReader.split_columns` (`str.split`, with the C level `csv` reader for the lines holding quoted
+fields) against the plain `str.split` of every line it replaces and against the `csv` reader on every line, on the
+files as they are and with every field quoted. All of them run with the garbage collector paused, like
+`split_columns` does. The end to end scans time a whole text mode `iter_batches` (reading, splitting and converting)
+with `split_columns` and with the `csv` reader in its place.
+
+    python -m w1.benchmark --type tst
+"""
+from typing import Callable, List
+from w1.data_processor import DataProcessor
+from w1.utils import DataReader, paused_gc
+import constants
+import argparse
+import tempfile
+import time
+import csv
+import io
+import os
+
+CURRENT_FOLDER_NAME = os.path.dirname(os.path.abspath(__file__))
+
+
+def split_lines(lines: List[str], max_split: int = -1) -> List:
+    # how `DataReader` turned lines into columns before quoted fields were supported
+    with paused_gc():
+        rows = [line.rstrip('\r\n').split(',', max_split) for line in lines if line.strip('\r\n')]
+
+    return list(zip(*rows))
+
+
+def read_lines(lines: List[str], max_split: int = -1) -> List:
+    # every line through the `csv` reader, the plain way to read quoted fields
+    with paused_gc():
+        rows = [row for row in csv.reader(lines) if row]
+
+    return list(zip(*rows))
+
+
+def best_time(func: Callable, n_repeats: int) -> float:
+    # the fastest of a few runs, the slower ones mostly measure noise
+    times = []
+    for _ in range(n_repeats):
+        st = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - st)
+
+    return min(times)
+
+
+def quote_all(lines: List[str]) -> List[str]:
+    # same rows with every field quoted, so a separator inside a field would be read correctly
+    out = io.StringIO()
+    csv.writer(out, lineterminator='\n', quoting=csv.QUOTE_ALL).writerows(csv.reader(lines))
+    return out.getvalue().split('\n')
+
+
+def scan(reader: DataReader) -> None:
+    for batch in reader.iter_batches():
+        for col_name in reader.get_column_names():
+            _ = batch[col_name]
+
+
+def benchmark_file(file_path: str, n_repeats: int) -> None:
+    dp = DataProcessor(file_path=file_path, use_mmap=False)
+    reader = dp.data_reader
+
+    with open(file_path) as f:
+        header = f.readline()
+        text = f.read()
+
+    lines = text.split('\n')
+    quoted_lines = quote_all(lines=lines)
+    n_rows = sum([1 for line in lines if line])
+
+    runs = {
+        'str.split': (lambda: split_lines(lines=lines), len(text)),
+        'csv.reader': (lambda: read_lines(lines=lines), len(text)),
+        'split_columns': (lambda: reader.split_columns(lines=lines), len(text)),
+        'csv.reader (all quoted)': (lambda: read_lines(lines=quoted_lines), sum(map(len, quoted_lines))),
+        'split_columns (all quoted)': (lambda: reader.split_columns(lines=quoted_lines), sum(map(len, quoted_lines))),
+    }
+
+    with tempfile.TemporaryDirectory() as folder_path:
+        quoted_fp = os.path.join(folder_path, 'quoted.csv')
+        with open(quoted_fp, 'w') as f:
+            f.write(header + '\n'.join(quoted_lines))
+
+        for name, fp in [('scan', file_path), ('scan (all quoted)', quoted_fp)]:
+            scan_reader = DataReader(fp=fp, sep=',', col_names=dp._col_names)
+            csv_reader = DataReader(fp=fp, sep=',', col_names=dp._col_names)
+            csv_reader.split_columns = read_lines
+            runs[f'{name} csv.reader'] = (lambda csv_reader=csv_reader: scan(reader=csv_reader), os.path.getsize(fp))
+            runs[f'{name} split_columns'] = (lambda scan_reader=scan_reader: scan(reader=scan_reader),
+                                             os.path.getsize(fp))
+
+        print(f"{os.path.basename(file_path)} - {n_rows} rows")
+        for name, (func, n_bytes) in runs.items():
+            seconds = best_time(func=func, n_repeats=n_repeats)
+            print(f"    {name:<36}{seconds:8.3f}s {n_rows / seconds / 1e6:8.2f}M rows/s "
+                  f"{n_bytes / seconds / 1e6:8.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Choose from one of these : [tst|sml|bg]")
+    parser.add_argument('--type',
+                        default='tst',
+                        choices=['tst', 'sml', 'bg'],
+                        help='Type of data to benchmark on')
+    parser.add_argument('--repeats', default=5, type=int, help='Runs per parser, the fastest one is reported')
+    args = parser.parse_args()
+
+    data_folder_path = os.path.join(CURRENT_FOLDER_NAME, '..', constants.DATA_FOLDER_NAME, args.type)
+    for file_name in sorted(os.listdir(data_folder_path)):
+        if file_name.endswith('.csv'):
+            benchmark_file(file_path=os.path.join(data_folder_path, file_name), n_repeats=args.repeats)
+
+
+if __name__ == '__main__':
+    main()
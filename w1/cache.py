@@ -0,0 +1,245 @@
+from typing import Callable, Dict, Generator, Iterable, List, Optional, Tuple
+from collections.abc import Mapping
+from w1.schema import Schema
+from w1.predicates import Predicate
+import numpy as np
+import shutil
+import json
+import os
+
+# bump when the layout of the cache folder changes, older caches are then rebuilt
+CACHE_VERSION = 1
+MANIFEST_FILE_NAME = 'manifest.json'
+OFFSETS_FILE_NAME = 'offsets.npy'
+
+# str columns of a chunk are dictionary encoded when they hold at most this fraction of distinct values
+MAX_DICT_RATIO = 0.5
+
+# how the values of a column chunk are stored
+FLOAT_ENCODING = 'float'
+DICT_ENCODING = 'dict'
+BYTES_ENCODING = 'bytes'
+
+
+def get_file_signature(fp: str, sep: str, col_names: List[str], schema: Schema) -> Dict:
+    # what a file derived from the CSV file depends on, it is out of date as soon as any of it changes
+    file_stat = os.stat(fp)
+
+    return {
+        'file_size': file_stat.st_size,
+        'file_mtime_ns': file_stat.st_mtime_ns,
+        'sep': sep,
+        'col_names': col_names,
+        'schema': schema.describe(col_names=col_names)
+    }
+
+
+class ColumnCache:
+    """
+    Binary columnar copy of a parsed CSV file, kept in the hidden folder `.<file name>.cache` next to the file
+
+    The file is stored in chunks of rows with one `.npy` file per column and chunk: float64 for FLOAT columns, and
+    either int32 codes plus the distinct values or fixed width utf-8 bytes for STR columns. The `.npy` files are
+    memory mapped when read, so a scan only touches the columns it asks for and never parses text. The byte offset
+    of every row is kept as well to serve `byte_range` scans.
+
+    `manifest.json` is written last and records the size and modification time of the CSV file together with the
+    separator, column names and schema it was parsed with. The cache is only used while all of them still match.
+    """
+    def __init__(self, fp: str, sep: str, col_names: List[str], schema: Schema) -> None:
+        self._fp = fp
+        self._sep = sep
+        self._col_names = col_names
+        self._schema = schema
+
+        folder_path, file_name = os.path.split(os.path.abspath(fp))
+        self._cache_dir = os.path.join(folder_path, f'.{file_name}.cache')
+
+    def get_cache_dir(self) -> str:
+        return self._cache_dir
+
+    def get_signature(self) -> Dict:
+        return dict(get_file_signature(fp=self._fp, sep=self._sep, col_names=self._col_names, schema=self._schema),
+                    version=CACHE_VERSION)
+
+    def load_manifest(self) -> Optional[Dict]:
+        # returns None when there is no cache or it is out of date
+        try:
+            with open(os.path.join(self._cache_dir, MANIFEST_FILE_NAME)) as f:
+                manifest = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+        signature = self.get_signature()
+        if any([manifest.get(key) != val for key, val in signature.items()]):
+            return None
+
+        return manifest
+
+    def is_valid(self) -> bool:
+        return self.load_manifest() is not None
+
+    def write(self, batches: Iterable[Tuple[Dict[str, np.ndarray], np.ndarray]],
+              get_rejected_counts: Optional[Callable[[], Dict[str, int]]] = None) -> None:
+        """
+        Write the cache from the (batch, row byte offsets) pairs of a full scan of the file. The chunks are written
+        to a temporary folder which replaces the old cache once complete.
+        """
+        signature = self.get_signature()
+        tmp_dir = f'{self._cache_dir}.tmp-{os.getpid()}'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        chunk_rows = []
+        encodings = []
+        offsets = []
+        for n_chunk, (batch, batch_offsets) in enumerate(batches):
+            encodings.append({col_name: self.write_column(folder_path=tmp_dir, n_chunk=n_chunk, col_name=col_name,
+                                                          vals=batch[col_name])
+                              for col_name in self._col_names})
+            chunk_rows.append(len(batch_offsets))
+            offsets.append(np.asarray(batch_offsets, dtype=np.int64))
+
+        np.save(os.path.join(tmp_dir, OFFSETS_FILE_NAME),
+                np.concatenate(offsets) if offsets else np.zeros(0, dtype=np.int64))
+
+        if self.get_signature() != signature:
+            # the file changed while it was being parsed
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        manifest = dict(signature)
+        manifest['n_rows'] = int(sum(chunk_rows))
+        manifest['chunk_rows'] = chunk_rows
+        manifest['encodings'] = encodings
+        manifest['n_rejected'] = get_rejected_counts() if get_rejected_counts is not None else {}
+        with open(os.path.join(tmp_dir, MANIFEST_FILE_NAME), 'w') as f:
+            f.write(json.dumps(manifest))
+
+        shutil.rmtree(self._cache_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, self._cache_dir)
+        except OSError:
+            # another process wrote the cache at the same time
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def write_column(self, folder_path: str, n_chunk: int, col_name: str, vals: np.ndarray) -> str:
+        path = os.path.join(folder_path, f'{n_chunk}_{col_name}')
+
+        if vals.dtype.kind == 'f':
+            np.save(f'{path}.npy', vals)
+            return FLOAT_ENCODING
+
+        categories, codes = np.unique(vals.astype(str), return_inverse=True)
+        if len(categories) <= MAX_DICT_RATIO * len(vals):
+            np.save(f'{path}.npy', codes.astype(np.int32))
+            np.save(f'{path}.categories.npy', np.char.encode(categories, 'utf-8'))
+            return DICT_ENCODING
+
+        np.save(f'{path}.npy', np.char.encode(vals.astype(str), 'utf-8'))
+        return BYTES_ENCODING
+
+    def read_column(self, n_chunk: int, col_name: str, encoding: str, rows: slice) -> np.ndarray:
+        path = os.path.join(self._cache_dir, f'{n_chunk}_{col_name}')
+        vals = np.load(f'{path}.npy', mmap_mode='r')[rows]
+
+        if encoding == FLOAT_ENCODING:
+            return np.asarray(vals)
+
+        if encoding == DICT_ENCODING:
+            categories = np.char.decode(np.load(f'{path}.categories.npy'), 'utf-8').astype(object)
+            return categories[vals]
+
+        return np.char.decode(vals, 'utf-8').astype(object)
+
+    def evaluate_column(self, n_chunk: int, col_name: str, encoding: str, rows: slice,
+                        predicate: Predicate) -> np.ndarray:
+        # a filter runs on the stored values - on the distinct values only of a dictionary encoded chunk, and on the
+        # utf-8 bytes of the others
+        path = os.path.join(self._cache_dir, f'{n_chunk}_{col_name}')
+        vals = np.load(f'{path}.npy', mmap_mode='r')[rows]
+
+        if encoding == DICT_ENCODING:
+            return predicate.evaluate(vals=np.load(f'{path}.categories.npy'))[vals]
+
+        return predicate.evaluate(vals=np.asarray(vals))
+
+    def get_row_range(self, manifest: Dict, byte_range: Optional[Tuple[int, int]] = None) -> Tuple[int, int]:
+        # rows to read - all of them, or the ones starting inside the byte range
+        if byte_range is None:
+            return 0, manifest['n_rows']
+
+        offsets = np.load(os.path.join(self._cache_dir, OFFSETS_FILE_NAME), mmap_mode='r')
+        return int(np.searchsorted(offsets, byte_range[0])), int(np.searchsorted(offsets, byte_range[1]))
+
+    def count_rows(self, manifest: Dict, byte_range: Optional[Tuple[int, int]] = None) -> int:
+        first_row, last_row = self.get_row_range(manifest=manifest, byte_range=byte_range)
+        return last_row - first_row
+
+    def iter_batches(self, manifest: Dict, batch_rows: int, col_index: Dict[str, int],
+                     byte_range: Optional[Tuple[int, int]] = None) -> Generator:
+        first_row, last_row = self.get_row_range(manifest=manifest, byte_range=byte_range)
+
+        chunk_start = 0
+        for n_chunk, n_chunk_rows in enumerate(manifest['chunk_rows']):
+            chunk_end = chunk_start + n_chunk_rows
+
+            row = max(first_row, chunk_start)
+            while row < min(last_row, chunk_end):
+                rows = slice(row - chunk_start, min(row + batch_rows, last_row, chunk_end) - chunk_start)
+                yield CacheBatch(cache=self, n_chunk=n_chunk, rows=rows, encodings=manifest['encodings'][n_chunk],
+                                 col_names=list(col_index.keys()))
+                row = rows.stop + chunk_start
+
+            chunk_start = chunk_end
+
+
+class CacheBatch(Mapping):
+    """
+    Column batch served from a `ColumnCache`, a column is only read from disk the first time it is looked up
+
+    `mask` keeps only some of the rows, see `take`.
+    """
+    def __init__(self, cache: ColumnCache, n_chunk: int, rows: slice, encodings: Dict[str, str],
+                 col_names: List[str], mask: Optional[np.ndarray] = None) -> None:
+        self._cache = cache
+        self._n_chunk = n_chunk
+        self._rows = rows
+        self._encodings = encodings
+        self._col_names = col_names
+        self._mask = mask
+        self._decoded = {}
+
+    def __getitem__(self, col_name: str) -> np.ndarray:
+        if col_name not in self._col_names:
+            raise KeyError(col_name)
+
+        if col_name not in self._decoded:
+            vals = self._cache.read_column(n_chunk=self._n_chunk, col_name=col_name,
+                                           encoding=self._encodings[col_name], rows=self._rows)
+            self._decoded[col_name] = vals if self._mask is None else vals[self._mask]
+
+        return self._decoded[col_name]
+
+    def evaluate(self, predicate: Predicate) -> np.ndarray:
+        # rows matching the predicate, the column is not decoded
+        matches = self._cache.evaluate_column(n_chunk=self._n_chunk, col_name=predicate.column,
+                                              encoding=self._encodings[predicate.column], rows=self._rows,
+                                              predicate=predicate)
+        return matches if self._mask is None else matches[self._mask]
+
+    def take(self, mask: np.ndarray, col_names: List[str]) -> 'CacheBatch':
+        # batch with only the rows in `mask` and the `col_names` columns, still read lazily
+        if self._mask is not None:
+            full_mask = self._mask.copy()
+            full_mask[full_mask] = mask
+            mask = full_mask
+
+        return CacheBatch(cache=self._cache, n_chunk=self._n_chunk, rows=self._rows, encodings=self._encodings,
+                          col_names=col_names, mask=mask)
+
+    def __iter__(self):
+        return iter(self._col_names)
+
+    def __len__(self) -> int:
+        return len(self._col_names)
@@ -1,21 +1,55 @@
-from typing import List
+from typing import Any, Callable, List, Dict, Tuple, Optional, Union
 from pprint import pprint
-from w1.utils import Stats, DataReader
+from w1.utils import Stats, DataReader, open_file, is_compressed, split_file, EXACT_STATS
+from w1.plan import Consumer
+from w1.predicates import Predicate, to_predicates
+from w1.incremental import PlanState
+from w1.cache import get_file_signature
+from w1.sketch import DEFAULT_SKETCH_K
+from w1.histogram import Histogram
+from w1.hyperloglog import HyperLogLog, DEFAULT_PRECISION
+from w1.heavy_hitters import TopK, DEFAULT_CAPACITY
+from w1.grouped_stats import GroupedStats
+from w1.group_by import GroupBy
 from tqdm import tqdm
+import numpy as np
+import csv
 import os
 
+# bytes of the file read between two checkpoints of a resumable plan, see `DataProcessor.run_plan(on_checkpoint=...)`
+CHECKPOINT_BYTES = 1 << 26
+
 
 class DataProcessor:
-    def __init__(self, file_path: str) -> None:
+    def __init__(self, file_path: str, use_mmap: bool = False, byte_range: Optional[Tuple[int, int]] = None,
+                 use_cache: bool = False, estimate_rows: bool = False, use_zone_map: bool = False) -> None:
         self._fp = file_path
         self._col_names = []
         self._sep = ","
         self._stats = None
         self._file_name = os.path.basename(file_path)
         self._n_rows = 0
+        self._estimate_rows = estimate_rows
+        self._byte_range = byte_range
 
         self._set_col_names()
-        self.data_reader = DataReader(fp=file_path, sep=self._sep, col_names=self._col_names)
+
+        # `use_mmap` is opt-in: only the columns a scan looks up are cut out of the memory map, which pays off for
+        # scans of a few columns, but each of them is padded to its longest field in every batch (see `MmapBatch`)
+        # and a scan of every column is slower than reading the text
+        self.data_reader = DataReader(fp=file_path, sep=self._sep, col_names=self._col_names, use_mmap=use_mmap,
+                                      byte_range=byte_range, use_cache=use_cache, use_zone_map=use_zone_map)
+
+        # with `use_cache` the file is parsed into its columnar cache once, later scans (and runs) read the cache
+        # instead. It costs a full parse and a copy of the file on disk, so it pays off for files scanned many times,
+        # a processor working on a byte range leaves building it to the processor of the whole file
+        if use_cache and byte_range is None and not self.data_reader.has_valid_cache():
+            self.data_reader.build_cache()
+
+        # same for the zone map, which lets filtered scans skip the blocks of rows that can't match
+        if use_zone_map and byte_range is None and not self.data_reader.has_valid_zone_map():
+            self.data_reader.build_zone_map()
+
         self._set_n_rows()
 
     @staticmethod
@@ -26,48 +60,266 @@ class DataProcessor:
             return None
 
     def _set_n_rows(self) -> None:
-        # get generator from data_reader
-        data_reader_gen = (row for row in self.data_reader)
-
-        _ = next(data_reader_gen)
-
-        for _ in tqdm(data_reader_gen):
-            self._n_rows += 1
+        # count (or estimate) the rows from the raw bytes instead of parsing them
+        self._n_rows = self.data_reader.count_rows(estimate=self._estimate_rows)
 
     def _set_col_names(self) -> None:
-        with open(self._fp) as f:
-            first_row = f.readline().strip('\n')
+        # plain or compressed file
+        with open_file(self._fp) as f:
+            first_row = f.readline().decode().strip('\r\n')
 
-        col_names = first_row.split(self._sep)
+        # the column names can be quoted like any other field
+        col_names = next(csv.reader([first_row], delimiter=self._sep))
         self._col_names = col_names
 
-    def describe(self, column_names: List[str]):
-        # get generator from data_reader
-        data_reader_gen = (row for row in self.data_reader)
+    def compute_stats(self, column_names: List[str], where: Union[Predicate, List[Predicate], None] = None,
+                      mode: str = EXACT_STATS, sketch_k: int = DEFAULT_SKETCH_K,
+                      histogram: Optional[Histogram] = None,
+                      on_batch: Optional[Callable[[int], None]] = None) -> Dict[str, Stats]:
+        # key is the column name and value is the stats object, `mode` is the `Stats` mode (see `STATS_MODES`)
+        # and `histogram` an empty histogram to fill for every column. `on_batch` is called with the number of rows
+        # read so far after every batch, like in `run_plan`.
+        stats = {name: Stats(mode=mode, sketch_k=sketch_k, histogram=histogram) for name in column_names}
+
+        # update stats as we iterate through the file one block of rows at a time
+        n_rows_done = 0
+        for batch in tqdm(self.data_reader.iter_batches(columns=column_names, where=where)):
+            for column_name in column_names:
+                stats[column_name].update_batch(vals=batch[column_name])
 
-        # skip first row as it is the column name
-        _ = next(data_reader_gen)
+            n_rows_done += len(batch[column_names[0]]) if column_names else 0
+            if on_batch is not None:
+                on_batch(n_rows_done)
 
-        # key is the column name and value is the stats object
-        stats = {name: Stats() for name in column_names}
+        return stats
 
-        # update stats as we iterate through the file
-        for row in tqdm(data_reader_gen):
+    def compute_distinct(self, column_names: List[str], where: Union[Predicate, List[Predicate], None] = None,
+                         precision: int = DEFAULT_PRECISION) -> Dict[str, HyperLogLog]:
+        """
+        Approximate number of distinct values of the columns in a few KB per column, e.g. the products and invoices
+        of a year, instead of a set of every value. The counters of separate files or processes can be merged
+        before reading their counts:
+
+        dp.compute_distinct(column_names=['StockCode', 'InvoiceNo'])['InvoiceNo'].get_count()
+        """
+        counters = {name: HyperLogLog(precision=precision) for name in column_names}
+
+        for batch in tqdm(self.data_reader.iter_batches(columns=column_names, where=where)):
             for column_name in column_names:
-                stats[column_name].update_stats(val=row[column_name])
+                counters[column_name].update(vals=batch[column_name])
+
+        return counters
+
+    def compute_top(self, key_column: str, val_column: str, where: Union[Predicate, List[Predicate], None] = None,
+                    capacity: Optional[int] = DEFAULT_CAPACITY) -> TopK:
+        """
+        Keys with the largest totals of `val_column` while tracking at most `capacity` keys (all of them, exactly,
+        with `capacity=None`), e.g. the top 20 products by revenue with the error of every total:
+
+        dp.compute_top(key_column='StockCode', val_column='TotalPrice').get_top(k=20)
+        """
+        top = TopK(capacity=capacity)
+
+        for batch in tqdm(self.data_reader.iter_batches(columns=[key_column, val_column], where=where)):
+            top.update(keys=batch[key_column], vals=batch[val_column])
+
+        return top
+
+    def compute_grouped_stats(self, column_names: List[str], group_by: str,
+                              where: Union[Predicate, List[Predicate], None] = None,
+                              group_key: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+                              on_batch: Optional[Callable[[int], None]] = None) -> GroupedStats:
+        """
+        Streaming stats of the columns per value of the `group_by` column in a single scan (see `GroupedStats`).
+        `group_key` maps a batch of `group_by` values to the keys to group on, e.g. the month of a date:
+
+        dp.compute_grouped_stats(column_names=['TotalPrice'], group_by='Date',
+                                 group_key=lambda dates: dates.astype('U7'))
+        """
+        grouped_stats = GroupedStats(column_names=column_names)
+        columns = list(dict.fromkeys(column_names + [group_by]))
+
+        n_rows_done = 0
+        for batch in tqdm(self.data_reader.iter_batches(columns=columns, where=where)):
+            keys = batch[group_by] if group_key is None else group_key(batch[group_by])
+            grouped_stats.update_batch(keys=keys, batch=batch)
+
+            n_rows_done += len(keys)
+            if on_batch is not None:
+                on_batch(n_rows_done)
+
+        return grouped_stats
+
+    def compute_group_by(self, group_by: Union[str, List[str]], aggregates: Dict[str, Tuple[str, str]],
+                         where: Union[Predicate, List[Predicate], None] = None,
+                         group_keys: Optional[Dict[str, Callable[[np.ndarray], np.ndarray]]] = None) -> GroupBy:
+        """
+        Sums, counts, means, mins and maxs of numeric columns per key of the `group_by` columns in a single scan
+        (see `GroupBy`), e.g. the revenue and the number of sales per Country and month:
+
+        dp.compute_group_by(group_by=['Country', 'Date'], group_keys={'Date': to_month},
+                            aggregates={'revenue': ('sum', 'TotalPrice'), 'sales': ('count', 'TotalPrice')})
+        """
+        grouped = GroupBy(group_by=group_by, aggregates=aggregates, group_keys=group_keys)
+
+        for batch in tqdm(self.data_reader.iter_batches(columns=grouped.get_columns(), where=where)):
+            grouped.update_batch(batch=batch)
+
+        return grouped
 
+    def describe(self, column_names: List[str], mode: str = EXACT_STATS, sketch_k: int = DEFAULT_SKETCH_K,
+                 histogram: Optional[Histogram] = None, group_by: Optional[str] = None,
+                 group_key: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+                 where: Union[Predicate, List[Predicate], None] = None,
+                 on_batch: Optional[Callable[[int], None]] = None) -> Optional[Dict]:
+        """
+        Print the stats of the columns, e.g. with the shape of the prices on a log scale:
+
+        dp.describe(column_names=['UnitPrice', 'TotalPrice'], histogram=Histogram.log(low=0.001, high=1e6))
+
+        With `group_by` the stats are computed per value of that column (or per `group_key` of it, see
+        `compute_grouped_stats`) in the same single scan, printed and returned as a nested dict of group key ->
+        column name -> stats. Grouped stats are always streaming (count, min, max, mean and std), so `mode`,
+        `sketch_k` and `histogram` only apply to the stats of the whole file.
+
+        dp.describe(column_names=['UnitPrice', 'TotalPrice'], group_by='Country')
+
+        `where` and `on_batch` work as in `run_plan`.
+        """
+        if group_by is not None:
+            grouped = self.compute_grouped_stats(column_names=column_names, group_by=group_by, where=where,
+                                                 group_key=group_key, on_batch=on_batch).get_stats()
+            pprint(grouped)
+            return grouped
+
+        self.print_stats(stats=self.compute_stats(column_names=column_names, where=where, mode=mode,
+                                                  sketch_k=sketch_k, histogram=histogram, on_batch=on_batch))
+
+    def print_stats(self, stats: Dict[str, Stats]) -> None:
         self._stats = stats
         for column_name, value in self._stats.items():
             pprint(column_name)
             pprint(value.get_stats())
 
-    def aggregate(self, column_name: str) -> float:
+    def run_plan(self, consumers: Dict[str, Consumer], on_batch: Optional[Callable[[int], None]] = None,
+                 where: Union[Predicate, List[Predicate], None] = None,
+                 state_name: Optional[str] = None,
+                 on_checkpoint: Optional[Callable[[int, Dict[str, Consumer]], None]] = None,
+                 resume_from: Optional[Tuple[int, Dict[str, Consumer]]] = None,
+                 checkpoint_bytes: int = CHECKPOINT_BYTES) -> Dict[str, Any]:
         """
-        Input : List[str]
+        Input : Dict[str, Consumer], Callable, Predicate or List[Predicate], str, Callable, Tuple, int
         Output : Dict
 
-        This method should use the generator method assigned to seld.data_reader and return aggregate
-        of the column mentioned in the `column_name` variable
+        Fused scan - the union of the columns the `consumers` need is read once and every batch is handed to all
+        of them, instead of one scan per computation. Returns the result of every consumer under its key:
+
+        dp.run_plan(consumers={
+            'stats': StatsConsumer(column_names=['UnitPrice', 'TotalPrice']),
+            'total_revenue': SumConsumer(column_name='TotalPrice'),
+            'revenue_per_region': SumByKeyConsumer(key_column='Country', val_column='TotalPrice')
+        })
+
+        `on_batch` is called with the number of rows scanned so far after every batch, e.g. to report progress.
+        With `where` the consumers only see the rows matching the predicates (see `DataReader.iter_batches`), the
+        rows scanned then only count the matching ones.
+
+        With `state_name` the plan is incremental, for a file that only grows (rows appended at its end): the
+        consumers are saved together with the offset of the end of the last complete row (see `PlanState`). The next
+        run with the same `state_name` and plan restores them and only reads the rows appended since, so it takes
+        time in proportion to the new rows instead of the whole file. The `consumers` passed in are then only used
+        to check the plan didn't change. Every run loads and saves the whole state, so only consumers with a bounded
+        state (e.g. streaming or sketch stats, not exact ones, see `Consumer.has_bounded_state`) can be incremental.
+
+        With `on_checkpoint` a long scan can be resumed after a crash: the rows are read in byte ranges of about
+        `checkpoint_bytes`, and after each one `on_checkpoint` is called with the offset the scan reached and the
+        consumers holding everything before it, for the caller to save (e.g. pickled). Passing them back as
+        `resume_from=(offset, consumers)` continues the scan from that offset. A compressed file can't be read from
+        an offset, its scan has no checkpoints.
+        """
+        columns = list(dict.fromkeys([column for consumer in consumers.values()
+                                      for column in consumer.get_columns()]))
+
+        byte_range = self._byte_range
+        if state_name is not None:
+            if self._byte_range is not None or is_compressed(self._fp):
+                raise ValueError(f"An incremental plan needs the whole of a plain file, not {self._fp} "
+                                 f"in the byte range {self._byte_range}")
+            unbounded = [name for name, consumer in consumers.items() if not consumer.has_bounded_state()]
+            if unbounded:
+                raise ValueError(f"The state of {unbounded} grows with the file, an incremental plan would load and "
+                                 f"save all of it on every run")
+
+            plan_state = PlanState(fp=self._fp, name=state_name)
+            signature = self.get_plan_signature(consumers=consumers, where=where)
+
+            saved = plan_state.load(signature=signature)
+            start, consumers = saved if saved is not None else (0, consumers)
+            end = plan_state.get_complete_end(start=start)
+            byte_range = (start, end)
+
+        elif resume_from is not None:
+            if is_compressed(self._fp):
+                raise ValueError(f"A scan of the compressed file {self._fp} can't be resumed from an offset")
+
+            start, consumers = resume_from
+            byte_range = (start, self._byte_range[1] if self._byte_range is not None else os.path.getsize(self._fp))
+
+        byte_ranges = [byte_range]
+        if on_checkpoint is not None and not is_compressed(self._fp):
+            start, end = byte_range if byte_range is not None else (0, os.path.getsize(self._fp))
+            byte_ranges = split_file(fp=self._fp, n_parts=max(-(-(end - start) // checkpoint_bytes), 1),
+                                     byte_range=(start, end))
+
+        def iter_batches():
+            for part_range in byte_ranges:
+                data_reader = self.data_reader if part_range is None else \
+                    self.data_reader.get_range_reader(byte_range=part_range)
+                yield from data_reader.iter_batches(columns=columns, where=where)
+
+                # only reached once the consumers took the last batch of the range
+                if on_checkpoint is not None and part_range is not None:
+                    on_checkpoint(part_range[1], consumers)
+
+        n_rows_done = 0
+        for batch in tqdm(iter_batches()):
+            for consumer in consumers.values():
+                consumer.update(batch=batch)
+
+            n_rows_done += len(batch[columns[0]]) if columns else 0
+            if on_batch is not None:
+                on_batch(n_rows_done)
+
+        if state_name is not None:
+            plan_state.save(signature=signature, offset=end, consumers=consumers)
+
+        return {name: consumer.get_result() for name, consumer in consumers.items()}
+
+    def get_plan_signature(self, consumers: Dict[str, Consumer],
+                           where: Union[Predicate, List[Predicate], None] = None) -> Dict:
+        # what the saved state of an incremental plan depends on
+        return {
+            'sep': self._sep,
+            'col_names': self._col_names,
+            'schema': self.data_reader.get_schema().describe(col_names=self._col_names),
+            'consumers': {name: consumer.get_signature() for name, consumer in consumers.items()},
+            'where': [[type(predicate).__name__, vars(predicate)] for predicate in to_predicates(where)]
+        }
+
+    def get_checkpoint_signature(self, consumers: Dict[str, Consumer],
+                                 where: Union[Predicate, List[Predicate], None] = None) -> Dict:
+        # what a checkpoint of `run_plan(on_checkpoint=...)` depends on, the file itself must not have changed either
+        return dict(self.get_plan_signature(consumers=consumers, where=where), byte_range=self._byte_range,
+                    file=get_file_signature(fp=self._fp, sep=self._sep, col_names=self._col_names,
+                                            schema=self.data_reader.get_schema()))
+
+    def aggregate(self, column_name: str, where: Union[Predicate, List[Predicate], None] = None) -> float:
+        """
+        Input : str, Predicate or List[Predicate]
+        Output : float
+
+        This method uses the column batches of self.data_reader and returns the aggregate of the column mentioned in
+        the `column_name` variable
 
         For example if the `column_name` -> 'TotalPrice' and the file format is as below:
 
@@ -77,20 +329,13 @@ class DataProcessor:
         84732D       , IVORY CLOCK    , 0.39       , 2       , 0.78       ,India
 
         aggregate should be 105.58
-        """
-        ######################################## YOUR CODE HERE ##################################################
-        # get generator from data_reader
-        data_reader_gen = #### [YOUR CODE HERE] ####
 
-        # skip first row as it is the column name
-        _ = next(data_reader_gen)
-
-        # initialize aggreate value
-        aggregate = #### [YOUR CODE HERE] ####
+        With `where` only the matching rows are summed, e.g. `where=Eq('Country', 'Germany')` gives 24.96
+        """
+        aggregate = 0
 
-        for row in tqdm(data_reader_gen):
-            if self.to_float(row[column_name]):
-                aggregate += #### [YOUR CODE HERE] ####
+        # NaN marks the values that couldn't be converted to float, nansum leaves them out
+        for batch in tqdm(self.data_reader.iter_batches(columns=[column_name], where=where)):
+            aggregate += float(np.nansum(batch[column_name]))
 
         return aggregate
-        ######################################## YOUR CODE HERE ##################################################
@@ -0,0 +1,161 @@
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Union
+from w1.key_encoder import INITIAL_GROUPS, KeyEncoder, grow
+import numpy as np
+
+# aggregates a group-by can compute over a numeric column
+AGGREGATES = ('sum', 'count', 'mean', 'min', 'max')
+
+
+def to_month(dates: np.ndarray) -> np.ndarray:
+    # 'YYYY/MM' of a batch of 'YYYY/MM/DD' dates, a `group_keys` function to group by month
+    return np.asarray(dates).astype('U7')
+
+
+class GroupBy:
+    """
+    Hash group-by of a few aggregates (sum, count, mean, min and max of numeric columns) per value of one or more
+    key columns, e.g. the revenue and the number of sales per Country and month, in one scan however many groups
+    there are
+
+    `aggregates` names every output after an (aggregate, column) pair:
+
+    GroupBy(group_by=['Country', 'Date'], aggregates={'revenue': ('sum', 'TotalPrice'),
+                                                      'sales': ('count', 'TotalPrice')},
+            group_keys={'Date': to_month})
+
+    The keys are dictionary encoded by a `KeyEncoder`: every distinct key (a tuple with several `group_by` columns)
+    gets a group code the first time it is seen, and the running count, sum, min and max of every column are kept
+    in one array per statistic, indexed by column and group code. A batch is folded in with `np.bincount`,
+    `np.minimum.at` and `np.maximum.at` over its group codes, the Python work per batch grows with its distinct
+    keys, not its rows. NaN values (values that couldn't be converted to float) are left out. Group-bys of separate
+    parts or files merge.
+
+    `group_keys` maps a `group_by` column to a function of its batches giving the keys to group on (e.g.
+    `to_month`), it must be a module level function for the group-by to be pickled by incremental plans.
+    """
+    def __init__(self, group_by: Union[str, List[str]], aggregates: Mapping[str, Tuple[str, str]],
+                 group_keys: Optional[Mapping[str, Callable[[np.ndarray], np.ndarray]]] = None) -> None:
+        for name, (aggregate, column_name) in aggregates.items():
+            if aggregate not in AGGREGATES:
+                raise ValueError(f"Unknown aggregate '{aggregate}' for '{name}', use one of {AGGREGATES}")
+
+        self._group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+        self._aggregates = dict(aggregates)
+        self._group_keys = dict(group_keys or dict())
+
+        # only the columns and extremes the aggregates need are accumulated
+        self._column_names = list(dict.fromkeys([column_name for _, column_name in self._aggregates.values()]))
+        self._with_min = {column_name for aggregate, column_name in self._aggregates.values() if aggregate == 'min'}
+        self._with_max = {column_name for aggregate, column_name in self._aggregates.values() if aggregate == 'max'}
+
+        self._encoder = KeyEncoder()
+
+        shape = (len(self._column_names), INITIAL_GROUPS)
+        self._counts = np.zeros(shape, dtype=np.int64)
+        self._sums = np.zeros(shape, dtype=np.float64)
+        self._mins = np.full(shape, np.inf)
+        self._maxs = np.full(shape, -np.inf)
+
+    def get_group_by(self) -> List[str]:
+        return self._group_by
+
+    def get_aggregates(self) -> Dict[str, Tuple[str, str]]:
+        return self._aggregates
+
+    def get_group_keys(self) -> Dict[str, Callable[[np.ndarray], np.ndarray]]:
+        return self._group_keys
+
+    def get_columns(self) -> List[str]:
+        # columns a scan has to read
+        return list(dict.fromkeys(self._group_by + self._column_names))
+
+    def get_keys(self) -> List[Any]:
+        return self._encoder.get_keys()
+
+    def get_batch_keys(self, batch: Mapping[str, np.ndarray]) -> List[np.ndarray]:
+        # keys to group on of every `group_by` column of a batch
+        return [batch[name] if name not in self._group_keys else self._group_keys[name](batch[name])
+                for name in self._group_by]
+
+    def grow(self) -> None:
+        # room in the accumulators for every group of the encoder
+        capacity = self._encoder.get_capacity()
+        self._counts = grow(self._counts, capacity=capacity)
+        self._sums = grow(self._sums, capacity=capacity)
+        self._mins = grow(self._mins, capacity=capacity, fill=np.inf)
+        self._maxs = grow(self._maxs, capacity=capacity, fill=-np.inf)
+
+    def update_batch(self, batch: Mapping[str, np.ndarray]) -> None:
+        codes = self._encoder.encode(key_columns=self.get_batch_keys(batch=batch))
+        self.grow()
+        n_groups = self._counts.shape[1]
+
+        for n_column, column_name in enumerate(self._column_names):
+            vals = np.asarray(batch[column_name], dtype=np.float64)
+            valid = ~np.isnan(vals)
+            vals, val_codes = vals[valid], codes[valid]
+
+            self._counts[n_column] += np.bincount(val_codes, minlength=n_groups)
+            self._sums[n_column] += np.bincount(val_codes, weights=vals, minlength=n_groups)
+            if column_name in self._with_min:
+                np.minimum.at(self._mins[n_column], val_codes, vals)
+            if column_name in self._with_max:
+                np.maximum.at(self._maxs[n_column], val_codes, vals)
+
+    def merge(self, other: 'GroupBy') -> 'GroupBy':
+        # fold the groups of `other` (e.g. another part of the file or another file) into these
+        if other._group_by != self._group_by or other._aggregates != self._aggregates:
+            raise ValueError(f"Can't merge a group-by of {other._aggregates} per {other._group_by} "
+                             f"into one of {self._aggregates} per {self._group_by}")
+
+        # the keys of a group-by are distinct, so its codes can be added to with plain fancy indexing
+        n_other = len(other.get_keys())
+        codes = self._encoder.encode_keys(keys=other.get_keys())
+        self.grow()
+
+        self._counts[:, codes] += other._counts[:, :n_other]
+        self._sums[:, codes] += other._sums[:, :n_other]
+        self._mins[:, codes] = np.minimum(self._mins[:, codes], other._mins[:, :n_other])
+        self._maxs[:, codes] = np.maximum(self._maxs[:, codes], other._maxs[:, :n_other])
+
+        return self
+
+    def get_aggregate(self, name: str) -> Dict[Any, Optional[float]]:
+        """
+        One aggregate per group key, in the order of the keys, e.g. the revenue per region:
+
+        {'France': 17.14, 'Germany': 53.7, ...}
+
+        The mean, min and max of a group without any value of the column are None, its sum and count are 0.
+        """
+        aggregate, column_name = self._aggregates[name]
+        n_column = self._column_names.index(column_name)
+
+        result = dict()
+        for code, key in sorted(enumerate(self.get_keys()), key=lambda item: str(item[1])):
+            count = int(self._counts[n_column, code])
+            if aggregate == 'count':
+                result[key] = count
+            elif aggregate == 'sum':
+                result[key] = float(self._sums[n_column, code])
+            elif count == 0:
+                result[key] = None
+            elif aggregate == 'mean':
+                result[key] = float(self._sums[n_column, code] / count)
+            elif aggregate == 'min':
+                result[key] = float(self._mins[n_column, code])
+            else:
+                result[key] = float(self._maxs[n_column, code])
+
+        return result
+
+    def get_result(self) -> Dict[Any, Dict[str, Optional[float]]]:
+        """
+        Nested result: group key -> aggregate name -> value, in the order of the keys
+
+        {('France', '2015/04'): {'revenue': 1520.3, 'sales': 301}, ...}
+        """
+        aggregates = {name: self.get_aggregate(name=name) for name in self._aggregates}
+
+        return {key: {name: values[key] for name, values in aggregates.items()}
+                for key in sorted(self.get_keys(), key=str)}
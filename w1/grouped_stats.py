@@ -0,0 +1,113 @@
+from typing import Any, Dict, List, Mapping
+from w1.key_encoder import INITIAL_GROUPS, KeyEncoder, grow
+import numpy as np
+
+
+class GroupedStats:
+    """
+    Streaming stats (count, min, max, mean and std) of a few columns per value of a key column, e.g. the prices
+    per Country, in one scan however many groups there are
+
+    The keys are dictionary encoded by a `KeyEncoder` like in `GroupBy`: every distinct key gets a group code the
+    first time it is seen, and the running count, mean, M2 (Welford/Chan), min and max of every column are kept in
+    one array per statistic, indexed by column and group code. A batch is folded in with `np.bincount`,
+    `np.minimum.at` and `np.maximum.at` over its group codes instead of a `Stats` object and a Python call per group.
+    """
+    def __init__(self, column_names: List[str]) -> None:
+        self._column_names = column_names
+        self._encoder = KeyEncoder()
+
+        shape = (len(column_names), INITIAL_GROUPS)
+        self._counts = np.zeros(shape, dtype=np.int64)
+        self._means = np.zeros(shape, dtype=np.float64)
+        self._m2s = np.zeros(shape, dtype=np.float64)
+        self._mins = np.full(shape, np.inf)
+        self._maxs = np.full(shape, -np.inf)
+
+    def get_column_names(self) -> List[str]:
+        return self._column_names
+
+    def get_keys(self) -> List[Any]:
+        return self._encoder.get_keys()
+
+    def grow(self) -> None:
+        # room in the accumulators for every group of the encoder
+        capacity = self._encoder.get_capacity()
+        self._counts = grow(self._counts, capacity=capacity)
+        self._means = grow(self._means, capacity=capacity)
+        self._m2s = grow(self._m2s, capacity=capacity)
+        self._mins = grow(self._mins, capacity=capacity, fill=np.inf)
+        self._maxs = grow(self._maxs, capacity=capacity, fill=-np.inf)
+
+    def update_batch(self, keys: np.ndarray, batch: Mapping[str, np.ndarray]) -> None:
+        codes = self._encoder.encode(key_columns=[keys])
+        self.grow()
+        n_groups = self._counts.shape[1]
+
+        for n_column, column_name in enumerate(self._column_names):
+            # NaN marks a value that couldn't be converted to float, those are skipped like in `Stats`
+            vals = np.asarray(batch[column_name], dtype=np.float64)
+            valid = ~np.isnan(vals)
+            vals, val_codes = vals[valid], codes[valid]
+
+            counts = np.bincount(val_codes, minlength=n_groups)
+            sums = np.bincount(val_codes, weights=vals, minlength=n_groups)
+            means = np.divide(sums, counts, out=np.zeros(n_groups), where=counts > 0)
+            m2s = np.bincount(val_codes, weights=np.square(vals - means[val_codes]), minlength=n_groups)
+
+            self.update_moments(n_column=n_column, counts=counts, means=means, m2s=m2s)
+            np.minimum.at(self._mins[n_column], val_codes, vals)
+            np.maximum.at(self._maxs[n_column], val_codes, vals)
+
+    def update_moments(self, n_column: int, counts: np.ndarray, means: np.ndarray, m2s: np.ndarray) -> None:
+        # Chan et al.'s combination of the running count, mean and M2 of every group with those of new values
+        totals = self._counts[n_column] + counts
+        deltas = means - self._means[n_column]
+        shares = np.divide(counts, totals, out=np.zeros(len(totals)), where=totals > 0)
+
+        self._means[n_column] += deltas * shares
+        self._m2s[n_column] += m2s + deltas * deltas * self._counts[n_column] * shares
+        self._counts[n_column] = totals
+
+    def merge(self, other: 'GroupedStats') -> 'GroupedStats':
+        # fold the groups of `other` (e.g. another part of the file or another file) into these
+        if other._column_names != self._column_names:
+            raise ValueError(f"Can't merge the grouped stats of {other._column_names} into {self._column_names}")
+
+        n_other = len(other.get_keys())
+        codes = self._encoder.encode_keys(keys=other.get_keys())
+        self.grow()
+        n_groups = self._counts.shape[1]
+
+        for n_column in range(len(self._column_names)):
+            counts, means, m2s = np.zeros(n_groups, dtype=np.int64), np.zeros(n_groups), np.zeros(n_groups)
+            counts[codes] = other._counts[n_column, :n_other]
+            means[codes] = other._means[n_column, :n_other]
+            m2s[codes] = other._m2s[n_column, :n_other]
+
+            self.update_moments(n_column=n_column, counts=counts, means=means, m2s=m2s)
+            np.minimum.at(self._mins[n_column], codes, other._mins[n_column, :n_other])
+            np.maximum.at(self._maxs[n_column], codes, other._maxs[n_column, :n_other])
+
+        return self
+
+    def get_stats(self) -> Dict[Any, Dict[str, Dict]]:
+        """
+        Nested result: group key -> column name -> stats, in the order of the keys
+
+        {'France': {'UnitPrice': {'count': 1805, 'min': 0.04, 'max': 649.5, 'mean': 4.8, 'std': 20.3}, ...}, ...}
+        """
+        stats = dict()
+        for code, key in sorted(enumerate(self.get_keys()), key=lambda item: str(item[1])):
+            stats[key] = dict()
+            for n_column, column_name in enumerate(self._column_names):
+                count = int(self._counts[n_column, code])
+                stats[key][column_name] = {
+                    'count': count,
+                    'min': float(self._mins[n_column, code]) if count > 0 else None,
+                    'max': float(self._maxs[n_column, code]) if count > 0 else None,
+                    'mean': float(self._means[n_column, code]) if count > 0 else None,
+                    'std': float(np.sqrt(self._m2s[n_column, code] / count)) if count > 0 else None
+                }
+
+        return stats
@@ -0,0 +1,106 @@
+from typing import List, Optional, Tuple
+import numpy as np
+
+# keys tracked by default, the error of a total is at most (sum of all values) / capacity
+DEFAULT_CAPACITY = 1000
+
+# number of keys reported by default
+DEFAULT_TOP_K = 20
+
+
+class TopK:
+    """
+    Keys with the largest totals of a non negative value, e.g. the products with the most revenue, in bounded
+    memory (weighted Space-Saving, Metwally et al. 2005, merged as in Agarwal et al. 2012)
+
+    At most `capacity` keys are tracked, each with an estimate of its total and the most the estimate can be over
+    the true total (`total - error <= true total <= total`). A key that isn't tracked has a true total of at most
+    `get_floor()`, the smallest tracked total once all the slots are taken, and no total is off by more than
+    `(sum of all values) / capacity`. With `capacity=None` every key is tracked and the totals are exact, for data
+    with few enough keys.
+
+    A batch is first summed per key (vectorized), and the batch totals are merged into the tracked ones like two
+    summaries: the totals of a key add up, a summary that doesn't track a key counts it at its floor (with the same
+    error), and only the `capacity` largest totals are kept. Summaries of the parts of a file or of several files
+    merge the same way.
+    """
+    def __init__(self, capacity: Optional[int] = DEFAULT_CAPACITY) -> None:
+        if capacity is not None and capacity < 1:
+            raise ValueError(f"A top-k summary needs a capacity of at least 1, not {capacity}")
+
+        self._capacity = capacity
+        self._keys = np.empty(0, dtype=object)
+        self._totals = np.empty(0, dtype=np.float64)
+        self._errors = np.empty(0, dtype=np.float64)
+
+    def get_capacity(self) -> Optional[int]:
+        return self._capacity
+
+    def is_exact(self) -> bool:
+        return self._capacity is None
+
+    def get_floor(self) -> float:
+        # largest possible true total of a key that isn't tracked
+        if self._capacity is None or len(self._keys) < self._capacity:
+            return 0.0
+
+        return float(self._totals.min())
+
+    def update(self, keys: np.ndarray, vals: np.ndarray) -> None:
+        # NaN values are left out like in `GroupBy`
+        vals = np.nan_to_num(np.asarray(vals, dtype=np.float64), nan=0.0)
+        if len(vals) == 0:
+            return
+        if vals.min() < 0:
+            raise ValueError("A top-k summary only adds up non negative values")
+
+        unique_keys, inverse = np.unique(np.asarray(keys, dtype=object), return_inverse=True)
+        totals = np.bincount(inverse, weights=vals, minlength=len(unique_keys))
+
+        self.add_summary(keys=unique_keys, totals=totals, errors=np.zeros(len(unique_keys)), floor=0.0)
+
+    def merge(self, other: 'TopK') -> 'TopK':
+        if other._capacity != self._capacity:
+            raise ValueError(f"Can't merge a top-k summary of capacity {other._capacity} "
+                             f"into one of capacity {self._capacity}")
+
+        self.add_summary(keys=other._keys, totals=other._totals, errors=other._errors, floor=other.get_floor())
+        return self
+
+    def add_summary(self, keys: np.ndarray, totals: np.ndarray, errors: np.ndarray, floor: float) -> None:
+        own_floor = self.get_floor()
+
+        unique_keys, inverse = np.unique(np.concatenate([self._keys, keys]), return_inverse=True)
+        own, other = inverse[:len(self._keys)], inverse[len(self._keys):]
+
+        # a key missing from a summary counts at that summary's floor, which is also as far off as it can be
+        own_totals, own_errors = np.full(len(unique_keys), own_floor), np.full(len(unique_keys), own_floor)
+        own_totals[own], own_errors[own] = self._totals, self._errors
+        other_totals, other_errors = np.full(len(unique_keys), floor), np.full(len(unique_keys), floor)
+        other_totals[other], other_errors[other] = totals, errors
+
+        merged_totals, merged_errors = own_totals + other_totals, own_errors + other_errors
+
+        if self._capacity is not None and len(unique_keys) > self._capacity:
+            kept = np.argpartition(-merged_totals, self._capacity - 1)[:self._capacity]
+            unique_keys, merged_totals, merged_errors = unique_keys[kept], merged_totals[kept], merged_errors[kept]
+
+        self._keys, self._totals, self._errors = unique_keys, merged_totals, merged_errors
+
+    def get_top(self, k: int = DEFAULT_TOP_K) -> List[Tuple[str, float, float]]:
+        """
+        (key, total, error) of the `k` keys with the largest totals, largest first. The true total of a key lies
+        between `total - error` and `total`, the error is always 0 in the exact mode.
+        """
+        order = np.argsort(-self._totals, kind='stable')[:k]
+
+        return [(key, float(total), float(error))
+                for key, total, error in zip(self._keys[order].tolist(), self._totals[order].tolist(),
+                                             self._errors[order].tolist())]
+
+    def get_guaranteed_top(self, k: int = DEFAULT_TOP_K) -> List[str]:
+        # keys of the top `k` certain to be among the true top `k`, whatever the errors hide
+        totals = np.sort(self._totals)[::-1]
+        threshold = max(float(totals[k]) if len(totals) > k else 0.0, self.get_floor())
+
+        return [key for key, total, error in self.get_top(k=k) if total - error >= threshold]
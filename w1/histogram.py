@@ -0,0 +1,68 @@
+from typing import List, Tuple
+import numpy as np
+
+# buckets per power of ten of the log-scaled histograms
+DEFAULT_BUCKETS_PER_DECADE = 4
+
+
+class Histogram:
+    """
+    Streaming histogram over fixed bucket edges, its memory is one count per bucket however many values it is fed
+
+    `Histogram.fixed(low=0, high=100, n_buckets=20)` has buckets of the same width, `Histogram.log(low=0.001,
+    high=1e6)` buckets of the same width on a log scale, which suits skewed values like prices. Values below the
+    first edge or at/above the last one are counted in an underflow and an overflow bucket, so no value is lost.
+    A batch goes in with one `np.searchsorted` and one `np.bincount`, and histograms with the same edges merge by
+    adding their counts (e.g. the histograms of the parts of a file or of several files).
+    """
+    def __init__(self, edges: np.ndarray) -> None:
+        edges = np.asarray(edges, dtype=np.float64)
+        if len(edges) < 2 or not np.all(np.diff(edges) > 0):
+            raise ValueError(f"A histogram needs at least 2 increasing edges, not {edges}")
+
+        self._edges = edges
+        # underflow, one count per bucket, overflow
+        self._counts = np.zeros(len(edges) + 1, dtype=np.int64)
+
+    @classmethod
+    def fixed(cls, low: float, high: float, n_buckets: int) -> 'Histogram':
+        return cls(edges=np.linspace(low, high, n_buckets + 1))
+
+    @classmethod
+    def log(cls, low: float = 1e-3, high: float = 1e6,
+            buckets_per_decade: int = DEFAULT_BUCKETS_PER_DECADE) -> 'Histogram':
+        if low <= 0:
+            raise ValueError(f"The log-scaled buckets need low > 0, not {low}")
+
+        n_buckets = max(int(np.ceil(np.log10(high / low) * buckets_per_decade)), 1)
+        return cls(edges=np.logspace(np.log10(low), np.log10(high), n_buckets + 1))
+
+    def get_empty(self) -> 'Histogram':
+        # histogram with the same buckets and no values
+        return Histogram(edges=self._edges)
+
+    def get_edges(self) -> np.ndarray:
+        return self._edges
+
+    def get_counts(self) -> np.ndarray:
+        return self._counts
+
+    def update(self, vals: np.ndarray) -> None:
+        # `vals` must not hold NaN
+        positions = np.searchsorted(self._edges, vals, side='right')
+        self._counts += np.bincount(positions, minlength=len(self._counts))
+
+    def merge(self, other: 'Histogram') -> 'Histogram':
+        if not np.array_equal(self._edges, other._edges):
+            raise ValueError("Can't merge histograms with different buckets")
+
+        self._counts += other._counts
+        return self
+
+    def get_buckets(self) -> List[Tuple[float, float, int]]:
+        # (low, high, count) of the buckets holding values, the underflow and overflow buckets reach -inf and inf
+        lows = np.concatenate([[-np.inf], self._edges])
+        highs = np.concatenate([self._edges, [np.inf]])
+
+        return [(float(low), float(high), int(count))
+                for low, high, count in zip(lows, highs, self._counts) if count > 0]
@@ -0,0 +1,108 @@
+import numpy as np
+
+# 2 ** precision one byte registers, 4 KB at the default precision for a relative standard error of about 1.6%
+DEFAULT_PRECISION = 12
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+
+# bits of the hash the rank of a value is read from, kept below the 53 bits a float64 holds exactly
+RANK_BITS = 52
+
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+
+
+def hash_values(vals: np.ndarray) -> np.ndarray:
+    """
+    Deterministic 64 bit hashes of a column batch, the same in every process and run (unlike the salted `hash` of
+    Python), so the distinct counts of separate processes can be merged
+
+    Strings are hashed on the code points of a fixed width unicode copy of the batch, one vectorized FNV-1a step
+    per two characters (the padding past the end of a shorter string is skipped, so the hash doesn't depend on the
+    longest string of the batch). Numbers are hashed on the bits of their float64 value. Both go through the
+    splitmix64 finalizer to spread the bits.
+    """
+    vals = np.asarray(vals)
+    with np.errstate(over='ignore'):
+        if vals.dtype.kind in 'fiub':
+            hashes = vals.astype(np.float64).view(np.uint64).copy()
+        else:
+            vals = vals.astype(str)
+            codes = vals.view(np.uint32).reshape(len(vals), -1)
+            if codes.shape[1] % 2 == 1:
+                codes = np.concatenate([codes, np.zeros((len(vals), 1), dtype=np.uint32)], axis=1)
+
+            # two characters per step
+            codes = np.ascontiguousarray(codes).view(np.uint64)
+            hashes = np.full(len(vals), FNV_OFFSET, dtype=np.uint64)
+            for position in range(codes.shape[1]):
+                code = codes[:, position]
+                hashes = np.where(code != 0, (hashes ^ code) * FNV_PRIME, hashes)
+
+        hashes ^= hashes >> np.uint64(30)
+        hashes *= np.uint64(0xbf58476d1ce4e5b9)
+        hashes ^= hashes >> np.uint64(27)
+        hashes *= np.uint64(0x94d049bb133111eb)
+        hashes ^= hashes >> np.uint64(31)
+
+    return hashes
+
+
+class HyperLogLog:
+    """
+    Approximate count of the distinct values of a column (Flajolet et al. 2007) in `2 ** precision` bytes however
+    many values it is fed
+
+    The top `precision` bits of the hash of a value pick a register, which keeps the longest run of leading zeros
+    seen in the other bits. The count is estimated from the harmonic mean of the registers (with linear counting
+    while many registers are still empty), its relative standard error is about `1.04 / sqrt(2 ** precision)`.
+    Counters of the same precision merge by keeping the larger register, e.g. the counters of the parts of a file,
+    of several files or of `w2` worker processes.
+    """
+    def __init__(self, precision: int = DEFAULT_PRECISION) -> None:
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f"The precision of a HyperLogLog goes from {MIN_PRECISION} to {MAX_PRECISION}, "
+                             f"not {precision}")
+
+        self._precision = precision
+        self._registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def get_precision(self) -> int:
+        return self._precision
+
+    def get_error(self) -> float:
+        # relative standard error of the count
+        return 1.04 / np.sqrt(len(self._registers))
+
+    def update(self, vals: np.ndarray) -> None:
+        if len(vals) == 0:
+            return
+
+        hashes = hash_values(vals=vals)
+        indexes = (hashes >> np.uint64(64 - self._precision)).astype(np.int64)
+
+        # leading zeros of the bits below the index, counted on (at most) their first RANK_BITS
+        n_bits = min(64 - self._precision, RANK_BITS)
+        rest = (hashes >> np.uint64(64 - self._precision - n_bits)) & np.uint64((1 << n_bits) - 1)
+        ranks = n_bits - np.frexp(rest.astype(np.float64))[1] + 1
+
+        np.maximum.at(self._registers, indexes, ranks.astype(np.uint8))
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        if other._precision != self._precision:
+            raise ValueError(f"Can't merge a HyperLogLog of precision {other._precision} "
+                             f"into one of precision {self._precision}")
+
+        np.maximum(self._registers, other._registers, out=self._registers)
+        return self
+
+    def get_count(self) -> int:
+        n_registers = len(self._registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(n_registers, 0.7213 / (1 + 1.079 / n_registers))
+        estimate = alpha * n_registers ** 2 / np.sum(np.ldexp(1.0, -self._registers.astype(np.int64)))
+
+        n_zeros = int(np.count_nonzero(self._registers == 0))
+        if estimate <= 2.5 * n_registers and n_zeros > 0:
+            estimate = n_registers * np.log(n_registers / n_zeros)
+
+        return int(round(estimate))
@@ -0,0 +1,97 @@
+from typing import Dict, Optional, Tuple
+from w1.plan import Consumer
+import hashlib
+import pickle
+import os
+
+# bump when the layout of the state file changes, older states are then ignored and the file is scanned again
+STATE_VERSION = 1
+
+# bytes of the file hashed at its start and right before the saved offset, to tell an append from a rewrite
+FINGERPRINT_BYTES = 1 << 12
+
+# bytes read at once when looking for the last new line of a file
+TAIL_BLOCK_BYTES = 1 << 16
+
+
+class PlanState:
+    """
+    Saved progress of a scan plan over a file that only grows, kept in the hidden file
+    `.<file name>.<name>.state.pkl` next to it (see `DataProcessor.run_plan(state_name=...)`)
+
+    Holds the consumers of the plan as they were at the end of the last run together with the byte offset the run
+    stopped at, i.e. the end of the last complete row. A new run restores the consumers and only feeds them the rows
+    appended since. The state is dropped (and the file scanned from the start) when the plan changed, or when the
+    file no longer starts with the bytes it was saved with (the file was rewritten or truncated).
+    """
+    def __init__(self, fp: str, name: str) -> None:
+        self._fp = fp
+
+        folder_path, file_name = os.path.split(os.path.abspath(fp))
+        self._path = os.path.join(folder_path, f'.{file_name}.{name}.state.pkl')
+
+    def get_path(self) -> str:
+        return self._path
+
+    def load(self, signature: Dict) -> Optional[Tuple[int, Dict[str, Consumer]]]:
+        # offset and consumers of the last run, None when there is no usable state
+        try:
+            with open(self._path, 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+
+        if state.get('version') != STATE_VERSION or state.get('signature') != signature:
+            return None
+
+        if state['fingerprint'] != self.get_fingerprint(offset=state['offset']):
+            return None
+
+        return state['offset'], state['consumers']
+
+    def save(self, signature: Dict, offset: int, consumers: Dict[str, Consumer]) -> None:
+        state = {
+            'version': STATE_VERSION,
+            'signature': signature,
+            'offset': offset,
+            'fingerprint': self.get_fingerprint(offset=offset),
+            'consumers': consumers
+        }
+
+        tmp_path = f'{self._path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path)
+
+    def get_fingerprint(self, offset: int) -> Optional[str]:
+        # hash of the first bytes and of the bytes before `offset`, None when the file is shorter than `offset`
+        with open(self._fp, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < offset:
+                return None
+
+            fingerprint = hashlib.sha1(f.read(min(offset, FINGERPRINT_BYTES)))
+            f.seek(max(offset - FINGERPRINT_BYTES, 0))
+            fingerprint.update(f.read(min(offset, FINGERPRINT_BYTES)))
+
+        return fingerprint.hexdigest()
+
+    def get_complete_end(self, start: int) -> int:
+        """
+        Offset right after the last new line of the file, rows past it may still be in the middle of being written
+        and are left for the next run. Returns `start` when no new line follows it.
+        """
+        with open(self._fp, 'rb') as f:
+            end = os.fstat(f.fileno()).st_size
+
+            while end > start:
+                block_start = max(end - TAIL_BLOCK_BYTES, start)
+                f.seek(block_start)
+                block = f.read(end - block_start)
+
+                last_new_line = block.rfind(b'\n')
+                if last_new_line != -1:
+                    return block_start + last_new_line + 1
+
+                end = block_start
+
+        return start
@@ -0,0 +1,82 @@
+from typing import Any, Dict, List
+import numpy as np
+
+# groups the accumulators have room for at first, they double when full
+INITIAL_GROUPS = 16
+
+# largest number of key combinations a batch of several key columns can be encoded into as one int64 per row
+MAX_COMBINED_KEYS = 1 << 62
+
+
+def grow(vals: np.ndarray, capacity: int, fill: float = 0) -> np.ndarray:
+    # (column x group) accumulator with room for `capacity` groups, the new groups start at `fill`
+    n_more = capacity - vals.shape[1]
+    if n_more <= 0:
+        return vals
+
+    return np.pad(vals, ((0, 0), (0, n_more)), constant_values=fill)
+
+
+class KeyEncoder:
+    """
+    Dictionary encoding of the group keys of a group-by (see `GroupBy` and `GroupedStats`): every distinct key (a
+    tuple with several key columns) gets the next group code the first time it is seen, so the accumulators of the
+    groups can be arrays indexed by code. `get_capacity` is the number of groups the accumulators should have room
+    for, it doubles when the groups outgrow it (see `grow`).
+
+    The rows of a batch are encoded with one `np.unique` per key column, the Python work grows with the distinct
+    keys of the batch, not its rows.
+    """
+    def __init__(self) -> None:
+        self._codes: Dict[Any, int] = dict()
+        self._keys: List[Any] = []
+        self._capacity = INITIAL_GROUPS
+
+    def get_keys(self) -> List[Any]:
+        return self._keys
+
+    def get_capacity(self) -> int:
+        return self._capacity
+
+    def encode(self, key_columns: List[np.ndarray]) -> np.ndarray:
+        # group code of every row, new keys get the next codes. Keys already in a fixed width array (e.g. the
+        # months of `to_month`) are sorted as such, which is a few times faster than sorting them as objects.
+        if len(key_columns) == 1:
+            unique_keys, inverse = np.unique(np.asarray(key_columns[0]), return_inverse=True)
+            return self.encode_keys(keys=unique_keys.tolist())[inverse.reshape(-1)]
+
+        column_keys, column_inverses = [], []
+        for keys in key_columns:
+            column_unique, column_inverse = np.unique(np.asarray(keys), return_inverse=True)
+            column_keys.append(column_unique.tolist())
+            column_inverses.append(column_inverse.reshape(-1))
+
+        if np.prod([float(len(keys)) for keys in column_keys]) < MAX_COMBINED_KEYS:
+            # the codes of the columns combined into one integer per row
+            combined = np.zeros(len(column_inverses[0]), dtype=np.int64)
+            for keys, column_inverse in zip(column_keys, column_inverses):
+                combined = combined * len(keys) + column_inverse
+            _, first_rows, inverse = np.unique(combined, return_index=True, return_inverse=True)
+        else:
+            # too many combinations for an int64, the rows of codes are compared instead
+            _, first_rows, inverse = np.unique(np.column_stack(column_inverses), axis=0, return_index=True,
+                                               return_inverse=True)
+
+        # only the distinct combinations become tuples
+        unique_keys = list(zip(*[[keys[code] for code in column_inverse[first_rows].tolist()]
+                                 for keys, column_inverse in zip(column_keys, column_inverses)]))
+        return self.encode_keys(keys=unique_keys)[inverse.reshape(-1)]
+
+    def encode_keys(self, keys: List[Any]) -> np.ndarray:
+        # group code of every distinct key, new keys get the next codes
+        key_codes = np.empty(len(keys), dtype=np.int64)
+        for n_key, key in enumerate(keys):
+            if key not in self._codes:
+                self._codes[key] = len(self._keys)
+                self._keys.append(key)
+            key_codes[n_key] = self._codes[key]
+
+        while self._capacity < len(self._keys):
+            self._capacity *= 2
+
+        return key_codes
@@ -1,8 +1,10 @@
 import constants
 from w1.data_processor import DataProcessor
+from w1.predicates import Predicate
+from w1.plan import get_sales_consumers
+from w1.utils import SKETCH_STATS
 from pprint import pprint
-from typing import Dict
-from tqdm import tqdm
+from typing import Dict, List, Union
 import os
 import argparse
 from global_utils import get_file_name, make_dir, plot_sales_data
@@ -13,7 +15,7 @@ import json
 CURRENT_FOLDER_NAME = os.path.dirname(os.path.abspath(__file__))
 
 
-def revenue_per_region(dp: DataProcessor) -> Dict:
+def revenue_per_region(dp: DataProcessor, where: Union[Predicate, List[Predicate], None] = None) -> Dict:
     """
     Input : object of instance type Class DataProcessor
     Output : Dict
@@ -42,37 +44,33 @@ def revenue_per_region(dp: DataProcessor) -> Dict:
         'United Kingdom': 29.05,
         'United States': 121.499
     }
-    """
-    ######################################## YOUR CODE HERE ##################################################
-    data_reader = #### [YOUR CODE HERE] ####
-    data_reader_gen = #### [YOUR CODE HERE] ####
-
-    # skip first row as it is the column name
-    _ = next(data_reader_gen)
 
-    # initialize the aggregate variable
-    aggregate = dict()
+    With `where` only the rows matching the predicates are counted, e.g. the revenue per region in Q3:
+    where=Between('Date', low='2015/07/01', high='2015/09/30')
+    """
+    revenue = dp.compute_group_by(group_by=constants.OutDataColNames.COUNTRY, where=where,
+                                  aggregates={'revenue': ('sum', constants.OutDataColNames.TOTAL_PRICE)})
 
-    for row in tqdm(data_reader_gen):
-        if row[constants.OutDataColNames.COUNTRY] not in aggregate:
-            aggregate[row[constants.OutDataColNames.COUNTRY]] = #### [YOUR CODE HERE] ####
-        aggregate[row[constants.OutDataColNames.COUNTRY]] += #### [YOUR CODE HERE] ####
+    return revenue.get_aggregate(name='revenue')
 
-    return aggregate
-    ######################################## YOUR CODE HERE ##################################################
 
+def get_sales_information(file_path: str, incremental: bool = False, use_cache: bool = False) -> Dict:
+    # Initialize - an incremental run only reads the rows appended since the last one, building the cache or counting
+    # the rows would read the whole file again
+    dp = DataProcessor(file_path=file_path, use_cache=use_cache and not incremental, estimate_rows=incremental)
 
-def get_sales_information(file_path: str) -> Dict:
-    # Initialize
-    dp = DataProcessor(file_path=file_path)
+    # stats, total revenue and revenue per region from a single scan of the file. The state of an incremental run is
+    # saved and loaded every time, its stats are sketches (approximate percentiles) so it stays small.
+    consumers = get_sales_consumers(stats_mode=SKETCH_STATS) if incremental else get_sales_consumers()
+    results = dp.run_plan(state_name='sales_information' if incremental else None, consumers=consumers)
 
     # print stats
-    dp.describe(column_names=[constants.OutDataColNames.UNIT_PRICE, constants.OutDataColNames.TOTAL_PRICE])
+    dp.print_stats(stats=results['stats'])
 
     # return total revenue and revenue per region
     return {
-        'total_revenue': dp.aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE),
-        'revenue_per_region': revenue_per_region(dp),
+        'total_revenue': results['total_revenue'],
+        'revenue_per_region': results['revenue_per_region'],
         'file_name': get_file_name(file_path)
     }
 
@@ -83,17 +81,25 @@ def main():
                         default='tst',
                         choices=['tst', 'sml', 'bg'],
                         help='Type of data to generate')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='Only process the rows appended to the files since the last incremental run, the '
+                             'percentiles are then approximate')
+    parser.add_argument('--cache', action='store_true',
+                        help='Parse every file into a columnar cache next to it (once), later runs read the cache. '
+                             'Not used by incremental runs')
     args = parser.parse_args()
 
     data_folder_path = os.path.join(CURRENT_FOLDER_NAME, '..', constants.DATA_FOLDER_NAME, args.type)
-    files = [str(file) for file in os.listdir(data_folder_path) if str(file).endswith('csv')]
+    files = [str(file) for file in os.listdir(data_folder_path)
+             if str(file).endswith(constants.DATA_FILE_EXTENSIONS)]
 
     output_save_folder = os.path.join(CURRENT_FOLDER_NAME, '..', 'output', args.type,
                                       datetime.now().strftime("%B %d %Y %H-%M-%S"))
     make_dir(output_save_folder)
 
     file_paths = [os.path.join(data_folder_path, file_name) for file_name in files]
-    revenue_data = [get_sales_information(file_path)
+    revenue_data = [get_sales_information(file_path, incremental=args.incremental, use_cache=args.cache)
                     for file_path in file_paths]
 
     pprint(revenue_data)
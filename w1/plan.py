@@ -0,0 +1,194 @@
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Union
+from w1.utils import Stats, EXACT_STATS
+from w1.sketch import DEFAULT_SKETCH_K
+from w1.histogram import Histogram
+from w1.hyperloglog import HyperLogLog, DEFAULT_PRECISION
+from w1.heavy_hitters import TopK, DEFAULT_CAPACITY
+from w1.grouped_stats import GroupedStats
+from w1.group_by import GroupBy
+from abc import ABC, abstractmethod
+import numpy as np
+import constants
+
+
+class Consumer(ABC):
+    """
+    One computation of a fused scan plan (see `DataProcessor.run_plan`). The plan reads the union of the columns
+    of its consumers once and hands every column batch to each consumer in turn.
+    """
+    @abstractmethod
+    def get_columns(self) -> List[str]:
+        ...
+
+    @abstractmethod
+    def update(self, batch: Mapping[str, np.ndarray]) -> None:
+        ...
+
+    @abstractmethod
+    def get_result(self) -> Any:
+        ...
+
+    def get_signature(self) -> List:
+        # what the result depends on besides the rows, a saved state is only reused for the same signature
+        return [type(self).__name__, self.get_columns()]
+
+    def has_bounded_state(self) -> bool:
+        # whether the state of the consumer stays small however many rows it sees (at most one entry per key)
+        return True
+
+
+class StatsConsumer(Consumer):
+    # same output as `DataProcessor.compute_stats`
+    def __init__(self, column_names: List[str], mode: str = EXACT_STATS, sketch_k: int = DEFAULT_SKETCH_K,
+                 histogram: Optional[Histogram] = None) -> None:
+        self._column_names = column_names
+        self._mode = mode
+        self._sketch_k = sketch_k
+        self._histogram = histogram
+        self._stats = {name: Stats(mode=mode, sketch_k=sketch_k, histogram=histogram) for name in column_names}
+
+    def get_columns(self) -> List[str]:
+        return self._column_names
+
+    def get_signature(self) -> List:
+        edges = None if self._histogram is None else self._histogram.get_edges().tolist()
+        return super().get_signature() + [self._mode, self._sketch_k, edges]
+
+    def has_bounded_state(self) -> bool:
+        # exact stats keep every value
+        return self._mode != EXACT_STATS
+
+    def update(self, batch: Mapping[str, np.ndarray]) -> None:
+        for column_name in self._column_names:
+            self._stats[column_name].update_batch(vals=batch[column_name])
+
+    def get_result(self) -> Dict[str, Stats]:
+        return self._stats
+
+
+class SumConsumer(Consumer):
+    # same output as `DataProcessor.aggregate`
+    def __init__(self, column_name: str) -> None:
+        self._column_name = column_name
+        self._total = 0
+
+    def get_columns(self) -> List[str]:
+        return [self._column_name]
+
+    def update(self, batch: Mapping[str, np.ndarray]) -> None:
+        # NaN marks the values that couldn't be converted to float, nansum leaves them out
+        self._total += float(np.nansum(batch[self._column_name]))
+
+    def get_result(self) -> float:
+        return self._total
+
+
+class SumByKeyConsumer(Consumer):
+    # sum of `val_column` per distinct value of `key_column`, e.g. the revenue per region
+    def __init__(self, key_column: str, val_column: str) -> None:
+        self._key_column = key_column
+        self._val_column = val_column
+        self._group_by = GroupBy(group_by=key_column, aggregates={'total': ('sum', val_column)})
+
+    def get_columns(self) -> List[str]:
+        return [self._key_column, self._val_column]
+
+    def update(self, batch: Mapping[str, np.ndarray]) -> None:
+        self._group_by.update_batch(batch=batch)
+
+    def get_result(self) -> Dict[str, float]:
+        return self._group_by.get_aggregate(name='total')
+
+
+class DistinctCountConsumer(Consumer):
+    # approximate number of distinct values of every column, see `HyperLogLog`
+    def __init__(self, column_names: List[str], precision: int = DEFAULT_PRECISION) -> None:
+        self._column_names = column_names
+        self._precision = precision
+        self._counters = {name: HyperLogLog(precision=precision) for name in column_names}
+
+    def get_columns(self) -> List[str]:
+        return self._column_names
+
+    def get_signature(self) -> List:
+        return super().get_signature() + [self._precision]
+
+    def update(self, batch: Mapping[str, np.ndarray]) -> None:
+        for column_name in self._column_names:
+            self._counters[column_name].update(vals=batch[column_name])
+
+    def get_result(self) -> Dict[str, HyperLogLog]:
+        return self._counters
+
+
+class TopKConsumer(Consumer):
+    # keys with the largest totals of `val_column`, e.g. the products with the most revenue, see `TopK`
+    def __init__(self, key_column: str, val_column: str, capacity: Optional[int] = DEFAULT_CAPACITY) -> None:
+        self._key_column = key_column
+        self._val_column = val_column
+        self._top = TopK(capacity=capacity)
+
+    def get_columns(self) -> List[str]:
+        return [self._key_column, self._val_column]
+
+    def get_signature(self) -> List:
+        return super().get_signature() + [self._top.get_capacity()]
+
+    def update(self, batch: Mapping[str, np.ndarray]) -> None:
+        self._top.update(keys=batch[self._key_column], vals=batch[self._val_column])
+
+    def get_result(self) -> TopK:
+        return self._top
+
+
+class GroupedStatsConsumer(Consumer):
+    # same output as `DataProcessor.compute_grouped_stats` (without a `group_key`)
+    def __init__(self, column_names: List[str], group_by: str) -> None:
+        self._column_names = column_names
+        self._group_by = group_by
+        self._grouped_stats = GroupedStats(column_names=column_names)
+
+    def get_columns(self) -> List[str]:
+        return list(dict.fromkeys(self._column_names + [self._group_by]))
+
+    def get_signature(self) -> List:
+        return super().get_signature() + [self._column_names, self._group_by]
+
+    def update(self, batch: Mapping[str, np.ndarray]) -> None:
+        self._grouped_stats.update_batch(keys=batch[self._group_by], batch=batch)
+
+    def get_result(self) -> GroupedStats:
+        return self._grouped_stats
+
+
+class GroupByConsumer(Consumer):
+    # same output as `DataProcessor.compute_group_by`
+    def __init__(self, group_by: Union[str, List[str]], aggregates: Dict[str, Tuple[str, str]],
+                 group_keys: Optional[Dict[str, Callable[[np.ndarray], np.ndarray]]] = None) -> None:
+        self._group_by = GroupBy(group_by=group_by, aggregates=aggregates, group_keys=group_keys)
+
+    def get_columns(self) -> List[str]:
+        return self._group_by.get_columns()
+
+    def get_signature(self) -> List:
+        # the key functions by their qualified name, the functions themselves can't be compared
+        group_keys = {name: f'{func.__module__}.{func.__qualname__}'
+                      for name, func in self._group_by.get_group_keys().items()}
+        return super().get_signature() + [self._group_by.get_group_by(), self._group_by.get_aggregates(), group_keys]
+
+    def update(self, batch: Mapping[str, np.ndarray]) -> None:
+        self._group_by.update_batch(batch=batch)
+
+    def get_result(self) -> GroupBy:
+        return self._group_by
+
+
+def get_sales_consumers(stats_mode: str = EXACT_STATS) -> Dict[str, Consumer]:
+    # the plan of every `get_sales_information`: stats of the prices, total revenue and revenue per region
+    return {
+        'stats': StatsConsumer(column_names=[constants.OutDataColNames.UNIT_PRICE,
+                                             constants.OutDataColNames.TOTAL_PRICE], mode=stats_mode),
+        'total_revenue': SumConsumer(column_name=constants.OutDataColNames.TOTAL_PRICE),
+        'revenue_per_region': SumByKeyConsumer(key_column=constants.OutDataColNames.COUNTRY,
+                                               val_column=constants.OutDataColNames.TOTAL_PRICE)
+    }
@@ -0,0 +1,137 @@
+from typing import Any, List, Optional, Sequence, Union
+from abc import ABC, abstractmethod
+from datetime import date
+import numpy as np
+import constants
+
+
+class Predicate(ABC):
+    """
+    Row filter on one column, see `DataReader.iter_batches(where=...)`
+
+    A predicate is evaluated on a whole block of values of its column at once. Where the batch allows it the values
+    are the raw utf-8 bytes of a STR column (mmap batches, cache chunks) or its distinct values (dictionary encoded
+    cache chunks), so the column is never decoded, and the other columns are only converted for the rows that match.
+    """
+    def __init__(self, column: str) -> None:
+        self.column = column
+
+    @abstractmethod
+    def evaluate(self, vals: np.ndarray) -> np.ndarray:
+        # boolean mask of the values that match
+        ...
+
+    def get_needles(self) -> Optional[List[str]]:
+        # text a raw line has to hold at least one of to possibly match, lines without any are dropped unparsed. Only
+        # used on the columns whose values are their raw text (see `ColumnConverter.keeps_raw_values`), the text of
+        # a number can be written in many ways.
+        return None
+
+    def may_match_range(self, low: Any, high: Any) -> bool:
+        # whether a block of values with this min/max can hold a match, see `ZoneMap`
+        return True
+
+    @staticmethod
+    def to_bound_kind(val: Any, bound: Any) -> Any:
+        # the value to compare with a float or str min/max
+        if isinstance(val, date):
+            val = val.strftime(constants.DATE_FORMAT)
+
+        return float(val) if isinstance(bound, float) else str(val)
+
+    @staticmethod
+    def to_kind(val: Any, vals: np.ndarray) -> Any:
+        # the value to compare with in the representation of `vals`
+        if isinstance(val, date):
+            val = val.strftime(constants.DATE_FORMAT)
+
+        if vals.dtype.kind == 'S':
+            return str(val).encode()
+        if vals.dtype.kind == 'f':
+            return float(val)
+
+        return val
+
+
+class Eq(Predicate):
+    """
+    Eq(column='Country', value='Germany')
+    """
+    def __init__(self, column: str, value: Any) -> None:
+        super().__init__(column=column)
+        self.value = value
+
+    def evaluate(self, vals: np.ndarray) -> np.ndarray:
+        return np.asarray(vals == self.to_kind(val=self.value, vals=vals), dtype=bool)
+
+    def may_match_range(self, low: Any, high: Any) -> bool:
+        return low <= self.to_bound_kind(val=self.value, bound=low) <= high
+
+    def get_needles(self) -> Optional[List[str]]:
+        if not isinstance(self.value, str) or constants.QUOTE_CHAR in self.value:
+            return None
+
+        return [self.value]
+
+
+class In(Predicate):
+    """
+    In(column='StockCode', values=['22180', '23017'])
+    """
+    def __init__(self, column: str, values: Sequence[Any]) -> None:
+        super().__init__(column=column)
+        self.values = list(values)
+
+    def evaluate(self, vals: np.ndarray) -> np.ndarray:
+        return np.isin(vals, [self.to_kind(val=val, vals=vals) for val in self.values])
+
+    def may_match_range(self, low: Any, high: Any) -> bool:
+        return any([low <= self.to_bound_kind(val=val, bound=low) <= high for val in self.values])
+
+    def get_needles(self) -> Optional[List[str]]:
+        if not all([isinstance(val, str) and constants.QUOTE_CHAR not in val for val in self.values]):
+            return None
+
+        return self.values
+
+
+class Between(Predicate):
+    """
+    Values inside [low, high], either bound can be left out
+
+    Between(column='Date', low='2015/07/01', high='2015/09/30')
+    Between(column='UnitPrice', low=10)
+
+    Dates can be given as `datetime.date` or as str in `constants.DATE_FORMAT`, which sorts like the dates it holds.
+    """
+    def __init__(self, column: str, low: Optional[Any] = None, high: Optional[Any] = None) -> None:
+        super().__init__(column=column)
+        self.low = low
+        self.high = high
+
+    def evaluate(self, vals: np.ndarray) -> np.ndarray:
+        mask = np.ones(len(vals), dtype=bool)
+        if self.low is not None:
+            mask &= np.asarray(vals >= self.to_kind(val=self.low, vals=vals), dtype=bool)
+        if self.high is not None:
+            mask &= np.asarray(vals <= self.to_kind(val=self.high, vals=vals), dtype=bool)
+
+        return mask
+
+    def may_match_range(self, low: Any, high: Any) -> bool:
+        if self.low is not None and self.to_bound_kind(val=self.low, bound=low) > high:
+            return False
+        if self.high is not None and self.to_bound_kind(val=self.high, bound=high) < low:
+            return False
+
+        return True
+
+
+def to_predicates(where: Union[Predicate, Sequence[Predicate], None]) -> List[Predicate]:
+    # `where` is a single predicate or a list of predicates that all have to match
+    if where is None:
+        return []
+    if isinstance(where, Predicate):
+        return [where]
+
+    return list(where)
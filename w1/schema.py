@@ -0,0 +1,172 @@
+from typing import Dict, List, Sequence, Union
+import numpy as np
+import constants
+
+# column types
+FLOAT = 'float'
+STR = 'str'
+
+# what to do with a value that can't be converted to the column type
+NULL = 'null'  # replace it with NaN (str columns keep the empty value)
+DEFAULT = 'default'  # replace it with the default value of the column
+RAISE = 'raise'  # stop reading the file with a ValueError
+
+# a block with bad values in it is halved until its parts convert in one go, parts of at most this many values
+# are converted value by value
+MIN_SPLIT_VALUES = 32
+
+
+class ColumnSchema:
+    def __init__(self, name: str, dtype: str = STR, nullable: bool = True, on_error: str = NULL,
+                 default: Union[float, str, None] = None) -> None:
+        """
+        :param name: name of the column in the column names row
+        :param dtype: FLOAT (converted to float64) or STR (kept as str)
+        :param nullable: whether an empty value is allowed, an empty value in a non nullable column is a bad value
+        :param on_error: NULL, DEFAULT or RAISE - what to do with a bad value
+        :param default: value used in place of bad values with DEFAULT
+        """
+        if dtype not in (FLOAT, STR):
+            raise ValueError(f"Unknown dtype {dtype} for column {name}")
+        if on_error not in (NULL, DEFAULT, RAISE):
+            raise ValueError(f"Unknown bad value policy {on_error} for column {name}")
+        if on_error == DEFAULT and default is None:
+            raise ValueError(f"Column {name} replaces bad values with its default but has no default")
+
+        self.name = name
+        self.dtype = dtype
+        self.nullable = nullable
+        self.on_error = on_error
+        self.default = default
+
+    def compile(self) -> 'ColumnConverter':
+        return ColumnConverter(column=self)
+
+    def describe(self) -> Dict:
+        return {'dtype': self.dtype, 'nullable': self.nullable, 'on_error': self.on_error, 'default': self.default}
+
+
+class ColumnConverter:
+    """
+    Converts whole blocks of values of one column (a sequence of str, or a numpy bytes array in mmap mode) at once
+    and keeps count of the bad values it found, instead of running a try/except per value. A value of a FLOAT column
+    is good when it converts to a finite float, 'nan' or 'inf' in the file are bad values like any other text.
+    """
+    def __init__(self, column: ColumnSchema) -> None:
+        self._column = column
+        self.n_rejected = 0
+
+    def __call__(self, vals: Union[Sequence[str], np.ndarray]) -> np.ndarray:
+        if self._column.dtype == FLOAT:
+            return self.to_float(vals=vals)
+
+        return self.to_str(vals=vals)
+
+    def to_float(self, vals: Union[Sequence[str], np.ndarray]) -> np.ndarray:
+        try:
+            # fast path - a block without bad values is converted by numpy in one go
+            converted = np.asarray(vals, dtype=np.float64)
+            if np.isfinite(converted).all():
+                return converted
+        except ValueError:
+            converted = None
+
+        vals = np.asarray(vals)
+        is_bytes = vals.dtype.kind == 'S'
+        if converted is None:
+            converted = self.split_to_float(vals=vals)
+
+        is_bad = ~np.isfinite(converted)
+        converted[is_bad] = np.nan
+        if self._column.nullable:
+            # empty values are nulls, not bad values
+            is_bad &= np.char.strip(vals) != (b'' if is_bytes else '')
+
+        return self.handle_bad_values(converted=converted, is_bad=is_bad, vals=vals)
+
+    def split_to_float(self, vals: np.ndarray) -> np.ndarray:
+        # floats of a block with bad values in it, NaN for those. The parts without bad values are still converted by
+        # numpy, only the values of the small parts holding bad ones are converted one at a time.
+        try:
+            return vals.astype(np.float64)
+        except ValueError:
+            pass
+
+        if len(vals) <= MIN_SPLIT_VALUES:
+            return np.array([self.to_float_or_nan(val=val) for val in vals.tolist()], dtype=np.float64)
+
+        middle = len(vals) // 2
+        return np.concatenate([self.split_to_float(vals=vals[:middle]), self.split_to_float(vals=vals[middle:])])
+
+    @staticmethod
+    def to_float_or_nan(val: Union[str, bytes]) -> float:
+        try:
+            return float(val)
+        except ValueError:
+            return np.nan
+
+    def to_str(self, vals: Union[Sequence[str], np.ndarray]) -> np.ndarray:
+        if isinstance(vals, np.ndarray) and vals.dtype.kind == 'S':
+            vals = np.char.decode(vals, 'utf-8')
+
+        converted = np.array(vals, dtype=object)
+        if self._column.nullable:
+            return converted
+
+        return self.handle_bad_values(converted=converted, is_bad=converted == '', vals=converted)
+
+    def keeps_raw_values(self) -> bool:
+        # whether the converted values are the raw values decoded, so a filter can compare the raw bytes instead
+        return self._column.dtype == STR and self._column.on_error != DEFAULT
+
+    def handle_bad_values(self, converted: np.ndarray, is_bad: np.ndarray, vals: np.ndarray) -> np.ndarray:
+        n_bad = int(np.count_nonzero(is_bad))
+        if n_bad == 0:
+            return converted
+
+        self.n_rejected += n_bad
+        if self._column.on_error == RAISE:
+            example = vals[is_bad][:1].tolist()[0]
+            if isinstance(example, bytes):
+                example = example.decode()
+            raise ValueError(f"{n_bad} bad values in column {self._column.name}, for example '{example}'")
+
+        if self._column.on_error == DEFAULT:
+            converted[is_bad] = self._column.default
+
+        return converted
+
+
+class Schema:
+    def __init__(self, columns: List[ColumnSchema]) -> None:
+        self._columns = {column.name: column for column in columns}
+
+    def get_column(self, name: str) -> ColumnSchema:
+        # columns the schema doesn't know about are read as nullable str
+        if name not in self._columns:
+            return ColumnSchema(name=name)
+
+        return self._columns[name]
+
+    def get_dtype(self, name: str) -> str:
+        return self.get_column(name=name).dtype
+
+    def compile(self, col_names: List[str]) -> Dict[str, ColumnConverter]:
+        return {name: self.get_column(name=name).compile() for name in col_names}
+
+    def describe(self, col_names: List[str]) -> Dict[str, Dict]:
+        # plain description of the columns, e.g. to check a cache was parsed with the same schema
+        return {name: self.get_column(name=name).describe() for name in col_names}
+
+
+# schema of the generated sales data files
+SALES_SCHEMA = Schema(columns=[
+    ColumnSchema(name=constants.OutDataColNames.STOCK_CODE, dtype=STR, nullable=False),
+    ColumnSchema(name=constants.OutDataColNames.DESCRIPTION, dtype=STR),
+    ColumnSchema(name=constants.OutDataColNames.UNIT_PRICE, dtype=FLOAT),
+    ColumnSchema(name=constants.OutDataColNames.QUANTITY, dtype=FLOAT),
+    ColumnSchema(name=constants.OutDataColNames.TOTAL_PRICE, dtype=FLOAT),
+    ColumnSchema(name=constants.OutDataColNames.COUNTRY, dtype=STR, nullable=False),
+    ColumnSchema(name=constants.OutDataColNames.INVOICE_NO, dtype=STR, nullable=False),
+    ColumnSchema(name=constants.OutDataColNames.DATE, dtype=STR, nullable=False),
+])
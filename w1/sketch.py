@@ -0,0 +1,148 @@
+from typing import List, Optional
+import numpy as np
+
+# items kept by the top level of a sketch, the rank error shrinks about as 1 / k
+DEFAULT_SKETCH_K = 200
+
+# levels below the top keep 2/3 of the items of the level above them (KLL), so the memory stays about 3 * k
+CAPACITY_RATIO = 2 / 3
+
+# the reported rank error holds with this probability
+ERROR_CONFIDENCE = 0.99
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch (KLL, Karnin, Lang and Liberty 2016) holding about `3 * k` values however many it
+    was fed
+
+    Values enter at level 0, a level holding more than its capacity is sorted and every other value (starting
+    at a random one of the first two) moves up a level, where it stands for twice as many values. A query sorts
+    the values left with their weights. Each such compaction moves the rank of any value by at most the weight of
+    its level, up or down with the same chance, so the variance of the rank error is the sum of the squared
+    weights of all compactions - it is tracked to report an error bound, and adds up when sketches are merged
+    (e.g. the sketches of the parts of a file or of several files).
+
+    Until the first compaction the sketch holds every value and its quantiles are exact.
+
+    The offsets are drawn from a generator seeded by the OS, so the sketches of parts that are merged compact
+    independently of each other and their errors don't add up in the same direction. A `seed` makes a sketch
+    reproducible, e.g. in tests.
+    """
+    def __init__(self, k: int = DEFAULT_SKETCH_K, seed: Optional[int] = None) -> None:
+        if k < 8:
+            raise ValueError(f"A quantile sketch needs k >= 8, not {k}")
+
+        self._k = k
+        self._levels: List[np.ndarray] = [np.empty(0, dtype=np.float64)]
+        self._pending = []
+        self._count = 0
+        self._error_variance = 0.0
+        self._rng = np.random.default_rng(seed)
+
+    def get_k(self) -> int:
+        return self._k
+
+    def get_count(self) -> int:
+        return self._count + len(self._pending)
+
+    def get_n_kept(self) -> int:
+        return sum([len(level) for level in self._levels]) + len(self._pending)
+
+    def get_capacity(self, level: int) -> int:
+        return max(int(np.ceil(self._k * CAPACITY_RATIO ** (len(self._levels) - 1 - level))), 2)
+
+    def add(self, val: float) -> None:
+        # single values are buffered and go in as one block
+        self._pending.append(val)
+        if len(self._pending) >= self._k:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._pending:
+            pending, self._pending = self._pending, []
+            self.update(vals=np.array(pending, dtype=np.float64))
+
+    def update(self, vals: np.ndarray) -> None:
+        # `vals` must not hold NaN
+        if len(vals) == 0:
+            return
+
+        self._levels[0] = np.concatenate([self._levels[0], np.asarray(vals, dtype=np.float64)])
+        self._count += len(vals)
+        self.compress()
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        if other._k != self._k:
+            raise ValueError(f"Can't merge a sketch with k={other._k} into one with k={self._k}")
+
+        # `other` is left as it is, its pending values are taken over as they are
+        for level, vals in enumerate(other._levels):
+            if level == len(self._levels):
+                self._levels.append(np.empty(0, dtype=np.float64))
+            self._levels[level] = np.concatenate([self._levels[level], vals])
+        self._levels[0] = np.concatenate([self._levels[0], np.array(other._pending, dtype=np.float64)])
+
+        self._count += other._count + len(other._pending)
+        self._error_variance += other._error_variance
+        self.compress()
+
+        return self
+
+    def compress(self) -> None:
+        level = 0
+        while level < len(self._levels):
+            vals = self._levels[level]
+            if len(vals) <= self.get_capacity(level=level):
+                level += 1
+                continue
+
+            if level + 1 == len(self._levels):
+                # a new top level, the capacities of the levels below it shrink
+                self._levels.append(np.empty(0, dtype=np.float64))
+
+            # an odd value out stays at its level
+            vals = np.sort(vals)
+            kept, vals = vals[len(vals) - len(vals) % 2:], vals[:len(vals) - len(vals) % 2]
+
+            offset = int(self._rng.integers(2))
+            self._levels[level] = kept
+            self._levels[level + 1] = np.concatenate([self._levels[level + 1], vals[offset::2]])
+            self._error_variance += float(4 ** level)
+
+            # the levels below may be over their (now smaller) capacity
+            level = 0
+
+    def get_quantile(self, q: float) -> Optional[float]:
+        # value at rank `q` (0 to 1), None when the sketch is empty
+        return self.get_quantiles(qs=[q])[0]
+
+    def get_quantiles(self, qs: List[float]) -> List[Optional[float]]:
+        # values at the ranks `qs` from a single sort of the values kept
+        self.flush()
+        if self._count == 0:
+            return [None] * len(qs)
+
+        if len(self._levels) == 1:
+            return np.percentile(self._levels[0], [100 * q for q in qs]).tolist()
+
+        vals = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(len(level_vals), 2 ** level, dtype=np.float64)
+                                  for level, level_vals in enumerate(self._levels)])
+        order = np.argsort(vals, kind='stable')
+        ranks = np.cumsum(weights[order])
+
+        positions = np.minimum(np.searchsorted(ranks, np.asarray(qs) * ranks[-1]), len(vals) - 1)
+        return vals[order][positions].tolist()
+
+    def get_rank_error(self) -> float:
+        """
+        Bound on the error of the rank of a quantile as a share of all the values, e.g. 0.005 means the 50th
+        percentile returned lies between the true 49.5th and 50.5th percentiles (with `ERROR_CONFIDENCE`). From
+        Hoeffding's inequality on the compactions, 0 while the sketch is exact.
+        """
+        self.flush()
+        if self._count == 0 or self._error_variance == 0:
+            return 0.0
+
+        return float(np.sqrt(2 * np.log(2 / (1 - ERROR_CONFIDENCE)) * self._error_variance) / self._count)
@@ -1,6 +1,26 @@
 import os
-from w1.main import get_sales_information
-from w1.utils import DataReader
+from typing import Dict
+from w1.main import get_sales_information, revenue_per_region
+from w1.utils import DataReader, MmapBatch, Stats, split_file, TUPLE_ROWS, EXACT_STATS, STREAMING_STATS, SKETCH_STATS, \
+    STATS_MODES, paused_gc
+from w1.data_processor import DataProcessor
+from w1.plan import Consumer, StatsConsumer, SumConsumer, SumByKeyConsumer, GroupedStatsConsumer, GroupByConsumer
+from w1.predicates import Predicate, Eq, In, Between
+from w1.histogram import Histogram
+from w1.hyperloglog import HyperLogLog
+from w1.heavy_hitters import TopK
+from w1.group_by import GroupBy, to_month
+import w1.zone_map
+from w1.schema import Schema, ColumnSchema, FLOAT, RAISE
+import numpy as np
+import pytest
+import shutil
+import gzip
+import bz2
+import lzma
+import pickle
+import threading
+import gc
 import constants
 from global_utils import blockPrint, enablePrint
 from pprint import pprint
@@ -50,3 +70,791 @@ def test_revenue_per_region():
     assert all([len(each) > 0 for each in revenue_data])
 
     pprint(revenue_data)
+
+
+def test_data_reader_batches():
+    blockPrint()
+    fp = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')
+    dp = DataProcessor(file_path=fp)
+
+    batches = list(dp.data_reader.iter_batches(batch_rows=1000))
+    enablePrint()
+
+    # every batch maps each column name to an array of the same length
+    assert all([set(batch.keys()) == set(dp.data_reader.get_column_names()) for batch in batches])
+    assert sum([len(batch[constants.OutDataColNames.TOTAL_PRICE]) for batch in batches]) == dp._n_rows
+
+    # numeric columns are float64, the rest hold strings
+    batch = batches[0]
+    assert batch[constants.OutDataColNames.UNIT_PRICE].dtype == np.float64
+    assert isinstance(batch[constants.OutDataColNames.COUNTRY][0], str)
+
+    # the batches should add up to the same total as the row by row iteration
+    data_gen = (row for row in dp.data_reader)
+    _ = next(data_gen)
+    row_total = sum([float(row[constants.OutDataColNames.TOTAL_PRICE]) for row in data_gen])
+    assert abs(dp.aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE) - row_total) < 1e-6 * row_total
+
+
+def test_data_reader_mmap_batches():
+    blockPrint()
+    fp = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2016.csv')
+    dp = DataProcessor(file_path=fp)
+    col_names = dp.data_reader.get_column_names()
+
+    text_batches = list(DataReader(fp=fp, sep=',', col_names=col_names).iter_batches(batch_rows=5000))
+    mmap_batches = list(DataReader(fp=fp, sep=',', col_names=col_names, use_mmap=True).iter_batches(batch_rows=5000))
+    enablePrint()
+
+    # both modes should cut the file into the same batches holding the same values, the quoted rows of the file
+    # don't keep the mmap mode from returning lazy batches
+    assert len(text_batches) == len(mmap_batches)
+    assert all([isinstance(mmap_batch, MmapBatch) for mmap_batch in mmap_batches])
+    for text_batch, mmap_batch in zip(text_batches, mmap_batches):
+        assert set(text_batch.keys()) == set(mmap_batch.keys())
+        for col_name in col_names:
+            assert np.array_equal(text_batch[col_name], mmap_batch[col_name])
+
+
+def test_data_reader_columns():
+    columns = [constants.OutDataColNames.TOTAL_PRICE, constants.OutDataColNames.COUNTRY]
+    fp = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')
+    col_names = open(fp).readline().strip('\n').split(',')
+
+    blockPrint()
+    data_gen = (row for row in DataReader(fp=fp, sep=',', col_names=col_names, columns=columns))
+    _ = next(data_gen)
+    row_1 = next(data_gen)
+
+    batches = {use_mmap: next(DataReader(fp=fp, sep=',', col_names=col_names,
+                                         use_mmap=use_mmap).iter_batches(batch_rows=100, columns=columns))
+               for use_mmap in [False, True]}
+    enablePrint()
+
+    # only the projected columns (and the row number) should be materialized
+    assert set(row_1.keys()) == set(columns + ['n_row'])
+    assert all([set(batch.keys()) == set(columns) for batch in batches.values()])
+    assert np.array_equal(batches[False][constants.OutDataColNames.COUNTRY],
+                          batches[True][constants.OutDataColNames.COUNTRY])
+
+
+def test_schema_bad_values(tmp_path):
+    fp = os.path.join(tmp_path, 'bad_values.csv')
+    col_names = [constants.OutDataColNames.STOCK_CODE, constants.OutDataColNames.UNIT_PRICE,
+                 constants.OutDataColNames.COUNTRY]
+    with open(fp, 'w') as f:
+        f.write(",".join(col_names) + "\n" + "22180,19.96,Russia\n" + "23017,N/A,Germany\n" + ",0.39,\n")
+
+    for use_mmap in [False, True]:
+        data_reader = DataReader(fp=fp, sep=',', col_names=col_names, use_mmap=use_mmap)
+        # mmap batches only convert (and count) the columns that are looked up
+        batch = {col_name: vals for col_name, vals in next(data_reader.iter_batches()).items()}
+
+        # bad values become NaN and are counted per column, empty values only count for non nullable columns
+        unit_price = batch[constants.OutDataColNames.UNIT_PRICE]
+        assert unit_price[0] == 19.96 and np.isnan(unit_price[1]) and unit_price[2] == 0.39
+        assert data_reader.get_rejected_counts() == {constants.OutDataColNames.STOCK_CODE: 1,
+                                                     constants.OutDataColNames.UNIT_PRICE: 1,
+                                                     constants.OutDataColNames.COUNTRY: 1}
+
+    # a column can also stop the scan on the first bad value
+    strict_schema = Schema(columns=[ColumnSchema(name=constants.OutDataColNames.UNIT_PRICE, dtype=FLOAT,
+                                                 on_error=RAISE)])
+    data_reader = DataReader(fp=fp, sep=',', col_names=col_names, schema=strict_schema)
+    with pytest.raises(ValueError):
+        next(data_reader.iter_batches())
+
+    # nan and inf are bad values, whether or not the block holds other bad values
+    converter = ColumnSchema(name=constants.OutDataColNames.UNIT_PRICE, dtype=FLOAT).compile()
+    for vals in [['19.96', 'nan', '-inf'], ['19.96', 'nan', '-inf', 'N/A'], ['19.96'] * 100 + ['inf', 'N/A', '']]:
+        converted = converter(vals)
+        assert converted[0] == 19.96 and np.isnan(converted[-1]) and np.isnan(converted[-2])
+        assert np.array_equal(converter(np.array(vals).astype('S')), converted, equal_nan=True)
+    assert converter.n_rejected == 2 * (2 + 3 + 2)
+
+
+def test_data_reader_cache(tmp_path):
+    fp = os.path.join(tmp_path, '2015.csv')
+    shutil.copyfile(os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv'), fp)
+    col_names = open(fp).readline().strip('\n').split(',')
+
+    blockPrint()
+    data_reader = DataReader(fp=fp, sep=',', col_names=col_names, use_cache=True)
+    assert not data_reader.has_valid_cache()
+    data_reader.build_cache()
+    assert data_reader.has_valid_cache()
+
+    # the cache should hold exactly what parsing the file gives
+    cached_batches = list(data_reader.iter_batches(batch_rows=7000))
+    parsed_batches = list(DataReader(fp=fp, sep=',', col_names=col_names).iter_batches(batch_rows=7000))
+    assert len(cached_batches) == len(parsed_batches)
+    for cached_batch, parsed_batch in zip(cached_batches, parsed_batches):
+        assert all([np.array_equal(cached_batch[col_name], parsed_batch[col_name]) for col_name in col_names])
+
+    # byte ranges read from the cache should cover every row once
+    n_rows = sum([len(batch[constants.OutDataColNames.COUNTRY])
+                  for byte_range in split_file(fp=fp, n_parts=3)
+                  for batch in DataReader(fp=fp, sep=',', col_names=col_names, use_cache=True,
+                                          byte_range=byte_range).iter_batches()])
+    assert n_rows == sum([len(batch[constants.OutDataColNames.COUNTRY]) for batch in parsed_batches])
+
+    # changing the file invalidates the cache
+    with open(fp, 'a') as f:
+        f.write("22180,RETROSPOT LAMP,19.96,4,79.84,Russia,676a89e8-cad5-11f1-9141-02fc00000001,2015/04/06\n")
+    assert not data_reader.has_valid_cache()
+    enablePrint()
+
+
+def test_count_rows(tmp_path):
+    fp = os.path.join(tmp_path, '2017.csv')
+    shutil.copyfile(os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2017.csv'), fp)
+    col_names = open(fp).readline().strip('\n').split(',')
+    n_lines = len(open(fp).readlines()) - 1
+
+    data_reader = DataReader(fp=fp, sep=',', col_names=col_names)
+
+    # counting new lines gives the exact number of data rows and the count is kept next to the file
+    assert data_reader.count_rows() == n_lines
+    assert os.path.exists(os.path.join(tmp_path, '.2017.csv.rows.json'))
+    assert data_reader.count_rows() == n_lines
+
+    # byte ranges add up to the whole file
+    assert sum([DataReader(fp=fp, sep=',', col_names=col_names, byte_range=byte_range).count_rows()
+                for byte_range in split_file(fp=fp, n_parts=5)]) == n_lines
+
+    # the estimate only looks at the start of the file but should be close
+    assert abs(data_reader.count_rows(estimate=True) - n_lines) < 0.01 * n_lines
+
+    # blank lines are skipped by the count as they are by the reader and the cache
+    fp = os.path.join(tmp_path, 'blank.csv')
+    with open(fp, 'w', newline='') as f:
+        f.write(",".join(col_names) + "\n\n" + ",".join(['x'] * len(col_names)) + "\r\n\r\n\n" +
+                ",".join(['y'] * len(col_names)) + "\n\n")
+
+    for use_mmap, use_cache in [(False, False), (True, False), (False, True)]:
+        data_reader = DataReader(fp=fp, sep=',', col_names=col_names, use_mmap=use_mmap, use_cache=use_cache)
+        if use_cache:
+            data_reader.build_cache()
+
+        assert data_reader.count_rows() == 2
+        assert sum([len(batch[col_names[0]]) for batch in data_reader.iter_batches()]) == 2
+        assert sum([DataReader(fp=fp, sep=',', col_names=col_names, byte_range=byte_range).count_rows()
+                    for byte_range in split_file(fp=fp, n_parts=3)]) == 2
+
+
+def test_compressed_files(tmp_path):
+    fp = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')
+    with open(fp, 'rb') as f:
+        data = f.read()
+
+    blockPrint()
+    expected = get_sales_information(fp)
+    for ext, compress in [('gz', gzip.compress), ('bz2', bz2.compress), ('xz', lzma.compress)]:
+        compressed_fp = os.path.join(tmp_path, f'2015.csv.{ext}')
+        with open(compressed_fp, 'wb') as f:
+            f.write(compress(data))
+
+        # the compressed file is streamed and gives the same answer as the plain one
+        for use_cache in [False, True]:
+            dp = DataProcessor(file_path=compressed_fp, use_cache=use_cache)
+            assert dp._n_rows == data.count(b'\n') - 1
+            assert abs(dp.aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE) -
+                       expected['total_revenue']) < 1e-6 * expected['total_revenue']
+
+        assert get_sales_information(compressed_fp)['file_name'] == '2015'
+    enablePrint()
+
+
+def test_run_plan():
+    fp = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')
+    column_names = [constants.OutDataColNames.UNIT_PRICE, constants.OutDataColNames.TOTAL_PRICE]
+
+    blockPrint()
+    dp = DataProcessor(file_path=fp)
+    n_rows_done = []
+    results = dp.run_plan(consumers={
+        'stats': StatsConsumer(column_names=column_names),
+        'total_revenue': SumConsumer(column_name=constants.OutDataColNames.TOTAL_PRICE),
+        'revenue_per_region': SumByKeyConsumer(key_column=constants.OutDataColNames.COUNTRY,
+                                               val_column=constants.OutDataColNames.TOTAL_PRICE)
+    }, on_batch=n_rows_done.append)
+
+    # one scan gives the same answers as a scan per computation
+    stats = dp.compute_stats(column_names=column_names)
+    total_revenue = dp.aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE)
+    revenue = revenue_per_region(dp)
+    enablePrint()
+
+    assert {name: value.get_stats() for name, value in results['stats'].items()} == \
+           {name: value.get_stats() for name, value in stats.items()}
+    assert results['total_revenue'] == total_revenue
+    assert results['revenue_per_region'] == revenue
+    assert n_rows_done[-1] == dp._n_rows
+
+    # a consumer has to implement the whole interface
+    with pytest.raises(TypeError):
+        Consumer()
+
+    # only the exact stats keep every value, a checkpoint of them would grow with the rows read
+    assert not StatsConsumer(column_names=column_names).has_bounded_state()
+    assert StatsConsumer(column_names=column_names, mode=SKETCH_STATS).has_bounded_state()
+
+
+def test_data_reader_tuple_rows():
+    fp = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')
+    col_names = DataProcessor(file_path=fp, use_cache=False)._col_names
+
+    blockPrint()
+    dict_rows = list(DataReader(fp=fp, sep=',', col_names=col_names))
+    tuple_rows = list(DataReader(fp=fp, sep=',', col_names=col_names, row_type=TUPLE_ROWS))
+    enablePrint()
+
+    # same keys and values as the dict rows
+    assert len(tuple_rows) == len(dict_rows)
+    assert all([tuple_row == dict_row for tuple_row, dict_row in zip(tuple_rows, dict_rows)])
+
+    row = tuple_rows[1]
+    assert row[constants.OutDataColNames.TOTAL_PRICE] == row[col_names.index(constants.OutDataColNames.TOTAL_PRICE)]
+    assert row['n_row'] == 1
+    assert list(row.keys()) == col_names + ['n_row']
+    with pytest.raises(AttributeError):
+        row.extra = 1
+
+    with pytest.raises(ValueError):
+        DataReader(fp=fp, sep=',', col_names=col_names, row_type='list')
+
+
+def test_quoted_fields(tmp_path):
+    fp = os.path.join(tmp_path, 'quoted.csv')
+    col_names = [constants.OutDataColNames.STOCK_CODE, constants.OutDataColNames.DESCRIPTION,
+                 constants.OutDataColNames.TOTAL_PRICE, constants.OutDataColNames.COUNTRY]
+    with open(fp, 'w') as f:
+        f.write(",".join(col_names) + "\n" + '84029E,"RED WOOLLY HOTTIE, WHITE HEART",3.75,France\n' +
+                '90214H,"LETTER ""H"" BLING KEY RING",2.03,"United Kingdom"\r\n' +
+                "22180,RETROSPOT LAMP,79.84,Russia\n")
+
+    descriptions = ['RED WOOLLY HOTTIE, WHITE HEART', 'LETTER "H" BLING KEY RING', 'RETROSPOT LAMP']
+    for use_mmap, use_cache in [(False, False), (True, False), (False, True)]:
+        data_reader = DataReader(fp=fp, sep=',', col_names=col_names, use_mmap=use_mmap, use_cache=use_cache)
+        if use_cache:
+            data_reader.build_cache()
+
+        # the separator inside a quoted field doesn't split it, and the quotes are removed
+        batches = data_reader.iter_batches()
+        batch = next(batches)
+        # the garbage collector is only paused while a block is split, not while the scan is suspended
+        assert gc.isenabled()
+        assert batch[constants.OutDataColNames.DESCRIPTION].tolist() == descriptions
+        assert batch[constants.OutDataColNames.COUNTRY].tolist() == ['France', 'United Kingdom', 'Russia']
+        assert batch[constants.OutDataColNames.TOTAL_PRICE].tolist() == [3.75, 2.03, 79.84]
+
+    # in mmap mode only the quoted rows are parsed apart, the block stays a lazy `MmapBatch`
+    data_reader = DataReader(fp=fp, sep=',', col_names=col_names, use_mmap=True)
+    assert isinstance(next(data_reader.iter_batches()), MmapBatch)
+    batch = next(data_reader.iter_batches(where=Eq(constants.OutDataColNames.COUNTRY, 'United Kingdom')))
+    assert batch[constants.OutDataColNames.DESCRIPTION].tolist() == [descriptions[1]]
+
+    rows = list(DataReader(fp=fp, sep=',', col_names=col_names))[1:]
+    assert [row[constants.OutDataColNames.DESCRIPTION] for row in rows] == descriptions
+
+
+def test_paused_gc():
+    assert gc.isenabled()
+
+    # nested pauses and those of other threads keep the collector off until the last one ends
+    inner_done, outer_done = threading.Event(), threading.Event()
+
+    def pause_in_thread():
+        with paused_gc():
+            inner_done.set()
+            outer_done.wait()
+
+    with paused_gc():
+        with paused_gc():
+            assert not gc.isenabled()
+        assert not gc.isenabled()
+
+        thread = threading.Thread(target=pause_in_thread)
+        thread.start()
+        inner_done.wait()
+    assert not gc.isenabled()
+
+    outer_done.set()
+    thread.join()
+    assert gc.isenabled()
+
+    # a collector that was already off stays off
+    gc.disable()
+    try:
+        with paused_gc():
+            pass
+        assert not gc.isenabled()
+    finally:
+        gc.enable()
+
+
+def test_where(tmp_path):
+    fp = os.path.join(tmp_path, 'where.csv')
+    col_names = [constants.OutDataColNames.STOCK_CODE, constants.OutDataColNames.UNIT_PRICE,
+                 constants.OutDataColNames.TOTAL_PRICE, constants.OutDataColNames.COUNTRY,
+                 constants.OutDataColNames.DATE]
+    with open(fp, 'w') as f:
+        f.write(",".join(col_names) + "\n" + "22180,19.96,79.84,Russia,2015/08/02\n" +
+                "23017,24.96,24.96,Germany,2015/07/15\n" + "84732D,0.39,0.78,Germany,2015/10/01\n" +
+                "22180,19.96,39.92,Germany,2015/09/30\n")
+
+    q3 = Between(constants.OutDataColNames.DATE, low='2015/07/01', high='2015/09/30')
+    for use_mmap, use_cache in [(False, False), (True, False), (False, True)]:
+        blockPrint()
+        dp = DataProcessor(file_path=fp, use_mmap=use_mmap, use_cache=use_cache)
+        total = dp.aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE,
+                             where=[Eq(constants.OutDataColNames.COUNTRY, 'Germany'), q3])
+        revenue = revenue_per_region(dp, where=q3)
+        stock_codes = [batch[constants.OutDataColNames.STOCK_CODE].tolist() for batch in dp.data_reader.iter_batches(
+            where=[In(constants.OutDataColNames.STOCK_CODE, ['22180', '84732D']),
+                   Between(constants.OutDataColNames.UNIT_PRICE, high=10)])]
+        enablePrint()
+
+        assert total == 24.96 + 39.92
+        assert revenue == {'Germany': 24.96 + 39.92, 'Russia': 79.84}
+        assert stock_codes == [['84732D']]
+
+        # no matching rows, no batches
+        assert list(dp.data_reader.iter_batches(where=Eq(constants.OutDataColNames.COUNTRY, 'India'))) == []
+
+        # a number matches its value, however it is written in the file
+        for price in [24.96, '24.960']:
+            batches = list(dp.data_reader.iter_batches(where=Eq(constants.OutDataColNames.UNIT_PRICE, price)))
+            assert [batch[constants.OutDataColNames.STOCK_CODE].tolist() for batch in batches] == [['23017']]
+
+    # the columns outside the predicates are only converted for the matching rows, a bad value elsewhere isn't seen
+    with open(fp, 'a') as f:
+        f.write("23017,24.96,n/a,India,2015/10/15\n")
+
+    for use_mmap in [False, True]:
+        data_reader = DataReader(fp=fp, sep=',', col_names=col_names, use_mmap=use_mmap)
+        batches = list(data_reader.iter_batches(columns=[constants.OutDataColNames.TOTAL_PRICE], where=q3))
+        assert [batch[constants.OutDataColNames.TOTAL_PRICE].tolist() for batch in batches] == [[79.84, 24.96, 39.92]]
+        assert data_reader.get_rejected_counts()[constants.OutDataColNames.TOTAL_PRICE] == 0
+
+    with pytest.raises(TypeError):
+        Predicate(constants.OutDataColNames.COUNTRY)
+
+
+def test_zone_map(tmp_path, monkeypatch):
+    monkeypatch.setattr(w1.zone_map, 'ZONE_ROWS', 2)
+
+    fp = os.path.join(tmp_path, 'zones.csv')
+    col_names = [constants.OutDataColNames.STOCK_CODE, constants.OutDataColNames.TOTAL_PRICE,
+                 constants.OutDataColNames.COUNTRY, constants.OutDataColNames.DATE]
+    with open(fp, 'w') as f:
+        f.write(",".join(col_names) + "\n" + "22180,79.84,Russia,2015/01/02\n" + "23017,24.96,Germany,2015/03/15\n" +
+                "84732D,0.78,Germany,2015/07/01\n" + "22180,39.92,Germany,2015/08/30\n" +
+                "23017,49.92,Germany,2015/11/01\n" + "84732D,1.56,India,2015/12/24\n")
+
+    q3 = Between(constants.OutDataColNames.DATE, low='2015/07/01', high='2015/09/30')
+    for use_mmap, use_cache in [(False, False), (True, False), (False, True)]:
+        blockPrint()
+        dp = DataProcessor(file_path=fp, use_mmap=use_mmap, use_cache=use_cache, use_zone_map=True)
+        enablePrint()
+
+        # only the middle zone of the three is read
+        byte_ranges = dp.data_reader.get_scan_ranges(predicates=[q3])
+        assert len(byte_ranges) == 1
+        assert dp.aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE, where=q3) == 0.78 + 39.92
+        assert dp.aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE,
+                            where=Between(constants.OutDataColNames.TOTAL_PRICE, low=100)) == 0
+
+        # the zones are cut down to the byte range of a processor
+        totals = [DataProcessor(file_path=fp, byte_range=byte_range, use_mmap=use_mmap, use_cache=use_cache,
+                                use_zone_map=True).aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE, where=q3)
+                  for byte_range in split_file(fp=fp, n_parts=3)]
+        assert sum(totals) == 0.78 + 39.92
+
+
+def test_incremental_plan(tmp_path):
+    fp = os.path.join(tmp_path, 'live.csv')
+    col_names = [constants.OutDataColNames.TOTAL_PRICE, constants.OutDataColNames.COUNTRY]
+    with open(fp, 'w') as f:
+        f.write(",".join(col_names) + "\n" + "79.84,Russia\n" + "24.96,Germany\n")
+
+    def run_plan() -> Dict:
+        blockPrint()
+        dp = DataProcessor(file_path=fp, use_cache=False)
+        results = dp.run_plan(state_name='test', on_batch=n_rows_done.append, consumers={
+            'total_revenue': SumConsumer(column_name=constants.OutDataColNames.TOTAL_PRICE),
+            'revenue_per_region': SumByKeyConsumer(key_column=constants.OutDataColNames.COUNTRY,
+                                                   val_column=constants.OutDataColNames.TOTAL_PRICE)
+        })
+        enablePrint()
+        return results
+
+    n_rows_done = []
+    assert run_plan()['total_revenue'] == 79.84 + 24.96
+
+    # only the appended rows are read, the row still being written is left for the next run
+    with open(fp, 'a') as f:
+        f.write("0.78,India\n" + "39.92,Ger")
+    n_rows_done = []
+    assert run_plan()['revenue_per_region'] == {'Russia': 79.84, 'Germany': 24.96, 'India': 0.78}
+    assert n_rows_done == [1]
+
+    with open(fp, 'a') as f:
+        f.write("many\n")
+    assert run_plan()['revenue_per_region'] == {'Russia': 79.84, 'Germany': 24.96 + 39.92, 'India': 0.78}
+
+    # a rewritten file is read from the start again
+    with open(fp, 'w') as f:
+        f.write(",".join(col_names) + "\n" + "1.5,Japan\n")
+    assert run_plan()['revenue_per_region'] == {'Japan': 1.5}
+
+
+def test_incremental_plan_settings(tmp_path):
+    fp = os.path.join(tmp_path, 'live.csv')
+    col_names = [constants.OutDataColNames.TOTAL_PRICE, constants.OutDataColNames.COUNTRY]
+    with open(fp, 'w') as f:
+        f.write(",".join(col_names) + "\n" + "79.84,Russia\n" + "24.96,Germany\n" + "0.78,Germany\n")
+
+    def run_plan(mode: str, aggregate: str) -> Dict:
+        blockPrint()
+        dp = DataProcessor(file_path=fp, use_cache=False)
+        consumers = {
+            'stats': StatsConsumer(column_names=[constants.OutDataColNames.TOTAL_PRICE], mode=mode),
+            'revenue': GroupByConsumer(group_by=constants.OutDataColNames.COUNTRY,
+                                       aggregates={'v': (aggregate, constants.OutDataColNames.TOTAL_PRICE)})
+        }
+        results = dp.run_plan(state_name='test', consumers=consumers)
+        enablePrint()
+        return dict(results, signature=dp.get_checkpoint_signature(consumers=consumers))
+
+    first = run_plan(mode=SKETCH_STATS, aggregate='sum')
+    assert first['revenue'].get_aggregate(name='v')['Germany'] == 24.96 + 0.78
+
+    # the same columns with other settings don't reuse the saved state
+    second = run_plan(mode=STREAMING_STATS, aggregate='max')
+    assert second['stats'][constants.OutDataColNames.TOTAL_PRICE].get_mode() == STREAMING_STATS
+    assert second['revenue'].get_aggregate(name='v')['Germany'] == 24.96
+    assert second['signature'] != first['signature']
+
+    # exact stats hold every value, they would make every run load and save the whole file
+    with pytest.raises(ValueError):
+        run_plan(mode=EXACT_STATS, aggregate='sum')
+
+
+def test_resumable_plan(tmp_path):
+    fp = os.path.join(tmp_path, 'sales.csv')
+    col_names = [constants.OutDataColNames.TOTAL_PRICE, constants.OutDataColNames.COUNTRY]
+    rows = [f"{n_row}.5,{['Russia', 'Germany', 'India'][n_row % 3]}\n" for n_row in range(100)]
+    with open(fp, 'w') as f:
+        f.write(",".join(col_names) + "\n" + "".join(rows))
+
+    def get_consumers() -> Dict:
+        return {
+            'total_revenue': SumConsumer(column_name=constants.OutDataColNames.TOTAL_PRICE),
+            'revenue_per_region': SumByKeyConsumer(key_column=constants.OutDataColNames.COUNTRY,
+                                                   val_column=constants.OutDataColNames.TOTAL_PRICE)
+        }
+
+    def save_checkpoint(offset: int, consumers: Dict) -> None:
+        checkpoints.append((offset, pickle.dumps(consumers)))
+
+    blockPrint()
+    dp = DataProcessor(file_path=fp, use_cache=False)
+    checkpoints = []
+    expected = dp.run_plan(consumers=get_consumers(), on_checkpoint=save_checkpoint, checkpoint_bytes=100)
+    assert expected['total_revenue'] == sum([n_row + 0.5 for n_row in range(100)])
+    assert len(checkpoints) > 5
+    assert checkpoints[-1][0] == os.path.getsize(fp)
+
+    # a run stopped after any checkpoint ends with the same results when resumed from it
+    for offset, consumers in checkpoints[:-1]:
+        results = dp.run_plan(consumers=get_consumers(), resume_from=(offset, pickle.loads(consumers)))
+        assert results['total_revenue'] == pytest.approx(expected['total_revenue'])
+        assert results['revenue_per_region'] == pytest.approx(expected['revenue_per_region'])
+    enablePrint()
+
+
+def test_streaming_stats():
+    vals = np.random.default_rng(seed=0).lognormal(mean=3, sigma=1.5, size=10000)
+    vals[::97] = np.nan
+
+    exact = Stats()
+    exact.update_batch(vals=vals)
+    expected = exact.get_stats()
+
+    # batches, single values and merged parts all give the same mean and std as the exact mode
+    streaming = Stats(mode=STREAMING_STATS)
+    streaming.update_batch(vals=vals[:3000])
+    for val in vals[3000:3100]:
+        streaming.update_stats(val=None if np.isnan(val) else val)
+    part = Stats(mode=STREAMING_STATS)
+    part.update_batch(vals=vals[3100:])
+    stats = streaming.merge(other=part).get_stats()
+
+    assert stats['min'] == expected['min'] and stats['max'] == expected['max']
+    assert stats['mean'] == pytest.approx(expected['mean'], rel=1e-12)
+    assert stats['std'] == pytest.approx(expected['std'], rel=1e-12)
+    assert stats['median'] is None and stats['50'] is None
+    assert not streaming._vals
+
+    with pytest.raises(ValueError):
+        exact.merge(other=part)
+
+
+def test_sketch_stats():
+    rng = np.random.default_rng(seed=0)
+    parts = [rng.lognormal(mean=3, sigma=1.5, size=200000) for _ in range(3)]
+    vals = np.sort(np.concatenate(parts))
+
+    # sketches of the parts of a file (or of several files) merge into one
+    stats = Stats(mode=SKETCH_STATS, sketch_k=400)
+    for part in parts:
+        part_stats = Stats(mode=SKETCH_STATS, sketch_k=400)
+        for n_start in range(0, len(part), 50000):
+            part_stats.update_batch(vals=part[n_start:n_start + 50000])
+        stats.merge(other=part_stats)
+    result = stats.get_stats()
+
+    assert 0 < result['quantile_error'] < 0.02
+    assert result['median'] == result['50']
+    assert result['mean'] == pytest.approx(vals.mean(), rel=1e-9)
+    for key, q in [('25', 0.25), ('50', 0.5), ('75', 0.75)]:
+        assert abs(np.searchsorted(vals, result[key]) / len(vals) - q) <= result['quantile_error']
+
+    # few values fit in the sketch and its percentiles are exact
+    small = Stats(mode=SKETCH_STATS)
+    for val in [4, 1, 3, 2]:
+        small.update_stats(val=val)
+    assert small.get_stats()['25'] == np.percentile([1, 2, 3, 4], 25)
+    assert small.get_stats()['quantile_error'] == 0
+
+    # merging doesn't change the stats merged in, not even the values they buffer
+    part = Stats(mode=SKETCH_STATS)
+    for val in [4, 1, 3, 2]:
+        part.update_stats(val=val)
+    merged = Stats(mode=SKETCH_STATS).merge(other=part)
+    assert part._sketch._pending == [4, 1, 3, 2]
+    assert merged.get_stats() == small.get_stats()
+
+
+def test_exact_percentiles():
+    vals = np.random.default_rng(seed=1).lognormal(mean=3, sigma=1.5, size=1001)
+
+    stats = Stats()
+    stats.update_batch(vals=vals[:500])
+    for val in vals[500:]:
+        stats.update_stats(val=val)
+    result = stats.get_stats()
+
+    # same values as np.percentile, and the median is filled in
+    assert [result['25'], result['50'], result['75']] == np.percentile(vals, [25, 50, 75]).tolist()
+    assert result['median'] == result['50'] == float(np.median(vals))
+    assert stats.get_percentiles(percentiles=[0, 33.3, 100]) == np.percentile(vals, [0, 33.3, 100]).tolist()
+    assert Stats().get_percentiles(percentiles=[50]) == [None]
+
+
+def test_stats_update_batch():
+    vals = ['19.96', '24.96', 'n/a', '0.39', '', '3']
+
+    # a batch gives the same stats as feeding its values one at a time, in every mode
+    for mode in STATS_MODES:
+        one_by_one = Stats(mode=mode)
+        for val in vals:
+            one_by_one.update_stats(val=val)
+
+        batched = Stats(mode=mode)
+        batched.update_batch(vals=np.array(vals, dtype=object))
+        batched.update_batch(vals=np.array([np.nan]))
+        assert batched.get_stats() == pytest.approx(one_by_one.get_stats(), nan_ok=True)
+        assert batched.get_stats()['min'] == 0.39 and batched.get_stats()['max'] == 24.96
+
+
+def test_histogram():
+    vals = np.array([0.0005, 0.001, 0.5, 0.9, 3, 250, 1e6, np.nan])
+
+    log_stats = Stats(mode=STREAMING_STATS, histogram=Histogram.log(low=0.001, high=1e6, buckets_per_decade=1))
+    log_stats.update_batch(vals=vals[:4])
+    part = log_stats.get_empty()
+    part.update_batch(vals=vals[4:])
+    buckets = log_stats.merge(other=part).get_stats()['histogram']
+
+    # the underflow and overflow buckets keep the values outside the edges
+    assert [count for _, _, count in buckets] == [1, 1, 2, 1, 1, 1]
+    assert buckets[0][0] == -np.inf and buckets[-1][1] == np.inf
+    assert sum([count for _, _, count in buckets]) == 7
+    assert buckets[2][:2] == pytest.approx((0.1, 1))
+
+    fixed = Histogram.fixed(low=0, high=10, n_buckets=5)
+    fixed.update(vals=np.arange(10))
+    assert fixed.get_counts().tolist() == [0, 2, 2, 2, 2, 2, 0]
+
+    with pytest.raises(ValueError):
+        fixed.merge(other=Histogram.fixed(low=0, high=10, n_buckets=4))
+    with pytest.raises(ValueError):
+        Stats(histogram=fixed).merge(other=Stats())
+
+
+def test_distinct_count():
+    codes = np.array([f'{n_code}ABC'[:n_code % 7 + 2] + str(n_code) for n_code in range(60000)], dtype=object)
+
+    # counters of separate parts merge into the counter of the whole, repeated values are counted once
+    counter = HyperLogLog(precision=12)
+    counter.update(vals=codes[:40000])
+    part = HyperLogLog(precision=12)
+    part.update(vals=codes[20000:])
+    counter.merge(other=part)
+    assert abs(counter.get_count() / len(codes) - 1) < 4 * counter.get_error()
+
+    small = HyperLogLog()
+    small.update(vals=np.array(['22180', '23017', '22180', '84732D'], dtype=object))
+    small.update(vals=np.array([19.96, 19.96]))
+    assert small.get_count() == 4
+
+    with pytest.raises(ValueError):
+        counter.merge(other=HyperLogLog(precision=10))
+
+    blockPrint()
+    dp = DataProcessor(file_path=os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv'))
+    counters = dp.compute_distinct(column_names=[constants.OutDataColNames.COUNTRY])
+    countries = set()
+    for batch in dp.data_reader.iter_batches(columns=[constants.OutDataColNames.COUNTRY]):
+        countries.update(batch[constants.OutDataColNames.COUNTRY].tolist())
+    enablePrint()
+    assert counters[constants.OutDataColNames.COUNTRY].get_count() == len(countries)
+
+
+def test_top_k():
+    rng = np.random.default_rng(seed=0)
+    keys = np.array([f'P{n_key}' for n_key in rng.zipf(a=1.3, size=50000) % 5000], dtype=object)
+    vals = rng.uniform(0, 10, size=len(keys))
+
+    exact = TopK(capacity=None)
+    exact.update(keys=keys, vals=vals)
+    true_totals = {key: total for key, total, _ in exact.get_top(k=len(keys))}
+    assert exact.get_top(k=3) == [(key, total, 0.0) for key, total in
+                                  sorted(true_totals.items(), key=lambda item: -item[1])[:3]]
+
+    # bounded summaries of the parts of the data merge, every total brackets the true one
+    top = TopK(capacity=100)
+    for n_start in range(0, len(keys), 5000):
+        part = TopK(capacity=100)
+        part.update(keys=keys[n_start:n_start + 5000], vals=vals[n_start:n_start + 5000])
+        top.merge(other=part)
+
+    assert all([total - error - 1e-6 <= true_totals[key] <= total + 1e-6 for key, total, error in top.get_top(k=20)])
+    assert all([error <= vals.sum() / 100 for _, _, error in top.get_top(k=20)])
+    assert max([total for key, total in true_totals.items() if key not in top._keys]) <= top.get_floor() + 1e-6
+
+    true_top = [key for key, _, _ in exact.get_top(k=20)]
+    assert set(top.get_guaranteed_top(k=20)) <= set(true_top)
+    assert len(top.get_guaranteed_top(k=20)) > 0
+
+    with pytest.raises(ValueError):
+        top.update(keys=np.array(['P1'], dtype=object), vals=np.array([-1.0]))
+
+
+def test_grouped_stats():
+    fp = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')
+    column_names = [constants.OutDataColNames.UNIT_PRICE, constants.OutDataColNames.TOTAL_PRICE]
+
+    blockPrint()
+    dp = DataProcessor(file_path=fp)
+    grouped = dp.describe(column_names=column_names, group_by=constants.OutDataColNames.COUNTRY)
+    germany = dp.compute_stats(column_names=column_names, where=Eq(constants.OutDataColNames.COUNTRY, 'Germany'))
+    by_month = dp.compute_grouped_stats(column_names=column_names, group_by=constants.OutDataColNames.DATE,
+                                        group_key=lambda dates: dates.astype('U7')).get_stats()
+
+    # the same stats from parts of the file merged together, and from a fused plan
+    parts = [DataProcessor(file_path=fp, byte_range=byte_range).run_plan(consumers={
+        'grouped': GroupedStatsConsumer(column_names=column_names, group_by=constants.OutDataColNames.COUNTRY)
+    })['grouped'] for byte_range in split_file(fp=fp, n_parts=3)]
+    enablePrint()
+
+    for column_name in column_names:
+        expected = germany[column_name].get_stats()
+        for key in ['min', 'max', 'mean', 'std']:
+            assert grouped['Germany'][column_name][key] == pytest.approx(expected[key], rel=1e-9)
+
+    assert sorted(by_month.keys()) == [f'2015/{month:02d}' for month in range(1, 13)]
+    assert sum([stats[column_names[0]]['count'] for stats in by_month.values()]) == \
+           sum([stats[column_names[0]]['count'] for stats in grouped.values()])
+
+    merged = parts[0].merge(other=parts[1]).merge(other=parts[2]).get_stats()
+    assert merged.keys() == grouped.keys()
+    for country, stats in grouped.items():
+        for column_name in column_names:
+            assert merged[country][column_name] == pytest.approx(stats[column_name], rel=1e-9)
+
+
+def test_group_by():
+    fp = os.path.join(CURRENT_FOLDER, '..', 'data', 'tst', '2015.csv')
+    aggregates = {
+        'revenue': ('sum', constants.OutDataColNames.TOTAL_PRICE),
+        'sales': ('count', constants.OutDataColNames.TOTAL_PRICE),
+        'mean_price': ('mean', constants.OutDataColNames.UNIT_PRICE),
+        'min_price': ('min', constants.OutDataColNames.UNIT_PRICE),
+        'max_price': ('max', constants.OutDataColNames.UNIT_PRICE)
+    }
+
+    blockPrint()
+    dp = DataProcessor(file_path=fp)
+    by_country = dp.compute_group_by(group_by=constants.OutDataColNames.COUNTRY, aggregates=aggregates).get_result()
+    by_country_month = dp.compute_group_by(group_by=[constants.OutDataColNames.COUNTRY, constants.OutDataColNames.DATE],
+                                           aggregates=aggregates,
+                                           group_keys={constants.OutDataColNames.DATE: to_month}).get_result()
+    germany = dp.compute_stats(column_names=[constants.OutDataColNames.UNIT_PRICE],
+                               where=Eq(constants.OutDataColNames.COUNTRY, 'Germany'))
+    revenue = revenue_per_region(dp)
+
+    # the same group-by from parts of the file merged together, each one a fused plan
+    parts = [DataProcessor(file_path=fp, byte_range=byte_range).run_plan(consumers={
+        'grouped': GroupByConsumer(group_by=[constants.OutDataColNames.COUNTRY, constants.OutDataColNames.DATE],
+                                   aggregates=aggregates, group_keys={constants.OutDataColNames.DATE: to_month})
+    })['grouped'] for byte_range in split_file(fp=fp, n_parts=3)]
+    enablePrint()
+
+    expected = germany[constants.OutDataColNames.UNIT_PRICE].get_stats()
+    assert by_country['Germany']['min_price'] == expected['min']
+    assert by_country['Germany']['max_price'] == expected['max']
+    assert by_country['Germany']['mean_price'] == pytest.approx(expected['mean'], rel=1e-9)
+    assert revenue == {country: aggregated['revenue'] for country, aggregated in by_country.items()}
+    assert sum([aggregated['sales'] for aggregated in by_country.values()]) == dp._n_rows
+
+    # the months of a country add up to the country
+    assert {key[1] for key in by_country_month} == {f'2015/{month:02d}' for month in range(1, 13)}
+    for country, aggregated in by_country.items():
+        months = [month_aggregated for key, month_aggregated in by_country_month.items() if key[0] == country]
+        assert sum([month['revenue'] for month in months]) == pytest.approx(aggregated['revenue'], rel=1e-9)
+        assert sum([month['sales'] for month in months]) == aggregated['sales']
+        assert max([month['max_price'] for month in months]) == aggregated['max_price']
+
+    merged = parts[0].merge(other=parts[1]).merge(other=parts[2]).get_result()
+    assert merged.keys() == by_country_month.keys()
+    for key, aggregated in by_country_month.items():
+        assert merged[key] == pytest.approx(aggregated, rel=1e-9)
+
+    # a group without any value of a column has no mean, min or max
+    grouped = GroupBy(group_by='Country', aggregates=aggregates)
+    grouped.update_batch(batch={'Country': np.array(['India', 'Japan'], dtype=object),
+                                'TotalPrice': np.array([1.5, np.nan]), 'UnitPrice': np.array([0.5, np.nan])})
+    assert grouped.get_result()['Japan'] == {'revenue': 0.0, 'sales': 0, 'mean_price': None, 'min_price': None,
+                                             'max_price': None}
+
+    # key columns with more combinations than an int64 can encode (50000 ** 4 > 2 ** 62)
+    rng = np.random.default_rng(0)
+    n_rows = 50000
+    batch = {name: np.array([f'{name}{n}' for n in range(n_rows)], dtype=object)[rng.permutation(n_rows)]
+             for name in ['A', 'B', 'C', 'D']}
+    batch['TotalPrice'] = rng.random(n_rows)
+    grouped = GroupBy(group_by=['A', 'B', 'C', 'D'], aggregates={'revenue': ('sum', 'TotalPrice')})
+    grouped.update_batch(batch=batch)
+    grouped.update_batch(batch={name: column[:100] for name, column in batch.items()})
+
+    revenue = grouped.get_aggregate(name='revenue')
+    assert len(revenue) == n_rows
+    for n_row in range(100):
+        key = (batch['A'][n_row], batch['B'][n_row], batch['C'][n_row], batch['D'][n_row])
+        assert revenue[key] == pytest.approx(2 * batch['TotalPrice'][n_row])
+
+    with pytest.raises(ValueError):
+        GroupBy(group_by='Country', aggregates={'revenue': ('median', 'TotalPrice')})
@@ -1,14 +1,148 @@
 from typing import Dict
 import numpy as np
-from typing import Generator, List
+from typing import Generator, Iterable, List, Sequence, Tuple, Optional, BinaryIO, Union
+from collections.abc import Mapping
+from itertools import islice, compress
+from operator import itemgetter
+from w1.schema import Schema, ColumnConverter, SALES_SCHEMA
+from w1.cache import ColumnCache, CacheBatch
+from w1.predicates import Predicate, to_predicates
+from w1.zone_map import ZoneMap
+from w1.sketch import QuantileSketch, DEFAULT_SKETCH_K
+from w1.histogram import Histogram
+from contextlib import contextmanager
+from array import array
+import threading
+import csv
+import queue
+import mmap
+import gc
+import json
+import gzip
+import bz2
+import lzma
+import sys
+import io
 import os
+import constants
 
 CURRENT_FOLDER = os.path.dirname(os.path.abspath(__file__))
 
+# number of rows read per block by `DataReader.iter_batches`
+DEFAULT_BATCH_ROWS = 100000
+
+# bytes per row used to size the first window scanned by the mmap mode, the window grows if a row doesn't fit
+MMAP_ROW_BYTES_GUESS = 128
+
+# bytes read at once when counting rows, and bytes sampled to estimate the number of rows
+COUNT_BLOCK_BYTES = 1 << 24
+ESTIMATE_SAMPLE_BYTES = 1 << 20
+
+# decompressors of the compressed files that can be read (streamed) without unpacking them first
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+# compressed files are decompressed on a background thread in blocks of this size, a few blocks ahead of parsing
+READ_BLOCK_BYTES = 1 << 22
+N_READ_AHEAD_BLOCKS = 4
+
+# types of the rows returned when iterating over a `DataReader`
+DICT_ROWS = 'dict'
+TUPLE_ROWS = 'tuple'
+
+# modes of `Stats`, every value is kept for exact percentiles, only running moments in constant memory, or the
+# running moments and a quantile sketch for approximate percentiles in bounded memory
+EXACT_STATS = 'exact'
+STREAMING_STATS = 'streaming'
+SKETCH_STATS = 'sketch'
+STATS_MODES = [EXACT_STATS, STREAMING_STATS, SKETCH_STATS]
+
+NEWLINE = ord('\n')
+CARRIAGE_RETURN = ord('\r')
+
+
+def merge_sums(totals: Iterable[Mapping[str, float]]) -> Dict[str, float]:
+    """
+    Add up per key totals, e.g. the revenue per region of the parts of a file or of several files. The order the
+    totals come in doesn't matter, so partial results can be combined in any grouping.
+
+    merge_sums(totals=[{'India': 4.5, 'Russia': 2.0}, {'India': 1.0}]) -> {'India': 5.5, 'Russia': 2.0}
+    """
+    merged = dict()
+    for part in totals:
+        for key, total in part.items():
+            merged[key] = merged.get(key, 0) + total
+
+    return merged
+
+
+# pauses of the garbage collector in progress in any thread, and whether it was on before the first of them
+_GC_PAUSES = {'count': 0, 'was_enabled': True}
+_GC_LOCK = threading.Lock()
+
+
+@contextmanager
+def paused_gc() -> Generator:
+    # pause the cyclic garbage collector while a block allocates many small objects. The pause holds for the whole
+    # process, so nested pauses and those of other threads are counted: the collector is only turned back on (if it
+    # was on) when the last of them ends. It must only wrap the parsing itself and never a `yield`.
+    with _GC_LOCK:
+        if _GC_PAUSES['count'] == 0:
+            _GC_PAUSES['was_enabled'] = gc.isenabled()
+            gc.disable()
+        _GC_PAUSES['count'] += 1
+
+    try:
+        yield
+    finally:
+        with _GC_LOCK:
+            _GC_PAUSES['count'] -= 1
+            if _GC_PAUSES['count'] == 0 and _GC_PAUSES['was_enabled']:
+                gc.enable()
+
+
+def parse_quoted_lines(lines: List[str], sep: str) -> List[List[str]]:
+    """
+    Fields of lines holding quoted fields, with a single pass of the C level `csv` reader (RFC 4180): a field in
+    double quotes can hold the separator, and a double quote inside it is written twice. A quoted field can't hold a
+    line break, when a quote left open runs on into the next line the lines are parsed one at a time instead.
+    """
+    rows = list(csv.reader(lines, delimiter=sep))
+    if len(rows) != len(lines):
+        rows = [next(csv.reader([line], delimiter=sep), []) for line in lines]
+
+    return rows
+
 
 class Stats:
-    def __init__(self) -> None:
-        self._vals = []
+    """
+    Summary stats of the values of a column, fed one value (`update_stats`) or one batch (`update_batch`) at a time
+
+    The default `EXACT_STATS` mode keeps every value (8 bytes each, in an `array('d')`) to compute exact
+    percentiles, its memory grows with the file. The 25th, 50th (the median) and 75th percentiles come out of a
+    single `np.partition` of the values.
+    `STREAMING_STATS` only keeps a running count, min, max, mean and M2 (Welford's method, batches and merged
+    parts are folded in with Chan's formula), so mean and std take constant memory and no final pass, and the
+    percentiles are left as None.
+
+    `SKETCH_STATS` keeps the same running moments plus a `QuantileSketch` of about `3 * sketch_k` values for
+    approximate percentiles, `get_stats` then also reports 'quantile_error': the bound on the rank error of the
+    percentiles as a share of the values (see `QuantileSketch.get_rank_error`).
+
+    In any mode an empty `histogram` (see `Histogram.fixed` and `Histogram.log`) adds the shape of the values:
+    the stats count them in a histogram with the same buckets, and `get_stats` reports its non-empty buckets
+    under 'histogram'.
+    """
+    def __init__(self, mode: str = EXACT_STATS, sketch_k: int = DEFAULT_SKETCH_K,
+                 histogram: Optional[Histogram] = None) -> None:
+        if mode not in STATS_MODES:
+            raise ValueError(f"Unknown stats mode {mode}, expected one of {STATS_MODES}")
+
+        self._mode = mode
+        self._vals = array('d')
+        self._sketch = QuantileSketch(k=sketch_k) if mode == SKETCH_STATS else None
+        self._histogram = histogram.get_empty() if histogram is not None else None
+        self._count = 0
+        self._m2 = 0.0
         self._min = None
         self._max = None
         self._mean = None
@@ -25,15 +159,37 @@ class Stats:
         except:
             return None
 
+    def __getstate__(self) -> Dict:
+        # only what the stats are computed from is pickled, e.g. when a worker process sends back partial stats
+        if self._sketch is not None:
+            self._sketch.flush()
+
+        state = dict(self.__dict__)
+        for name in ['_median', '_std', '_25', '_50', '_75'] + (['_mean'] if self._mode == EXACT_STATS else []):
+            state[name] = None
+
+        return state
+
+    def get_mode(self) -> str:
+        return self._mode
+
+    def get_sketch_k(self) -> int:
+        return self._sketch.get_k() if self._sketch is not None else DEFAULT_SKETCH_K
+
+    def get_histogram(self) -> Optional[Histogram]:
+        return self._histogram
+
+    def get_empty(self) -> 'Stats':
+        # stats with the same settings and no values, e.g. to merge partial stats into
+        return Stats(mode=self._mode, sketch_k=self.get_sketch_k(), histogram=self._histogram)
+
     def get_stats(self) -> Dict:
         # calculate mean, std and percentiles only when required
         self.calculate_mean()
         self.calculate_std()
-        self.calculate_25()
-        self.calculate_50()
-        self.calculate_75()
+        self.calculate_percentiles()
 
-        return {
+        stats = {
             'min': self._min,
             'max': self._max,
             'mean': self._mean,
@@ -43,6 +199,12 @@ class Stats:
             '50': self._50,
             '75': self._75
         }
+        if self._mode == SKETCH_STATS:
+            stats['quantile_error'] = self._sketch.get_rank_error()
+        if self._histogram is not None:
+            stats['histogram'] = self._histogram.get_buckets()
+
+        return stats
 
     def update_min(self, val: float) -> None:
         if self._min is None:
@@ -59,35 +221,348 @@ class Stats:
             self._max = val
 
     def calculate_mean(self) -> None:
-        self._mean = sum(self._vals) / len(self._vals)
+        # the streaming mode keeps the mean up to date
+        if self._mode == EXACT_STATS:
+            self._mean = float(np.frombuffer(self._vals).mean()) if self._vals else None
 
     def calculate_std(self) -> None:
-        self._std = np.std(self._vals)
+        if self._mode != EXACT_STATS:
+            self._std = float(np.sqrt(self._m2 / self._count)) if self._count > 0 else None
+            return
+
+        self._std = np.std(np.frombuffer(self._vals)) if self._vals else None
+
+    def calculate_percentiles(self) -> None:
+        # the streaming mode has no percentiles
+        if self._mode == STREAMING_STATS:
+            return
+
+        self._25, self._50, self._75 = self.get_percentiles(percentiles=[25, 50, 75])
+        self._median = self._50
 
     def calculate_25(self) -> None:
-        self._25 = np.percentile(self._vals, 25)
+        self._25 = self.get_percentiles(percentiles=[25])[0]
 
     def calculate_50(self) -> None:
-        self._50 = np.percentile(self._vals, 50)
+        self._50 = self._median = self.get_percentiles(percentiles=[50])[0]
 
     def calculate_75(self) -> None:
-        self._75 = np.percentile(self._vals, 75)
+        self._75 = self.get_percentiles(percentiles=[75])[0]
+
+    def get_percentiles(self, percentiles: Sequence[float]) -> List[Optional[float]]:
+        """
+        Percentiles (0 to 100) of the values, None when there is none (or in the streaming mode)
+
+        The exact mode partitions a copy of the values once around all the positions the percentiles need, and
+        interpolates between neighbours like `np.percentile` (its default 'linear' method) does, instead of a
+        sort or selection per percentile.
+        """
+        if self._mode == SKETCH_STATS:
+            return self._sketch.get_quantiles(qs=[percentile / 100 for percentile in percentiles])
+        if self._mode == STREAMING_STATS or not self._vals:
+            return [None] * len(percentiles)
+
+        vals = np.array(self._vals, dtype=np.float64)
+        positions = np.asarray(percentiles, dtype=np.float64) / 100 * (len(vals) - 1)
+        lows = np.floor(positions).astype(np.int64)
+        highs = np.minimum(lows + 1, len(vals) - 1)
+        vals.partition(np.unique(np.concatenate([lows, highs])))
+
+        low_vals, high_vals, fractions = vals[lows], vals[highs], positions - lows
+        return np.where(fractions >= 0.5, high_vals - (high_vals - low_vals) * (1 - fractions),
+                        low_vals + (high_vals - low_vals) * fractions).tolist()
 
     def update_stats(self, val) -> None:
         val = self.to_float(val)
-        if val is None:
+        if val is None or np.isnan(val):
             return
 
-        self._vals.append(val)
+        if self._mode != EXACT_STATS:
+            # Welford's update of the running mean and sum of squared differences from it
+            self._count += 1
+            delta = val - (self._mean or 0.0)
+            self._mean = (self._mean or 0.0) + delta / self._count
+            self._m2 += delta * (val - self._mean)
+        else:
+            self._vals.append(val)
+
+        if self._mode == SKETCH_STATS:
+            self._sketch.add(val=val)
+        if self._histogram is not None:
+            self._histogram.update(vals=np.array([val]))
+
         self.update_min(val=val)
         self.update_max(val=val)
 
+    def update_moments(self, count: int, mean: float, m2: float) -> None:
+        # fold the count, mean and M2 of another set of values into the running ones (Chan et al.)
+        if count == 0:
+            return
+
+        total = self._count + count
+        delta = mean - (self._mean or 0.0)
+        self._mean = (self._mean or 0.0) + delta * count / total
+        self._m2 += m2 + delta * delta * self._count * count / total
+        self._count = total
+
+    def merge(self, other: 'Stats') -> 'Stats':
+        # fold the values seen by `other` (e.g. another part of the same file) into these stats
+        if other._mode != self._mode:
+            raise ValueError(f"Can't merge {other._mode} stats into {self._mode} stats")
+        if (other._histogram is None) != (self._histogram is None):
+            raise ValueError("Can't merge stats with a histogram and stats without one")
+
+        if self._mode != EXACT_STATS:
+            self.update_moments(count=other._count, mean=other._mean, m2=other._m2)
+        else:
+            self._vals.extend(other._vals)
+
+        if self._mode == SKETCH_STATS:
+            self._sketch.merge(other=other._sketch)
+        if self._histogram is not None:
+            self._histogram.merge(other=other._histogram)
+
+        if other._min is not None:
+            self.update_min(val=other._min)
+        if other._max is not None:
+            self.update_max(val=other._max)
+
+        return self
+
+    @classmethod
+    def to_float_array(cls, vals: np.ndarray) -> np.ndarray:
+        # float64 values of a column batch, NaN where a value (e.g. of a STR column) can't be converted
+        vals = np.asarray(vals)
+        if vals.dtype.kind in 'fiub':
+            return vals.astype(np.float64, copy=False)
+
+        try:
+            return vals.astype(np.float64)
+        except (ValueError, TypeError):
+            return np.array([cls.to_float(val) for val in vals.tolist()], dtype=np.float64)
+
+    def update_batch(self, vals: np.ndarray) -> None:
+        """
+        Fold a whole column batch in at once: count, min, max, the running moments or the kept values and the
+        quantile sketch are all updated with a few NumPy calls instead of a Python call per value (`update_stats`)
+
+        NaN marks a value that couldn't be converted to float, those are skipped like `update_stats` skips None
+        """
+        vals = self.to_float_array(vals=vals)
+        vals = vals[~np.isnan(vals)]
+        if vals.size == 0:
+            return
+
+        if self._mode != EXACT_STATS:
+            mean = float(vals.mean())
+            self.update_moments(count=vals.size, mean=mean, m2=float(np.square(vals - mean).sum()))
+        else:
+            self._vals.frombytes(vals.tobytes())
+
+        if self._mode == SKETCH_STATS:
+            self._sketch.update(vals=vals)
+        if self._histogram is not None:
+            self._histogram.update(vals=vals)
+
+        self.update_min(val=float(vals.min()))
+        self.update_max(val=float(vals.max()))
+
+
+def is_compressed(fp: str) -> bool:
+    return os.path.splitext(fp)[1] in COMPRESSED_OPENERS
+
+
+def count_block_rows(block: bytes, tail: bytes = b'\n\n') -> int:
+    """
+    Number of rows ended by the new lines of a block of bytes, `tail` holds the 2 bytes read before it. Blank lines
+    don't make a row, as when the file is parsed, so the count matches the one of the columnar cache.
+    """
+    data = np.frombuffer(tail + block, dtype=np.uint8)
+    line_ends = np.flatnonzero(data[len(tail):] == NEWLINE) + len(tail)
+
+    before = data[line_ends - 1]
+    is_blank = (before == NEWLINE) | ((before == CARRIAGE_RETURN) & (data[line_ends - 2] == NEWLINE))
+    return len(line_ends) - int(np.count_nonzero(is_blank))
+
+
+def open_file(fp: str) -> BinaryIO:
+    """
+    Open a plain or compressed (.gz, .bz2, .xz) file for binary reading. Compressed files are decompressed by a
+    `BackgroundReader` while the caller parses what is already decompressed.
+    """
+    if not is_compressed(fp):
+        return open(fp, "rb")
+
+    decompressed = COMPRESSED_OPENERS[os.path.splitext(fp)[1]](fp, "rb")
+    return io.BufferedReader(BackgroundReader(f=decompressed), buffer_size=READ_BLOCK_BYTES)
+
+
+class BackgroundReader(io.RawIOBase):
+    """
+    Reads a file object block by block on a background thread and hands the blocks over through a bounded queue, so
+    decompressing the next blocks of a compressed file overlaps with parsing the current one
+    """
+    def __init__(self, f: BinaryIO, block_bytes: int = READ_BLOCK_BYTES, n_blocks: int = N_READ_AHEAD_BLOCKS) -> None:
+        super().__init__()
+        self._f = f
+        self._block_bytes = block_bytes
+        self._blocks = queue.Queue(maxsize=n_blocks)
+        self._pending = memoryview(b'')
+        self._eof = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_blocks, daemon=True)
+        self._thread.start()
+
+    def _read_blocks(self) -> None:
+        try:
+            while not self._stop.is_set():
+                block = self._f.read(self._block_bytes)
+                self._put(item=block)
+                if not block:
+                    return
+        except Exception as e:
+            # raised again in the thread reading the blocks
+            self._put(item=e)
+
+    def _put(self, item) -> None:
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if not self._pending:
+            if self._eof:
+                return 0
+
+            block = self._blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                self._eof = True
+                return 0
+
+            self._pending = memoryview(block)
+
+        n_bytes = min(len(b), len(self._pending))
+        b[:n_bytes] = self._pending[:n_bytes]
+        self._pending = self._pending[n_bytes:]
+
+        return n_bytes
+
+    def close(self) -> None:
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._f.close()
+
+        super().close()
+
+
+def split_file(fp: str, n_parts: int, byte_range: Optional[Tuple[int, int]] = None) -> List[Tuple[int, int]]:
+    """
+    Cut the data rows of a file (everything after the column names row) into at most `n_parts` byte ranges of about
+    the same size. Every range starts at the beginning of a row and ends right after a new line (or at the end of
+    the file), so the ranges can be handed to `DataReader(byte_range=...)` and each row is read exactly once.
+
+    With `byte_range` (itself starting at a row) only that part of the file is cut.
+
+    A compressed file can only be streamed from the start, so it is never split.
+    """
+    if is_compressed(fp):
+        return [(0, sys.maxsize)]
+
+    with open(fp, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        f.readline()
+        header_end = f.tell()
+
+        if byte_range is not None:
+            header_end, size = max(byte_range[0], header_end), min(byte_range[1], size)
+
+        boundaries = [header_end]
+        for n_part in range(1, n_parts):
+            guess = header_end + (size - header_end) * n_part // n_parts
+            if guess <= boundaries[-1]:
+                continue
+
+            # move the boundary forward to the start of the next row
+            f.seek(guess - 1)
+            f.readline()
+            if boundaries[-1] < f.tell() < size:
+                boundaries.append(f.tell())
+
+        boundaries.append(size)
+
+    return [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start]
+
+
+class Row(Mapping):
+    """
+    Compact read only row - the values are kept in one tuple and the column names are shared by all the rows of a
+    file through the class made by `make_row_type`, instead of every row carrying a dict of its own. It is a
+    Mapping, so `row['TotalPrice']`, `row.get(...)`, `dict(row)` and comparing to a dict work as with dict rows,
+    and `row[4]` reads the value at a position.
+    """
+    __slots__ = ('_vals',)
+    _fields: Tuple[str, ...] = ()
+    _index: Dict[str, int] = {}
+
+    def __init__(self, vals: Tuple) -> None:
+        self._vals = vals
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._vals[key]
+
+        return self._vals[self._index[key]]
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({dict(zip(self._fields, self._vals))})'
+
+    def get_values(self) -> Tuple:
+        return self._vals
+
+
+def make_row_type(fields: Sequence[str]) -> type:
+    # one `Row` class per set of column names, so the rows themselves only hold their values
+    fields = tuple(fields)
+    return type('Row', (Row,), {'__slots__': (), '_fields': fields,
+                                '_index': {field: ind for ind, field in enumerate(fields)}})
+
 
 class DataReader:
-    def __init__(self, fp: str, sep: str, col_names: List) -> None:
+    def __init__(self, fp: str, sep: str, col_names: List, use_mmap: bool = False,
+                 byte_range: Optional[Tuple[int, int]] = None, columns: Optional[List[str]] = None,
+                 schema: Schema = SALES_SCHEMA, use_cache: bool = False, row_type: str = DICT_ROWS,
+                 use_zone_map: bool = False) -> None:
+        if row_type not in (DICT_ROWS, TUPLE_ROWS):
+            raise ValueError(f"Unknown row type {row_type}, choose from {DICT_ROWS} or {TUPLE_ROWS}")
+
         self._fp = fp
         self._sep = sep
         self._col_names = col_names
+        self._use_mmap = use_mmap
+        self._byte_range = byte_range
+        self._columns = self.resolve_columns(columns=columns)
+        self._schema = schema
+        self._converters = schema.compile(col_names=col_names)
+        self._use_cache = use_cache
+        self._cache = ColumnCache(fp=fp, sep=sep, col_names=col_names, schema=schema)
+        self._row_type = row_type
+        self._use_zone_map = use_zone_map
+        self._zone_map = ZoneMap(fp=fp, sep=sep, col_names=col_names, schema=schema)
 
     def __iter__(self) -> Generator:
         """
@@ -110,22 +585,504 @@ class DataReader:
             'TotalPrice': 79.84,
             'Country': 'Russia',
         }
+
+        With `row_type=TUPLE_ROWS` the rows are compact `Row` objects with the same keys instead of dicts.
+        """
+        max_split = self.get_max_split(col_index=self._columns)
+
+        if self._row_type == TUPLE_ROWS:
+            yield from self._iter_tuple_rows(max_split=max_split)
+            return
+
+        for n_row, row in enumerate(self._iter_lines()):
+            row_vals = self.split_line(line=row, max_split=max_split)
+
+            # define the row_vals dictionary
+            row_vals = {col_name: row_vals[ind] for col_name, ind in self._columns.items()}
+            row_vals['n_row'] = n_row
+
+            # return results:
+            yield row_vals
+
+    def _iter_tuple_rows(self, max_split: int) -> Generator:
+        row_type = make_row_type(fields=list(self._columns) + ['n_row'])
+        # picks the projected values out of a split row in one C call
+        get_vals = itemgetter(*self._columns.values(), 0)
+
+        for n_row, row in enumerate(self._iter_lines()):
+            row_vals = get_vals(self.split_line(line=row, max_split=max_split))
+            yield row_type(row_vals[:-1] + (n_row,))
+
+    def iter_batches(self, batch_rows: int = DEFAULT_BATCH_ROWS, columns: Optional[List[str]] = None,
+                     where: Union[Predicate, List[Predicate], None] = None) -> Generator:
+        """
+        Input : batch_rows (int), columns (List[str]), where (Predicate or List[Predicate])
+        Output : Generator
+
+        Columnar alternative to `__iter__`. The column names row is skipped and the rest of the file is read in blocks
+        of `batch_rows` rows. Every block is returned as a Dict mapping the column name to a numpy array with the
+        values of that column:
+
+        {
+            'StockCode': array(['22180', '23017'], dtype=object),
+            'Description': array(['RETROSPOT LAMP', 'APOTHECARY JAR'], dtype=object),
+            'UnitPrice': array([19.96, 24.96]),
+            'Quantity': array([4., 1.]),
+            'TotalPrice': array([79.84, 24.96]),
+            'Country': array(['Russia', 'Germany'], dtype=object),
+        }
+
+        Values are converted in bulk following the reader's `schema`: FLOAT columns become float64 arrays, STR
+        columns object arrays of str. Bad values are handled by the column's policy (NaN/None by default) and counted,
+        see `get_rejected_counts`.
+
+        With `use_mmap` the file is memory mapped instead and every batch is a `MmapBatch`, which only decodes a
+        column the first time it is looked up (see its memory cost there).
+
+        With `use_cache` the batches are served from the columnar sidecar cache of the file while it is up to date
+        (see `build_cache`), otherwise the file is parsed as usual.
+
+        With `byte_range` only the rows inside that part of the file are read (see `split_file`).
+
+        Only the `columns` asked for (by default the `columns` the reader was created with, or all of them) are
+        converted and returned.
+
+        With `where` only the rows matching all the predicates are returned (see `w1/predicates.py`), e.g.
+        `where=[Eq('Country', 'Germany'), Between('Date', '2015/07/01', '2015/09/30')]`. The predicates run before
+        the rest of the row is converted: text lines that can't hold an Eq/In value are dropped before they are
+        split, STR columns are compared as raw bytes in mmap mode and as distinct values in the cache, and the other
+        columns are only converted for the matching rows. Blocks without any matching row are skipped.
+
+        With `use_zone_map` the zones of rows whose min/max rule out a match are never read at all, while the zone
+        map of the file is up to date (see `build_zone_map`).
         """
-    ######################################## YOUR CODE HERE ##################################################
-        # output generator -- use 'yield' keyword 
-        # generate each row: dictionary comprehension
-        
-        for n_row, row in enumerate(open(self._fp, "r")):
-            row_vals = row.strip('\n').split(self._sep)
-            
-            # define the row_vals dictionary 
-            row_vals = #### [YOUR CODE HERE] ####
-            row_vals['n_row'] = #### [YOUR CODE HERE] ####
-
-            # return results: 
-            #### [YOUR CODE HERE] ####
-    
-    ######################################## YOUR CODE HERE ##################################################
+        col_index = self._columns if columns is None else self.resolve_columns(columns=columns)
+
+        for converter in self._converters.values():
+            converter.n_rejected = 0
+
+        predicates = to_predicates(where)
+        if not predicates:
+            yield from self._iter_batches(batch_rows=batch_rows, col_index=col_index)
+            return
+
+        # the predicate columns are read as well but only the asked for columns are returned
+        scan_index = self.resolve_columns(columns=list(dict.fromkeys(
+            list(col_index) + [predicate.column for predicate in predicates])))
+
+        for batch in self._iter_batches(batch_rows=batch_rows, col_index=scan_index, predicates=predicates):
+            mask = self.evaluate_predicates(batch=batch, predicates=predicates)
+            if np.any(mask):
+                yield self.take_rows(batch=batch, mask=mask, col_names=list(col_index))
+
+    def _iter_batches(self, batch_rows: int, col_index: Dict[str, int],
+                      predicates: Sequence[Predicate] = ()) -> Generator:
+        # batches of all the rows from the cache, the memory map or the text lines - only from the zones that can
+        # match the `predicates`, and text lines are already narrowed down by them
+        manifest = self._cache.load_manifest() if self._use_cache else None
+        if manifest is not None:
+            # bad values were handled when the cache was built
+            for col_name, n_rejected in manifest['n_rejected'].items():
+                self._converters[col_name].n_rejected = n_rejected
+
+        for byte_range in self.get_scan_ranges(predicates=predicates):
+            if manifest is not None:
+                yield from self._cache.iter_batches(manifest=manifest, batch_rows=batch_rows, col_index=col_index,
+                                                    byte_range=self._byte_range if byte_range is None else byte_range)
+
+            # a compressed file can't be memory mapped, it is streamed instead
+            elif self._use_mmap and not is_compressed(self._fp):
+                yield from self._iter_mmap_batches(batch_rows=batch_rows, col_index=col_index, byte_range=byte_range)
+
+            else:
+                for lines in self._iter_line_blocks(batch_rows=batch_rows, byte_range=byte_range):
+                    lines = b''.join(lines).decode().split('\n')
+                    for predicate in predicates:
+                        needles = predicate.get_needles()
+                        if needles is not None and self._converters[predicate.column].keeps_raw_values():
+                            lines = [line for line in lines if any([needle in line for needle in needles])]
+
+                    yield self._lines_to_batch(lines=lines, col_index=col_index, predicates=predicates)
+
+    def get_scan_ranges(self, predicates: Sequence[Predicate]) -> List[Optional[Tuple[int, int]]]:
+        # parts of the byte range to read, None reads all of it
+        if not predicates or not self._use_zone_map or is_compressed(self._fp):
+            return [None]
+
+        zones = self._zone_map.load()
+        if zones is None:
+            return [None]
+
+        return self._zone_map.get_byte_ranges(zones=zones, predicates=predicates, byte_range=self._byte_range)
+
+    @staticmethod
+    def evaluate_predicates(batch: Mapping, predicates: Sequence[Predicate]) -> np.ndarray:
+        # rows of the batch matching all the predicates, lazy batches evaluate them without decoding the column
+        mask = None
+        for predicate in predicates:
+            if isinstance(batch, (MmapBatch, CacheBatch)):
+                matches = batch.evaluate(predicate=predicate)
+            else:
+                matches = predicate.evaluate(vals=batch[predicate.column])
+
+            mask = matches if mask is None else mask & matches
+
+        return mask
+
+    @staticmethod
+    def take_rows(batch: Mapping, mask: np.ndarray, col_names: List[str]) -> Mapping:
+        if isinstance(batch, (MmapBatch, CacheBatch)):
+            return batch.take(mask=mask, col_names=col_names)
+
+        return {col_name: batch[col_name][mask] for col_name in col_names}
+
+    def resolve_columns(self, columns: Optional[List[str]]) -> Dict[str, int]:
+        """
+        Map the name of every projected column to its position in a row. This is done once per file (or scan)
+        instead of once per row.
+        """
+        if columns is None:
+            columns = self._col_names
+
+        missing = [col_name for col_name in columns if col_name not in self._col_names]
+        if missing:
+            raise ValueError(f"Columns {missing} are not in {self._fp}, available columns are {self._col_names}")
+
+        return {col_name: self._col_names.index(col_name) for col_name in columns}
+
+    def get_max_split(self, col_index: Dict[str, int]) -> int:
+        # rows only need to be split up to the last projected column, the remaining text is left in one piece
+        last_ind = max(col_index.values(), default=0)
+        return last_ind + 1 if last_ind < len(self._col_names) - 1 else -1
+
+    def get_range_reader(self, byte_range: Tuple[int, int]) -> 'DataReader':
+        # reader with the same settings over another byte range of the file
+        return DataReader(fp=self._fp, sep=self._sep, col_names=self._col_names, use_mmap=self._use_mmap,
+                          byte_range=byte_range, columns=list(self._columns), schema=self._schema,
+                          use_cache=self._use_cache, row_type=self._row_type, use_zone_map=self._use_zone_map)
+
+    def split_line(self, line: str, max_split: int = -1) -> List[str]:
+        # plain split unless the line holds a quoted field
+        if constants.QUOTE_CHAR in line:
+            return next(csv.reader([line.rstrip('\r\n')], delimiter=self._sep), [''])
+
+        return line.rstrip('\r\n').split(self._sep, max_split)
+
+    def split_columns(self, lines: List[str], max_split: int = -1) -> List[Tuple[str, ...]]:
+        """
+        Split a block of lines into their fields and return the values of every column, empty lines are left out
+
+        Lines are cut with `str.split`, only the lines holding a quote go through the C level `csv` reader (see
+        `parse_quoted_lines`), all of them in one pass, e.g. `84029E,"RED WOOLLY HOTTIE, WHITE HEART",3.75`. A quoted
+        field can't hold a line break, rows are found by their new lines.
+
+        The garbage collector is paused while the lines are split, the hundreds of thousands of lists and str
+        created would otherwise set off a collection every few hundred rows although they can't form a cycle.
+        """
+        sep = self._sep
+        with paused_gc():
+            rows = [line.rstrip('\r\n').split(sep, max_split) if constants.QUOTE_CHAR not in line else None
+                    for line in lines if line.strip('\r\n')]
+
+            quoted_lines = [line.rstrip('\r\n') for line in lines if constants.QUOTE_CHAR in line]
+            if quoted_lines:
+                quoted_rows = iter(parse_quoted_lines(lines=quoted_lines, sep=sep))
+                rows = [row if row is not None else next(quoted_rows) for row in rows]
+
+        return list(zip(*rows))
+
+    def build_cache(self) -> None:
+        """
+        Parse the whole file once and write its columnar sidecar cache, later `use_cache` scans read the cache
+        instead of the file until the file changes
+        """
+        for converter in self._converters.values():
+            converter.n_rejected = 0
+
+        self._cache.write(batches=self._iter_batches_with_offsets(), get_rejected_counts=self.get_rejected_counts)
+
+    def has_valid_cache(self) -> bool:
+        return self._cache.is_valid()
+
+    def build_zone_map(self) -> None:
+        """
+        Parse the whole file once and write its zone map, used by the filtered scans with `use_zone_map` until the
+        file changes. Compressed files can't seek to a zone and get no zone map.
+        """
+        if is_compressed(self._fp):
+            return
+
+        self._zone_map.write(batches=self._iter_batches_with_offsets(columns=self._zone_map.get_columns()))
+
+    def has_valid_zone_map(self) -> bool:
+        return self._zone_map.is_valid()
+
+    def count_rows(self, estimate: bool = False) -> int:
+        """
+        Number of data rows in the file (or byte range) without parsing them. Taken from the columnar cache when it
+        is up to date, otherwise the new lines are counted over large binary blocks. The count of a whole file is
+        kept in the small `.<file name>.rows.json` file next to it until the file changes.
+
+        With `estimate` the size of the range is divided by the average length of the rows at its start instead,
+        which only reads the first `ESTIMATE_SAMPLE_BYTES` (plain files only).
+        """
+        manifest = self._cache.load_manifest()
+        if manifest is not None:
+            return self._cache.count_rows(manifest=manifest, byte_range=self._byte_range)
+
+        with open_file(self._fp) as f:
+            start, end = self.get_byte_range(f)
+
+            # the size of a compressed file says little about its number of rows, those are always counted
+            if estimate and not is_compressed(self._fp):
+                return self._estimate_rows(f=f, start=start, end=end)
+
+            file_stat = os.stat(self._fp)
+            signature = {'file_size': file_stat.st_size, 'file_mtime_ns': file_stat.st_mtime_ns}
+            counts_fp = os.path.join(os.path.dirname(os.path.abspath(self._fp)),
+                                     f'.{os.path.basename(self._fp)}.rows.json')
+
+            if self._byte_range is None:
+                try:
+                    with open(counts_fp) as counts_f:
+                        counts = json.loads(counts_f.read())
+                    if all([counts.get(key) == val for key, val in signature.items()]):
+                        return counts['n_rows']
+                except (OSError, ValueError):
+                    pass
+
+            n_rows = self._count_new_lines(f=f, start=start, end=end)
+
+        if self._byte_range is None:
+            try:
+                with open(counts_fp, 'w') as counts_f:
+                    counts_f.write(json.dumps(dict(signature, n_rows=n_rows)))
+            except OSError:
+                pass
+
+        return n_rows
+
+    @staticmethod
+    def _count_new_lines(f: BinaryIO, start: int, end: int) -> int:
+        n_rows = 0
+        # the range starts right after a new line
+        tail = b'\n\n'
+
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(COUNT_BLOCK_BYTES, remaining))
+            if not block:
+                break
+
+            n_rows += count_block_rows(block=block, tail=tail)
+            tail = (tail + block[-2:])[-2:]
+            remaining -= len(block)
+
+        # the last row of the file may not be terminated by a new line
+        return n_rows + (tail[-1:] != b'\n')
+
+    @staticmethod
+    def _estimate_rows(f: BinaryIO, start: int, end: int) -> int:
+        sample = f.read(min(ESTIMATE_SAMPLE_BYTES, end - start))
+        n_sample_rows = count_block_rows(block=sample) + (sample[-1:] not in (b'', b'\n'))
+
+        if len(sample) < ESTIMATE_SAMPLE_BYTES or n_sample_rows == 0:
+            # the sample is the whole range (or a single row)
+            return n_sample_rows
+
+        return round((end - start) * n_sample_rows / len(sample))
+
+    def _iter_batches_with_offsets(self, columns: Optional[List[str]] = None) -> Generator:
+        # all the (or the asked for) columns of the whole file together with the byte offset where every row starts
+        col_index = self.resolve_columns(columns=columns)
+
+        with open_file(self._fp) as f:
+            position, _ = self.get_byte_range(f, full_file=True)
+
+        for lines in self._iter_line_blocks(batch_rows=DEFAULT_BATCH_ROWS, full_file=True):
+            line_lens = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+            line_starts = position + np.cumsum(line_lens) - line_lens
+            position += int(line_lens.sum())
+
+            # empty lines don't make a row
+            is_row = np.array([bool(line.strip(b'\r\n')) for line in lines], dtype=bool)
+            lines = [line for line, keep in zip(lines, is_row) if keep]
+
+            yield (self._lines_to_batch(lines=b''.join(lines).decode().split('\n'), col_index=col_index),
+                   line_starts[is_row])
+
+    def get_byte_range(self, f: BinaryIO, full_file: bool = False,
+                       byte_range: Optional[Tuple[int, int]] = None) -> Tuple[int, int]:
+        """
+        Start and end offset of the data rows to read, the column names row is never part of the range. `f` has to
+        be freshly opened with `open_file` and is left at the start offset.
+
+        `byte_range` reads a part of the reader's range instead, e.g. the zones a filtered scan can't skip.
+
+        The size of a compressed file isn't known before it is read, its range ends at `sys.maxsize`.
+        """
+        header_end = len(f.readline())
+        size = sys.maxsize if is_compressed(self._fp) else os.path.getsize(self._fp)
+
+        byte_range = self._byte_range if byte_range is None else byte_range
+        if byte_range is None or full_file:
+            return header_end, size
+
+        start, end = max(byte_range[0], header_end), min(byte_range[1], size)
+        if start > header_end:
+            if is_compressed(self._fp):
+                raise ValueError(f"{self._fp} is compressed and can only be read from the start")
+            f.seek(start)
+
+        return start, end
+
+    def _iter_lines(self) -> Generator:
+        # column names row first, then the data rows inside the byte range
+        with open_file(self._fp) as f:
+            yield f.readline().decode()
+
+        for lines in self._iter_line_blocks(batch_rows=DEFAULT_BATCH_ROWS):
+            for line in lines:
+                yield line.decode()
+
+    def _iter_line_blocks(self, batch_rows: int, full_file: bool = False,
+                          byte_range: Optional[Tuple[int, int]] = None) -> Generator:
+        with open_file(self._fp) as f:
+            start, end = self.get_byte_range(f, full_file=full_file, byte_range=byte_range)
+
+            remaining = end - start
+            while remaining > 0:
+                lines = list(islice(f, batch_rows))
+                if not lines:
+                    return
+
+                n_bytes = sum(map(len, lines))
+                if n_bytes > remaining:
+                    # drop the lines past the end of the byte range
+                    n_bytes = 0
+                    for n_line, line in enumerate(lines):
+                        n_bytes += len(line)
+                        if n_bytes >= remaining:
+                            lines = lines[:n_line + 1]
+                            break
+
+                remaining -= n_bytes
+                yield lines
+
+    def _lines_to_batch(self, lines: List[str], col_index: Dict[str, int],
+                        predicates: Sequence[Predicate] = ()) -> Dict:
+        max_split = self.get_max_split(col_index=col_index)
+        columns = self.split_columns(lines=lines, max_split=max_split)
+        if not columns:
+            columns = [() for _ in self._col_names]
+
+        if not predicates:
+            return {col_name: self._converters[col_name](columns[ind]) for col_name, ind in col_index.items()}
+
+        # the predicate columns are converted first, the other columns only for the rows matching them
+        batch = {col_name: self._converters[col_name](columns[col_index[col_name]])
+                 for col_name in dict.fromkeys([predicate.column for predicate in predicates])}
+        mask = self.evaluate_predicates(batch=batch, predicates=predicates)
+
+        return {col_name: batch[col_name][mask] if col_name in batch else
+                self._converters[col_name](list(compress(columns[ind], mask)))
+                for col_name, ind in col_index.items()}
+
+    def _iter_mmap_batches(self, batch_rows: int, col_index: Dict[str, int],
+                           byte_range: Optional[Tuple[int, int]] = None) -> Generator:
+        with open(self._fp, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+
+            start, end = self.get_byte_range(f, byte_range=byte_range)
+
+            # the map is closed once the last batch referencing its bytes is garbage collected
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        buf = np.frombuffer(mm, dtype=np.uint8)[:end]
+
+        window = batch_rows * MMAP_ROW_BYTES_GUESS
+        while start < len(buf):
+            block = buf[start:start + window]
+            line_ends = np.flatnonzero(block == NEWLINE)
+
+            if start + len(block) == len(buf) and (len(line_ends) == 0 or line_ends[-1] != len(block) - 1):
+                # the last row of the file isn't terminated by a new line
+                line_ends = np.append(line_ends, len(block))
+
+            if len(line_ends) == 0:
+                # a single row is longer than the window
+                window *= 2
+                continue
+
+            line_ends = line_ends[:batch_rows]
+            yield self._mmap_batch(block=block[:line_ends[-1]], line_ends=line_ends, col_index=col_index)
+
+            start += int(line_ends[-1]) + 1
+
+    def _mmap_batch(self, block: np.ndarray, line_ends: np.ndarray, col_index: Dict[str, int]) -> Mapping:
+        n_rows = len(line_ends)
+        n_seps = len(self._col_names) - 1
+        seps = np.flatnonzero(block == ord(self._sep))
+        sep_rows = np.searchsorted(line_ends, seps)
+
+        # every row should hold exactly one separator less than the number of columns. The other rows (empty,
+        # ragged rows or rows with a quoted field, which can hold a separator) are parsed one by one below.
+        quotes = np.flatnonzero(block == ord(constants.QUOTE_CHAR))
+        quotes = quotes[(quotes == 0) | np.isin(block[quotes - 1], (ord(self._sep), NEWLINE))]
+
+        is_irregular = np.bincount(sep_rows, minlength=n_rows)[:n_rows] != n_seps
+        is_irregular[np.searchsorted(line_ends, quotes)] = True
+
+        line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+        # leave out the carriage return of windows line endings
+        line_stops = line_ends - ((line_ends > line_starts) & (block[np.maximum(line_ends - 1, 0)] == CARRIAGE_RETURN))
+
+        starts = np.empty((n_rows, n_seps + 1), dtype=np.int64)
+        ends = np.empty((n_rows, n_seps + 1), dtype=np.int64)
+        regular_seps = seps[~is_irregular[sep_rows]].reshape(-1, n_seps)
+        starts[~is_irregular] = np.column_stack((line_starts[~is_irregular], regular_seps + 1))
+        ends[~is_irregular] = np.column_stack((regular_seps, line_stops[~is_irregular]))
+
+        if not np.any(is_irregular):
+            return MmapBatch(buf=block, starts=starts, ends=ends, col_index=col_index, converters=self._converters)
+
+        buf, is_row = self._parse_irregular_rows(block=block, starts=starts, ends=ends, is_irregular=is_irregular,
+                                                 line_starts=line_starts, line_stops=line_stops)
+
+        return MmapBatch(buf=buf, starts=starts[is_row], ends=ends[is_row], col_index=col_index,
+                         converters=self._converters)
+
+    def _parse_irregular_rows(self, block: np.ndarray, starts: np.ndarray, ends: np.ndarray, is_irregular: np.ndarray,
+                              line_starts: np.ndarray, line_stops: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Parse the rows of a mmap block that can't be cut at their separators with the `csv` reader, one row at a
+        time, so a few quoted rows don't send the whole block to the text path. Their unquoted fields are appended
+        to a copy of the block and the `starts`/`ends` of those rows are set to point at them. Missing fields of a
+        ragged row are empty, extra ones are left out.
+
+        Returns the new buffer and the rows to keep, empty lines don't make a row.
+        """
+        n_cols = starts.shape[1]
+        rows = np.flatnonzero(is_irregular)
+        lines = block[line_starts[rows[0]]:line_stops[rows[-1]]].tobytes()
+        offset = int(line_starts[rows[0]])
+
+        is_row = np.ones(len(starts), dtype=bool)
+        extra = bytearray()
+        for row, fields in zip(rows.tolist(), parse_quoted_lines(
+                lines=[lines[line_starts[row] - offset:line_stops[row] - offset].decode() for row in rows.tolist()],
+                sep=self._sep)):
+            if not fields:
+                is_row[row] = False
+                continue
+
+            for n_field, field in enumerate((fields + [''] * n_cols)[:n_cols]):
+                starts[row, n_field] = len(block) + len(extra)
+                extra += field.encode()
+                ends[row, n_field] = len(block) + len(extra)
+
+        return np.concatenate([block, np.frombuffer(bytes(extra), dtype=np.uint8)]), is_row
 
     def get_file_path(self):
         return self._fp
@@ -133,3 +1090,77 @@ class DataReader:
     def get_column_names(self):
         return self._col_names
 
+    def get_schema(self) -> Schema:
+        return self._schema
+
+    def get_rejected_counts(self) -> Dict[str, int]:
+        # number of bad values found per column during the last `iter_batches` scan
+        return {col_name: converter.n_rejected for col_name, converter in self._converters.items()}
+
+
+class MmapBatch(Mapping):
+    """
+    Column batch returned by `DataReader.iter_batches` in mmap mode
+
+    Holds a view on the raw bytes of a block of rows plus the start/end offset of every field in it. A column is cut
+    out of the bytes and converted only the first time it is looked up, so columns a query never touches are never
+    copied or decoded.
+
+    The columns that are looked up are copied though: `gather_fields` pads every field to the longest one of the
+    batch, through an index matrix of 8 bytes per padded byte. A batch of 100000 rows with a 40 byte wide column
+    briefly needs about 32MB for that column, far more than its text, when one long value widens the whole column.
+    """
+    def __init__(self, buf: np.ndarray, starts: np.ndarray, ends: np.ndarray, col_index: Dict[str, int],
+                 converters: Dict[str, ColumnConverter], decoded: Optional[Dict[str, np.ndarray]] = None) -> None:
+        self._buf = buf
+        self._starts = starts
+        self._ends = ends
+        self._col_index = col_index
+        self._converters = converters
+        self._decoded = {} if decoded is None else decoded
+
+    def __getitem__(self, col_name: str) -> np.ndarray:
+        if col_name not in self._decoded:
+            self._decoded[col_name] = self._converters[col_name](self.get_raw(col_name=col_name))
+
+        return self._decoded[col_name]
+
+    def get_raw(self, col_name: str) -> np.ndarray:
+        # bytes of the column before conversion
+        ind = self._col_index[col_name]
+        return self.gather_fields(buf=self._buf, starts=self._starts[:, ind], ends=self._ends[:, ind])
+
+    def evaluate(self, predicate: Predicate) -> np.ndarray:
+        # rows matching the predicate, a str column is compared as raw bytes without decoding it
+        if predicate.column not in self._decoded and self._converters[predicate.column].keeps_raw_values():
+            return predicate.evaluate(vals=self.get_raw(col_name=predicate.column))
+
+        return predicate.evaluate(vals=self[predicate.column])
+
+    def take(self, mask: np.ndarray, col_names: List[str]) -> 'MmapBatch':
+        # batch with only the rows in `mask` and the `col_names` columns, the other columns are still not converted
+        return MmapBatch(buf=self._buf, starts=self._starts[mask], ends=self._ends[mask],
+                         col_index={col_name: self._col_index[col_name] for col_name in col_names},
+                         converters=self._converters,
+                         decoded={col_name: vals[mask] for col_name, vals in self._decoded.items()
+                                  if col_name in col_names})
+
+    def __iter__(self):
+        return iter(self._col_index)
+
+    def __len__(self) -> int:
+        return len(self._col_index)
+
+    @staticmethod
+    def gather_fields(buf: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        # copy the fields into a fixed width bytes array, shorter fields are padded with null bytes which numpy drops
+        lens = ends - starts
+        width = int(lens.max()) if len(lens) > 0 else 0
+        if width == 0:
+            return np.zeros(len(starts), dtype='S1')
+
+        offsets = np.arange(width)
+        chars = buf[np.minimum(starts[:, None] + offsets, len(buf) - 1)]
+        chars = np.where(offsets < lens[:, None], chars, 0).astype(np.uint8)
+
+        return chars.view(f'S{width}').ravel()
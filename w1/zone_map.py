@@ -0,0 +1,137 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from w1.cache import get_file_signature
+from w1.predicates import Predicate
+from w1.schema import Schema
+import constants
+import numpy as np
+import json
+import os
+
+# bump when the layout of the zone map file changes, older zone maps are then rebuilt
+ZONE_MAP_VERSION = 1
+
+# rows per zone, a filtered scan skips or reads whole zones
+ZONE_ROWS = 8192
+
+# columns with a min/max per zone by default
+ZONE_COLUMNS = [constants.OutDataColNames.DATE, constants.OutDataColNames.UNIT_PRICE,
+                constants.OutDataColNames.TOTAL_PRICE]
+
+
+class ZoneMap:
+    """
+    Small index of a CSV file, kept in the hidden file `.<file name>.zones.json` next to it
+
+    The rows are cut into zones of `ZONE_ROWS` rows, and for every zone the byte offset where it starts and the
+    min/max of a few columns (Date, UnitPrice and TotalPrice by default) are kept. A filtered scan (see
+    `DataReader.iter_batches(where=...)`) then only reads the zones whose min/max can hold a match and seeks past the
+    others. This pays off when the file is (roughly) ordered on the column, e.g. sales appended over time and
+    filtered on Date.
+
+    Like the columnar cache it records the size and modification time of the file it was built from (see
+    `get_file_signature`) and is only used while they still match.
+    """
+    def __init__(self, fp: str, sep: str, col_names: List[str], schema: Schema,
+                 columns: Optional[List[str]] = None) -> None:
+        self._fp = fp
+        self._sep = sep
+        self._col_names = col_names
+        self._schema = schema
+        self._columns = [column for column in (ZONE_COLUMNS if columns is None else columns) if column in col_names]
+
+        folder_path, file_name = os.path.split(os.path.abspath(fp))
+        self._path = os.path.join(folder_path, f'.{file_name}.zones.json')
+
+    def get_path(self) -> str:
+        return self._path
+
+    def get_columns(self) -> List[str]:
+        return self._columns
+
+    def get_signature(self) -> Dict:
+        return dict(get_file_signature(fp=self._fp, sep=self._sep, col_names=self._col_names, schema=self._schema),
+                    version=ZONE_MAP_VERSION, columns=self._columns)
+
+    def load(self) -> Optional[Dict]:
+        # returns None when there is no zone map or it is out of date
+        try:
+            with open(self._path) as f:
+                zones = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+        signature = self.get_signature()
+        if any([zones.get(key) != val for key, val in signature.items()]):
+            return None
+
+        return zones
+
+    def is_valid(self) -> bool:
+        return self.load() is not None
+
+    def write(self, batches: Iterable[Tuple[Dict[str, np.ndarray], np.ndarray]]) -> None:
+        """
+        Write the zone map from the (batch, row byte offsets) pairs of a full scan of the file
+        """
+        signature = self.get_signature()
+
+        starts = []
+        bounds = {column: {'min': [], 'max': []} for column in self._columns}
+        for batch, offsets in batches:
+            for first_row in range(0, len(offsets), ZONE_ROWS):
+                starts.append(int(offsets[first_row]))
+                for column in self._columns:
+                    low, high = self.get_bounds(vals=batch[column][first_row:first_row + ZONE_ROWS])
+                    bounds[column]['min'].append(low)
+                    bounds[column]['max'].append(high)
+
+        if self.get_signature() != signature:
+            # the file changed while it was being parsed
+            return
+
+        tmp_path = f'{self._path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(dict(signature, starts=starts, bounds=bounds)))
+        os.replace(tmp_path, self._path)
+
+    @staticmethod
+    def get_bounds(vals: np.ndarray) -> Tuple:
+        # min/max of a block of values, None when it holds no value (all NaN)
+        if vals.dtype.kind == 'f':
+            vals = vals[~np.isnan(vals)]
+            return (float(vals.min()), float(vals.max())) if len(vals) > 0 else (None, None)
+
+        vals = [str(val) for val in vals.tolist()]
+        return (min(vals), max(vals)) if len(vals) > 0 else (None, None)
+
+    def get_byte_ranges(self, zones: Dict, predicates: Sequence[Predicate],
+                        byte_range: Optional[Tuple[int, int]] = None) -> List[Tuple[int, int]]:
+        """
+        Byte ranges of the zones that can hold rows matching all the `predicates`, neighbouring zones are merged
+        into one range. Only the part inside `byte_range` is kept when given.
+        """
+        starts = zones['starts']
+        ends = starts[1:] + [os.path.getsize(self._fp)]
+
+        may_match = np.ones(len(starts), dtype=bool)
+        for predicate in predicates:
+            if predicate.column not in zones['bounds']:
+                continue
+
+            bounds = zones['bounds'][predicate.column]
+            may_match &= np.array([low is None or predicate.may_match_range(low=low, high=high)
+                                   for low, high in zip(bounds['min'], bounds['max'])], dtype=bool)
+
+        byte_ranges = []
+        for start, end, keep in zip(starts, ends, may_match):
+            if byte_range is not None:
+                start, end = max(start, byte_range[0]), min(end, byte_range[1])
+            if not keep or start >= end:
+                continue
+
+            if byte_ranges and byte_ranges[-1][1] == start:
+                byte_ranges[-1] = (byte_ranges[-1][0], end)
+            else:
+                byte_ranges.append((start, end))
+
+        return byte_ranges
@@ -1,9 +1,13 @@
 import time
-from typing import List, Dict
-from tqdm import tqdm
+from typing import List, Dict, Tuple, Optional, Union
 import os
 import multiprocessing
 from w1.data_processor import DataProcessor
+from w1.utils import split_file, merge_sums, EXACT_STATS, STREAMING_STATS, SKETCH_STATS, STATS_MODES
+from w1.predicates import Predicate
+from w1.hyperloglog import HyperLogLog
+from w1.heavy_hitters import TopK, DEFAULT_CAPACITY
+from w1.plan import DistinctCountConsumer, TopKConsumer, get_sales_consumers
 import constants
 from global_utils import get_file_name, make_dir, plot_sales_data
 import json
@@ -15,8 +19,8 @@ CURRENT_FOLDER_NAME = os.path.dirname(os.path.abspath(__file__))
 
 
 class DP(DataProcessor):
-    def __init__(self, file_path: str) -> None:
-        super().__init__(file_path)
+    def __init__(self, file_path: str, byte_range: Optional[Tuple[int, int]] = None) -> None:
+        super().__init__(file_path, byte_range=byte_range, use_cache=True)
 
     def get_file_path(self) -> str:
         return self._fp
@@ -28,82 +32,134 @@ class DP(DataProcessor):
         return self._n_rows
 
 
-def revenue_per_region(dp: DP) -> Dict:
-    data_reader = dp.data_reader
-    data_reader_gen = (row for row in data_reader)
+def revenue_per_region(dp: DP, where: Union[Predicate, List[Predicate], None] = None) -> Dict:
+    revenue = dp.compute_group_by(group_by=constants.OutDataColNames.COUNTRY, where=where,
+                                  aggregates={'revenue': ('sum', constants.OutDataColNames.TOTAL_PRICE)})
 
-    # skip first row as it is the column name
-    _ = next(data_reader_gen)
-
-    aggregate = dict()
-
-    for row in tqdm(data_reader_gen):
-        if row[constants.OutDataColNames.COUNTRY] not in aggregate:
-            aggregate[row[constants.OutDataColNames.COUNTRY]] = 0
-        aggregate[row[constants.OutDataColNames.COUNTRY]] += dp.to_float(row[constants.OutDataColNames.TOTAL_PRICE])
-
-    return aggregate
+    return revenue.get_aggregate(name='revenue')
 
 
 def get_sales_information(file_path: str) -> Dict:
     # Initialize
     dp = DP(file_path=file_path)
 
+    # stats, total revenue and revenue per region from a single scan of the file
+    results = dp.run_plan(consumers=get_sales_consumers())
+
     # print stats
-    dp.describe(column_names=[constants.OutDataColNames.UNIT_PRICE, constants.OutDataColNames.TOTAL_PRICE])
+    dp.print_stats(stats=results['stats'])
 
     # return total revenue and revenue per region
     return {
-        'total_revenue': dp.aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE),
-        'revenue_per_region': revenue_per_region(dp),
+        'total_revenue': results['total_revenue'],
+        'revenue_per_region': results['revenue_per_region'],
         'file_name': get_file_name(file_path)
     }
 
 
-# batches the files based on the number of processes
-def batch_files(file_paths: List[str], n_processes: int) -> List[set]:
-    if n_processes > len(file_paths):
-        return #### [YOUR CODE HERE] ####
-
-    n_per_batch = #### [YOUR CODE HERE] ####
-
-    first_set_len = n_processes * n_per_batch
-    first_set = file_paths[0:first_set_len]
-    second_set = #### [YOUR CODE HERE] ####
-
-    batches = [set(file_paths[i:i + n_per_batch]) for i in range(0, len(first_set), n_per_batch)]
-    for ind, each_file in enumerate(second_set):
-        #### [YOUR CODE HERE] ####
-
-    return batches
-
+# A processor of the whole file parses it into its columnar cache (when it isn't up to date already), the byte
+# ranges of the file are then read from the cache. Its rows are counted from the manifest of the cache, not the file.
+def build_cache(file_path: str) -> None:
+    DP(file_path=file_path)
+
+
+# Fetch the partial revenue data and stats of the rows inside one byte range of a file, with the streaming or
+# sketch stats mode the partial stats sent back to the parent process stay small however big the range is. The
+# distinct values of `distinct_columns` are counted approximately, in a few KB per column. With `top_k` the products
+# with the most revenue are tracked in `top_capacity` slots (every product, exactly, with `top_capacity=None`).
+def get_partial_sales_information(file_path: str, byte_range: Tuple[int, int], stats_mode: str = EXACT_STATS,
+                                  distinct_columns: Optional[List[str]] = None, top_k: int = 0,
+                                  top_capacity: Optional[int] = DEFAULT_CAPACITY) -> Dict:
+    dp = DP(file_path=file_path, byte_range=byte_range)
+
+    consumers = get_sales_consumers(stats_mode=stats_mode)
+    if distinct_columns:
+        consumers['distinct'] = DistinctCountConsumer(column_names=distinct_columns)
+    if top_k > 0:
+        consumers['top_products'] = TopKConsumer(key_column=constants.OutDataColNames.STOCK_CODE,
+                                                 val_column=constants.OutDataColNames.TOTAL_PRICE,
+                                                 capacity=top_capacity)
+
+    results = dp.run_plan(consumers=consumers)
+    if top_k > 0:
+        results['top_k'] = top_k
+    results['file_name'] = get_file_name(file_path)
+
+    return results
+
+
+# Combine partial results (of byte ranges, whole files or earlier combinations) into one partial result, the
+# partials are left as they are. Any grouping gives the same answer, e.g. the ranges of every file and then the
+# files, or all the ranges of all the years at once. The file name lists the files the result covers.
+def combine_sales_information(partials: List[Dict]) -> Dict:
+    stats = dict()
+    for partial in partials:
+        for column_name, column_stats in partial['stats'].items():
+            if column_name not in stats:
+                stats[column_name] = column_stats.get_empty()
+            stats[column_name].merge(other=column_stats)
+
+    distinct = dict()
+    for partial in partials:
+        for column_name, counter in partial.get('distinct', dict()).items():
+            if column_name not in distinct:
+                distinct[column_name] = HyperLogLog(precision=counter.get_precision())
+            distinct[column_name].merge(other=counter)
+
+    top_products = None
+    for partial in partials:
+        if 'top_products' in partial:
+            if top_products is None:
+                top_products = TopK(capacity=partial['top_products'].get_capacity())
+            top_products.merge(other=partial['top_products'])
+
+    file_names = sorted(set([file_name for partial in partials for file_name in partial['file_name'].split('+')]))
+
+    combined = {
+        'stats': stats,
+        'total_revenue': sum([partial['total_revenue'] for partial in partials]),
+        'revenue_per_region': merge_sums(totals=[partial['revenue_per_region'] for partial in partials]),
+        'file_name': '+'.join(file_names)
+    }
+    if distinct:
+        combined['distinct'] = distinct
+    if top_products is not None:
+        combined['top_products'] = top_products
+        combined['top_k'] = max([partial.get('top_k', 0) for partial in partials])
 
-# Fetch the revenue data from a file
-def run(file_names: List[str], n_process: int) -> List[Dict]:
-    st = time.time()
+    return combined
 
-    print("Process : {}".format(n_process))
-    folder_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
-    file_paths = [os.path.join(folder_path, file_name) for file_name in file_names]
-    revenue_data = [get_sales_information(file_path) for file_path in file_paths]
 
-    en = time.time()
+# Combine the partial results of the byte ranges of a file (or of several files) into the output of
+# `get_sales_information`
+def merge_sales_information(partials: List[Dict]) -> Dict:
+    combined = combine_sales_information(partials=partials)
 
-    print(f"Batch for process-{n_process} time taken {en - st}")
-    return revenue_data
+    for column_name, value in combined['stats'].items():
+        pprint(column_name)
+        pprint(value.get_stats())
 
+    sales_information = {
+        'total_revenue': combined['total_revenue'],
+        'revenue_per_region': combined['revenue_per_region'],
+        'file_name': combined['file_name']
+    }
+    if 'distinct' in combined:
+        sales_information['distinct_counts'] = {column_name: counter.get_count()
+                                                for column_name, counter in combined['distinct'].items()}
+    if 'top_products' in combined:
+        # (StockCode, revenue, error) with the true revenue between `revenue - error` and `revenue`
+        sales_information['top_products'] = combined['top_products'].get_top(k=combined['top_k'])
 
-def flatten(lst: List[List]) -> List:
-    return [item for sublist in lst for item in sublist]
+    return sales_information
 
 
 def main() -> List[Dict]:
     """
-    Use the `batch_files` method to create batches of files that needs to be run in each process
-    Use the `run` method to fetch revenue data for a given batch of files
-
-    Use multiprocessing module to process batches of data in parallel
-    Check `multiprocessing.Pool` and `pool.starmap` methods to help you wit the task
+    Every file is cut into newline aligned byte ranges with `split_file` (one per process), so a single big file is
+    spread over all the processes instead of setting the wall time on its own. Each range is handled by
+    `get_partial_sales_information` in a `multiprocessing.Pool` and the partial results of a file are combined
+    with `merge_sales_information`
 
     At the end check the overall time taken in this code vs the time taken in W1 code
 
@@ -144,41 +200,81 @@ def main() -> List[Dict]:
     """
 
     st = time.time()
-    n_processes = 3 # you may modify this number - check out multiprocessing.cpu_count() as well
+    n_processes = multiprocessing.cpu_count()
 
     parser = argparse.ArgumentParser(description="Choose from one of these : [tst|sml|bg]")
     parser.add_argument('--type',
                         default='tst',
                         choices=['tst', 'sml', 'bg'],
                         help='Type of data to generate')
+    parser.add_argument('--stats-mode',
+                        default=EXACT_STATS,
+                        choices=STATS_MODES,
+                        help='Exact stats send every value back from the workers, streaming and sketch stats '
+                             'only a small summary')
+    parser.add_argument('--distinct',
+                        nargs='*',
+                        default=[],
+                        help='Columns to count the distinct values of (approximately), e.g. StockCode InvoiceNo')
+    parser.add_argument('--top',
+                        default=0,
+                        type=int,
+                        help='Number of products with the most revenue to report per year and overall')
+    parser.add_argument('--exact-top',
+                        action='store_true',
+                        help='Track the revenue of every product instead of a bounded number of them')
+    parser.add_argument('--all-years',
+                        action='store_true',
+                        help='Also merge the partials of all the files into one answer over all the years (streaming '
+                             'and sketch stats only, exact ones would gather every value of every file)')
     args = parser.parse_args()
+    if args.all_years and args.stats_mode == EXACT_STATS:
+        parser.error(f"--all-years needs the stats mode {STREAMING_STATS} or {SKETCH_STATS}")
 
     data_folder_path = os.path.join(CURRENT_FOLDER_NAME, '..', constants.DATA_FOLDER_NAME, args.type)
-    files = [str(file) for file in os.listdir(data_folder_path) if str(file).endswith('csv')]
+    files = [str(file) for file in os.listdir(data_folder_path)
+             if str(file).endswith(constants.DATA_FILE_EXTENSIONS)]
 
     output_save_folder = os.path.join(CURRENT_FOLDER_NAME, '..', 'output', args.type,
                                       datetime.now().strftime("%B %d %Y %H-%M-%S"))
     make_dir(output_save_folder)
     file_paths = [os.path.join(data_folder_path, file_name) for file_name in files]
 
-    batches = batch_files(file_paths=file_paths, n_processes=n_processes)
+    top_capacity = None if args.exact_top else DEFAULT_CAPACITY
+    file_ranges = [(file_path, byte_range, args.stats_mode, args.distinct, args.top, top_capacity)
+                   for file_path in file_paths
+                   for byte_range in split_file(fp=file_path, n_parts=n_processes)]
 
-    ######################################## YOUR CODE HERE ##################################################
     with multiprocessing.Pool(processes=n_processes) as pool:
-        
-    ######################################## YOUR CODE HERE ##################################################
+        pool.map(build_cache, file_paths)
+        partials = pool.starmap(get_partial_sales_information, file_ranges)
+
+    revenue_data = [merge_sales_information(partials=[partial for (range_file_path, *_), partial
+                                                      in zip(file_ranges, partials) if range_file_path == file_path])
+                    for file_path in file_paths]
+
+    # the same partials also give the answer over all the years, when their stats are small summaries
+    if args.all_years:
+        all_years_data = merge_sales_information(partials=partials)
+        print(f"Total revenue of {all_years_data['file_name']} : {all_years_data['total_revenue']}")
+        if 'distinct_counts' in all_years_data:
+            print(f"Distinct values of {all_years_data['file_name']} : {all_years_data['distinct_counts']}")
+        if 'top_products' in all_years_data:
+            print(f"Top products of {all_years_data['file_name']} :")
+            pprint(all_years_data['top_products'])
 
     en = time.time()
     print("Overall time taken : {}".format(en-st))
 
-    ######################################## YOUR CODE HERE ##################################################
     for yearly_data in revenue_data:
-        
+        with open(os.path.join(output_save_folder, f'{yearly_data["file_name"]}.json'), 'w') as f:
+            f.write(json.dumps(yearly_data))
+
+        plot_sales_data(yearly_revenue=yearly_data['revenue_per_region'], year=yearly_data["file_name"],
+                        plot_save_path=os.path.join(output_save_folder, f'{yearly_data["file_name"]}.png'))
 
-    ######################################## YOUR CODE HERE ##################################################
-        
     # should return revenue data
-    return #### [YOUR CODE HERE] ####
+    return revenue_data
 
 
 if __name__ == '__main__':
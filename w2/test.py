@@ -1,7 +1,10 @@
 import os
-from w2.main import get_sales_information
-from w1.utils import DataReader
+from w2.main import get_sales_information, get_partial_sales_information, merge_sales_information, \
+    combine_sales_information
+from w1.utils import DataReader, split_file, STREAMING_STATS
+import pickle
 import constants
+import pytest
 from global_utils import blockPrint, enablePrint
 from pprint import pprint
 
@@ -50,3 +53,53 @@ def test_revenue_per_region():
     assert all([len(each) > 0 for each in revenue_data])
 
     pprint(revenue_data)
+
+
+def test_split_file():
+    blockPrint()
+    file_path = os.path.join(CURRENT_FOLDER, '..', constants.DATA_FOLDER_NAME, 'tst', '2020.csv')
+    byte_ranges = split_file(fp=file_path, n_parts=4)
+
+    merged = merge_sales_information(partials=[get_partial_sales_information(file_path=file_path,
+                                                                             byte_range=byte_range)
+                                               for byte_range in byte_ranges])
+    expected = get_sales_information(file_path)
+    enablePrint()
+
+    # the ranges should follow each other and cover the file up to the end
+    assert len(byte_ranges) == 4
+    assert all([prev[1] == nxt[0] for prev, nxt in zip(byte_ranges[:-1], byte_ranges[1:])])
+    assert byte_ranges[-1][1] == os.path.getsize(file_path)
+
+    # combining the ranges should give the same answer as processing the file in one go
+    assert abs(merged['total_revenue'] - expected['total_revenue']) < 1e-6 * expected['total_revenue']
+    assert merged['revenue_per_region'].keys() == expected['revenue_per_region'].keys()
+    assert all([abs(merged['revenue_per_region'][country] - revenue) < 1e-6 * revenue
+                for country, revenue in expected['revenue_per_region'].items()])
+
+
+def test_combine_sales_information():
+    blockPrint()
+    data_folder_path = os.path.join(CURRENT_FOLDER, '..', constants.DATA_FOLDER_NAME, 'tst')
+    file_paths = [os.path.join(data_folder_path, file_name) for file_name in ['2015.csv', '2016.csv']]
+    partials = [get_partial_sales_information(file_path=file_path, byte_range=byte_range, stats_mode=STREAMING_STATS)
+                for file_path in file_paths for byte_range in split_file(fp=file_path, n_parts=2)]
+    enablePrint()
+
+    # streaming partial states are small to send back from a worker process
+    assert all([len(pickle.dumps(partial)) < 4096 for partial in partials])
+
+    # any grouping of the partials gives the same answer over all the years
+    all_at_once = combine_sales_information(partials=partials)
+    per_file = combine_sales_information(partials=[combine_sales_information(partials=partials[:2]),
+                                                   combine_sales_information(partials=partials[2:])])
+    assert all_at_once['file_name'] == per_file['file_name'] == '2015+2016'
+    assert abs(all_at_once['total_revenue'] - per_file['total_revenue']) < 1e-6 * per_file['total_revenue']
+    assert all([abs(all_at_once['revenue_per_region'][country] - revenue) < 1e-6 * revenue
+                for country, revenue in per_file['revenue_per_region'].items()])
+    for column_name, column_stats in per_file['stats'].items():
+        assert all_at_once['stats'][column_name].get_stats()['std'] == \
+               pytest.approx(column_stats.get_stats()['std'], rel=1e-9)
+
+    assert abs(sum(all_at_once['revenue_per_region'].values()) - all_at_once['total_revenue']) < \
+           1e-6 * all_at_once['total_revenue']
@@ -1,13 +1,16 @@
 import datetime
-from typing import List, Dict
+from typing import List, Dict, Union
 from pprint import pprint
-from w1.utils import Stats
+from w1.utils import EXACT_STATS, SKETCH_STATS
 from tqdm import tqdm
 import os
-from w3.utils.database import DB
 import uuid
 import inspect
-from w1.data_processor import DataProcessor
+import numpy as np
+from w3.utils.tracked_processor import TrackedDataProcessor
+from w1.predicates import Predicate
+from w1.group_by import GroupBy
+from w1.plan import get_sales_consumers
 import argparse
 from global_utils import make_dir,  plot_sales_data, get_file_name
 import json
@@ -16,30 +19,14 @@ import constants
 CURRENT_FOLDER_NAME = os.path.dirname(os.path.abspath(__file__))
 
 
-class DP(DataProcessor):
-    def __init__(self, file_path):
-        super().__init__(file_path)
-        self._db = DB()
-
-    def get_db(self) -> DB:
-        return self._db
-
-    def get_file_path(self) -> str:
-        return self._fp
-
-    def get_file_name(self) -> str:
-        return self._file_name
-
-    def get_n_rows(self) -> int:
-        return self._n_rows
-
-    def aggregate(self, column_name: str) -> float:
+class DP(TrackedDataProcessor):
+    def aggregate(self, column_name: str, where: Union[Predicate, List[Predicate], None] = None) -> float:
         """
-        Input : List[str]
-        Output : Dict
+        Input : str, Predicate or List[Predicate]
+        Output : float
 
-        This method should use the generator function (`file_reader`) created above and return aggregate
-        of the column mentioned in the `column_name` variable
+        This method uses the column batches of self.data_reader and returns the aggregate of the column mentioned in
+        the `column_name` variable, its progress is recorded in the processes table
 
         For example if the `column_name` -> 'TotalPrice' and the file format is as below:
 
@@ -49,60 +36,30 @@ class DP(DataProcessor):
         84732D       , IVORY CLOCK    , 0.39       , 2       , 0.78       ,India
 
         aggregate should be 105.58
+
+        With `where` only the matching rows are summed, e.g. `where=Eq('Country', 'Germany')` gives 24.96
         """
         process_id = str(uuid.uuid4())
         self._db.insert(process_id, start_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
                         file_name=self._file_name, file_path=self._fp, description=inspect.stack()[0][3])
 
-        # get generator from data_reader
-        data_reader_gen = (row for row in self.data_reader)
-
-        # skip first row as it is the column name
-        _ = next(data_reader_gen)
-
         aggregate = 0
+        n_rows_done = 0
 
-        for row_num, row in enumerate(tqdm(data_reader_gen)):
-            if isinstance(self._n_rows, int) and isinstance(row_num, int) and row_num % 10000 == 0:
-                self._db.update_percentage(process_id=process_id, percentage=100 * row_num/self._n_rows)
+        for batch in tqdm(self.data_reader.iter_batches(columns=[column_name], where=where)):
+            # NaN marks the values that couldn't be converted to float, nansum leaves them out
+            aggregate += float(np.nansum(batch[column_name]))
 
-            if self.to_float(row[column_name]):
-                aggregate += self.to_float(row[column_name])
+            n_rows_done += len(batch[column_name])
+            if isinstance(self._n_rows, int) and self._n_rows > 0:
+                self._db.update_percentage(process_id=process_id, percentage=100 * n_rows_done/self._n_rows)
 
         self._db.update_percentage(process_id=process_id, percentage=100)
         self._db.update_end_time(process_id=process_id, end_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
         return aggregate
 
-    def describe(self, column_names: List[str]):
-        # get generator from data_reader
-        data_reader_gen = (row for row in self.data_reader)
-
-        # skip first row as it is the column name
-        _ = next(data_reader_gen)
-
-        stats = {name: Stats() for name in column_names}
 
-        process_id = str(uuid.uuid4())
-        self._db.insert(process_id, start_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-                        file_name=self._file_name, file_path=self._fp, description=inspect.stack()[0][3])
-
-        for row_num, row in enumerate(tqdm(data_reader_gen)):
-            if isinstance(self._n_rows, int) and isinstance(row_num, int) and row_num % 10000 == 0:
-                self._db.update_percentage(process_id=process_id, percentage=100 * row_num/self._n_rows)
-
-            for column_name in column_names:
-                stats[column_name].update_stats(val=row[column_name])
-
-        self._stats = stats
-        for column_name, value in self._stats.items():
-            pprint(column_name)
-            pprint(value.get_stats())
-
-        self._db.update_percentage(process_id=process_id, percentage=100)
-        self._db.update_end_time(process_id=process_id, end_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
-
-
-def revenue_per_region(dp: DP) -> Dict:
+def revenue_per_region(dp: DP, where: Union[Predicate, List[Predicate], None] = None) -> Dict:
     """
     Input : object of instance type Class Koala
     Output : Dict
@@ -131,44 +88,47 @@ def revenue_per_region(dp: DP) -> Dict:
         'United Kingdom': 29.05,
         'United States': 121.499
     }
-    """
-    # get generator from data_reader
-    data_reader_gen = (row for row in dp.data_reader)
 
-    # skip first row as it is the column name
-    _ = next(data_reader_gen)
-
-    aggregate = dict()
+    With `where` only the rows matching the predicates are counted, e.g. the revenue per region in Q3:
+    where=Between('Date', low='2015/07/01', high='2015/09/30')
+    """
+    n_rows_done = 0
 
     process_id = str(uuid.uuid4())
     dp.get_db().insert(process_id=process_id, start_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
                        file_name=dp.get_file_name(), file_path=dp.get_file_path(), description=inspect.stack()[0][3])
 
-    for n_row, row in enumerate(tqdm(data_reader_gen)):
-        if isinstance(dp.get_n_rows(), int) and isinstance(n_row, int) and n_row % 10000 == 0:
-            dp.get_db().update_percentage(process_id=process_id, percentage=100 * n_row / dp.get_n_rows())
+    revenue = GroupBy(group_by=constants.OutDataColNames.COUNTRY,
+                      aggregates={'revenue': ('sum', constants.OutDataColNames.TOTAL_PRICE)})
+    for batch in tqdm(dp.data_reader.iter_batches(columns=revenue.get_columns(), where=where)):
+        revenue.update_batch(batch=batch)
 
-        if row[constants.OutDataColNames.COUNTRY] not in aggregate:
-            aggregate[row[constants.OutDataColNames.COUNTRY]] = 0
-        aggregate[row[constants.OutDataColNames.COUNTRY]] += dp.to_float(row[constants.OutDataColNames.TOTAL_PRICE])
+        n_rows_done += len(batch[constants.OutDataColNames.TOTAL_PRICE])
+        if isinstance(dp.get_n_rows(), int) and dp.get_n_rows() > 0:
+            dp.get_db().update_percentage(process_id=process_id, percentage=100 * n_rows_done / dp.get_n_rows())
 
     dp.get_db().update_percentage(process_id=process_id, percentage=100)
     dp.get_db().update_end_time(process_id=process_id, end_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
 
-    return aggregate
+    return revenue.get_aggregate(name='revenue')
 
 
-def get_sales_information(file_path: str) -> Dict:
+def get_sales_information(file_path: str, resume: bool = False, approx: bool = False,
+                          use_cache: bool = False) -> Dict:
     # Initialize
-    dp = DP(file_path=file_path)
+    dp = DP(file_path=file_path, resume=resume, use_cache=use_cache)
+
+    # stats, total revenue and revenue per region from a single scan of the file. Only approximate (sketch) stats
+    # are checkpointed, exact ones hold every value read so far
+    results = dp.run_plan(consumers=get_sales_consumers(stats_mode=SKETCH_STATS if approx else EXACT_STATS))
 
     # print stats
-    dp.describe(column_names=[constants.OutDataColNames.UNIT_PRICE, constants.OutDataColNames.TOTAL_PRICE])
+    dp.print_stats(stats=results['stats'])
 
     # return total revenue and revenue per region
     return {
-        'total_revenue': dp.aggregate(column_name=constants.OutDataColNames.TOTAL_PRICE),
-        'revenue_per_region': revenue_per_region(dp),
+        'total_revenue': results['total_revenue'],
+        'revenue_per_region': results['revenue_per_region'],
         'file_name': get_file_name(file_path)
     }
 
@@ -179,17 +139,27 @@ def main():
                         default='tst',
                         choices=['tst', 'sml', 'bg'],
                         help='Type of data to generate')
+    parser.add_argument('--resume', action='store_true',
+                        help='Carry on an interrupted run from its last checkpoint instead of starting over')
+    parser.add_argument('--approx', action='store_true',
+                        help='Approximate percentiles (sketches) instead of exact ones, only such runs are '
+                             'checkpointed and can be resumed')
+    parser.add_argument('--cache', action='store_true',
+                        help='Parse every file into a columnar cache next to it (once), later runs read the cache')
     args = parser.parse_args()
+    if not args.approx:
+        print("Checkpointing is off for exact stats, an interrupted run starts over (see --approx)")
 
     data_folder_path = os.path.join(CURRENT_FOLDER_NAME, '..', constants.DATA_FOLDER_NAME, args.type)
-    files = [str(file) for file in os.listdir(data_folder_path) if str(file).endswith('csv')]
+    files = [str(file) for file in os.listdir(data_folder_path)
+             if str(file).endswith(constants.DATA_FILE_EXTENSIONS)]
 
     output_save_folder = os.path.join(CURRENT_FOLDER_NAME, '..', 'output', args.type,
                                       datetime.datetime.now().strftime("%B %d %Y %H-%M-%S"))
     make_dir(output_save_folder)
 
     file_paths = [os.path.join(data_folder_path, file_name) for file_name in files]
-    revenue_data = [get_sales_information(file_path)
+    revenue_data = [get_sales_information(file_path, resume=args.resume, approx=args.approx, use_cache=args.cache)
                     for file_path in file_paths]
 
     pprint(revenue_data)
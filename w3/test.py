@@ -1,5 +1,10 @@
 from w3.utils.database import DB
 from w3.utils.response_model import ProcessStatus
+from w3.utils.tracked_processor import TrackedDataProcessor
+from w1.plan import StatsConsumer, SumConsumer, SumByKeyConsumer
+from w1.utils import EXACT_STATS
+import tempfile
+import os
 import uuid
 from datetime import datetime
 import time
@@ -67,3 +72,66 @@ class TestApp(unittest.TestCase):
 
         records = self.db.read_all()
         pprint(records)
+
+
+class TestTrackedDataProcessor(unittest.TestCase):
+    db_name = 'db_test.sqlite'
+
+    @staticmethod
+    def get_consumers():
+        return {
+            'total_revenue': SumConsumer(column_name='TotalPrice'),
+            'revenue_per_region': SumByKeyConsumer(key_column='Country', val_column='TotalPrice')
+        }
+
+    @staticmethod
+    def crash(n_rows_done: int) -> None:
+        if n_rows_done >= 50:
+            raise RuntimeError('killed halfway')
+
+    def test_resume_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as folder_path:
+            fp = os.path.join(folder_path, 'sales.csv')
+            with open(fp, 'w') as f:
+                f.write('TotalPrice,Country\n' + ''.join([f"{n_row}.5,{['Russia', 'Germany', 'India'][n_row % 3]}\n"
+                                                          for n_row in range(100)]))
+
+            expected = TrackedDataProcessor(file_path=fp, db_name=self.db_name).run_plan(
+                consumers=self.get_consumers(), checkpoint_bytes=100)
+
+            # a run killed halfway leaves its last checkpoint in the processes table
+            dp = TrackedDataProcessor(file_path=fp, db_name=self.db_name)
+            with self.assertRaises(RuntimeError):
+                dp.run_plan(consumers=self.get_consumers(), on_batch=self.crash, checkpoint_bytes=100)
+
+            saved = dp.get_db().read_checkpoint(file_path=fp, description='run_plan')
+            self.assertIsNotNone(saved, msg='The killed run should have saved a checkpoint')
+            process_id, offset, _ = saved
+            self.assertTrue(0 < offset < os.path.getsize(fp), msg='The checkpoint should be in the middle of the file')
+
+            # the resumed run carries on from the checkpoint under the same process and ends it
+            n_rows_done = []
+            resumed = TrackedDataProcessor(file_path=fp, resume=True, db_name=self.db_name).run_plan(
+                consumers=self.get_consumers(), on_batch=n_rows_done.append, checkpoint_bytes=100)
+            self.assertAlmostEqual(resumed['total_revenue'], expected['total_revenue'])
+            self.assertEqual(resumed['revenue_per_region'].keys(), expected['revenue_per_region'].keys())
+            for country, revenue in expected['revenue_per_region'].items():
+                self.assertAlmostEqual(resumed['revenue_per_region'][country], revenue)
+            self.assertEqual(n_rows_done[-1], 100, msg='The rows before the checkpoint should count as done')
+            self.assertTrue(n_rows_done[0] > 8, msg='The rows before the checkpoint should not be read again')
+            self.assertIsNone(dp.get_db().read_checkpoint(file_path=fp, description='run_plan'))
+            self.assertTrue(any([process['process_id'] == process_id and process['end_time'] is not None
+                                 for process in dp.get_db().read_all()]))
+
+    def test_exact_stats_are_not_checkpointed(self):
+        with tempfile.TemporaryDirectory() as folder_path:
+            fp = os.path.join(folder_path, 'sales.csv')
+            with open(fp, 'w') as f:
+                f.write('TotalPrice,Country\n' + ''.join([f'{n_row}.5,Russia\n' for n_row in range(100)]))
+
+            dp = TrackedDataProcessor(file_path=fp, db_name=self.db_name)
+            consumers = dict(self.get_consumers(), stats=StatsConsumer(column_names=['TotalPrice'], mode=EXACT_STATS))
+            with self.assertRaises(RuntimeError):
+                dp.run_plan(consumers=consumers, on_batch=self.crash, checkpoint_bytes=100)
+
+            self.assertIsNone(dp.get_db().read_checkpoint(file_path=fp, description='run_plan'))
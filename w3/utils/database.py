@@ -3,7 +3,7 @@
 import sqlite3
 from datetime import datetime
 import os
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from global_utils import make_dir
 
 
@@ -15,6 +15,7 @@ class DB:
                                            check_same_thread=False)
         self._table_name = 'processes'
         self._col_order = ['process_id', 'file_name', 'file_path', 'description', 'start_time', 'end_time', 'percentage']
+        self._checkpoint_cols = {'checkpoint_offset': 'INTEGER', 'checkpoint': 'BLOB'}
 
         self.create_table()
 
@@ -43,10 +44,30 @@ class DB:
         - percentage : REAL (default is null)
 
         Read more about datatypes in Sqlite here -> https://www.sqlite.org/datatype3.html
+
+        Two more columns hold the last checkpoint of a resumable process (see `update_checkpoint`), they are added
+        to a table made before they existed:
+
+        - checkpoint_offset : INTEGER (default is null)
+        - checkpoint : BLOB (default is null)
         """
-    ######################################## YOUR CODE HERE ##################################################
+        self._connection.execute(f'''CREATE TABLE IF NOT EXISTS {self._table_name} (
+                                         process_id TEXT NOT NULL,
+                                         file_name TEXT DEFAULT NULL,
+                                         file_path TEXT DEFAULT NULL,
+                                         description TEXT DEFAULT NULL,
+                                         start_time TEXT NOT NULL,
+                                         end_time TEXT DEFAULT NULL,
+                                         percentage REAL DEFAULT NULL
+                                     );''')
+
+        col_names = [row[1] for row in self._connection.execute(f'PRAGMA table_info({self._table_name});')]
+        for col_name, col_type in self._checkpoint_cols.items():
+            if col_name not in col_names:
+                self._connection.execute(f'''ALTER TABLE {self._table_name}
+                                             ADD COLUMN {col_name} {col_type} DEFAULT NULL;''')
 
-    ######################################## YOUR CODE HERE ##################################################
+        self._connection.commit()
 
     def insert(self, process_id, start_time, file_name=None, file_path=None,
                description=None, end_time=None, percentage=None) -> None:
@@ -62,9 +83,11 @@ class DB:
         :param percentage: Percentage of process completed
         :return: None
         """
-    ######################################## YOUR CODE HERE ##################################################
+        self._connection.execute(f'''INSERT INTO {self._table_name} ({",".join(self._col_order)})
+                                     VALUES (?, ?, ?, ?, ?, ?, ?);''',
+                                 (process_id, file_name, file_path, description, start_time, end_time, percentage))
 
-    ######################################## YOUR CODE HERE ##################################################
+        self._connection.commit()
 
     def read_all(self) -> List[Dict]:
         data = []
@@ -94,8 +117,40 @@ class DB:
         :param percentage: Percentage of process completed
         :return: None
         """
-    ######################################## YOUR CODE HERE ##################################################
+        self._connection.execute(f'''UPDATE {self._table_name} SET percentage=?
+                                     WHERE process_id=?;''', (percentage, process_id))
+
+        self._connection.commit()
+
+    def update_checkpoint(self, process_id, offset: int, checkpoint: bytes) -> None:
+        """
+        Save the last checkpoint of a process, replacing the one before
+
+        :param process_id: Id of the process
+        :param offset: Byte offset of the file the process got to
+        :param checkpoint: Serialized partial result of the process up to `offset`
+        :return: None
+        """
+        self._connection.execute(f'''UPDATE {self._table_name} SET checkpoint_offset=?, checkpoint=?
+                                     WHERE process_id=?;''', (offset, sqlite3.Binary(checkpoint), process_id))
 
-    ######################################## YOUR CODE HERE ##################################################
+        self._connection.commit()
 
+    def read_checkpoint(self, file_path, description) -> Optional[Tuple[str, int, bytes]]:
+        """
+        Last checkpoint of the most recent process on `file_path` with this `description` that never ended, e.g.
+        because it crashed or was killed
 
+        :param file_path: Path to the file being processed
+        :param description: Description of the file/process
+        :return: (process_id, offset, checkpoint) or None when there is no such process
+        """
+        cursor = self._connection.execute(f'''SELECT process_id, checkpoint_offset, checkpoint
+                                              FROM {self._table_name}
+                                              WHERE file_path=? AND description=? AND end_time IS NULL
+                                                    AND checkpoint IS NOT NULL
+                                              ORDER BY start_time DESC, rowid DESC
+                                              LIMIT 1;''', (file_path, description))
+        row = cursor.fetchone()
+
+        return (row[0], row[1], bytes(row[2])) if row is not None else None
@@ -0,0 +1,129 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from w1.data_processor import DataProcessor, CHECKPOINT_BYTES
+from w1.utils import EXACT_STATS
+from w1.sketch import DEFAULT_SKETCH_K
+from w1.histogram import Histogram
+from w1.predicates import Predicate
+from w1.plan import Consumer
+from w3.utils.database import DB
+import datetime
+import numpy as np
+import pickle
+import uuid
+
+
+class TrackedDataProcessor(DataProcessor):
+    """
+    `DataProcessor` whose scans are recorded in the processes table of `DB` (start and end time and progress),
+    shared by the `DP` of w3 and w4
+
+    `run_plan` saves a checkpoint of its consumers to the table every `CHECKPOINT_BYTES`, with `resume` the last
+    run of the same plan on the same file that never ended is carried on from its checkpoint under its process id.
+    Only plans whose consumers all have a bounded state (e.g. streaming or sketch stats, not exact ones) are
+    checkpointed: every checkpoint pickles the whole state, exact stats would write all the values read so far each
+    time, which grows with the square of the file size. A plan with exact stats always starts over.
+    """
+    def __init__(self, file_path: str, resume: bool = False, db_name: str = "database.sqlite",
+                 use_cache: bool = False) -> None:
+        super().__init__(file_path, use_cache=use_cache)
+        self._db = DB(db_name=db_name)
+        self._resume = resume
+
+    def get_db(self) -> DB:
+        return self._db
+
+    def get_file_path(self) -> str:
+        return self._fp
+
+    def get_file_name(self) -> str:
+        return self._file_name
+
+    def get_n_rows(self) -> int:
+        return self._n_rows
+
+    def describe(self, column_names: List[str], mode: str = EXACT_STATS, sketch_k: int = DEFAULT_SKETCH_K,
+                 histogram: Optional[Histogram] = None, group_by: Optional[str] = None,
+                 group_key: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+                 where: Union[Predicate, List[Predicate], None] = None,
+                 on_batch: Optional[Callable[[int], None]] = None) -> Optional[Dict]:
+        # `DataProcessor.describe` with its progress recorded in the processes table
+        process_id = str(uuid.uuid4())
+        self._db.insert(process_id, start_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                        file_name=self._file_name, file_path=self._fp, description='describe')
+
+        def update_percentage(n_rows_done: int) -> None:
+            if isinstance(self._n_rows, int) and self._n_rows > 0:
+                self._db.update_percentage(process_id=process_id, percentage=100 * n_rows_done/self._n_rows)
+
+            if on_batch is not None:
+                on_batch(n_rows_done)
+
+        described = super().describe(column_names=column_names, mode=mode, sketch_k=sketch_k, histogram=histogram,
+                                     group_by=group_by, group_key=group_key, where=where, on_batch=update_percentage)
+
+        self._db.update_percentage(process_id=process_id, percentage=100)
+        self._db.update_end_time(process_id=process_id, end_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+        return described
+
+    def run_plan(self, consumers: Dict[str, Consumer], on_batch: Optional[Callable[[int], None]] = None,
+                 where: Union[Predicate, List[Predicate], None] = None,
+                 checkpoint_bytes: int = CHECKPOINT_BYTES) -> Dict[str, Any]:
+        # `on_batch` is called with the rows done so far, a resumed run counts the rows before its checkpoint too
+        description = 'run_plan'
+        signature = self.get_checkpoint_signature(consumers=consumers, where=where)
+
+        checkpoint = self.load_checkpoint(description=description, signature=signature) if self._resume else None
+        if checkpoint is not None:
+            process_id, offset, n_rows_start, consumers = checkpoint
+            resume_from = (offset, consumers)
+        else:
+            process_id = str(uuid.uuid4())
+            self._db.insert(process_id, start_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                            file_name=self._file_name, file_path=self._fp, description=description)
+            n_rows_start, resume_from = 0, None
+
+        n_rows_done = n_rows_start
+
+        def update_percentage(n_rows_scanned: int) -> None:
+            nonlocal n_rows_done
+            n_rows_done = n_rows_start + n_rows_scanned
+            if isinstance(self._n_rows, int) and self._n_rows > 0:
+                self._db.update_percentage(process_id=process_id, percentage=100 * n_rows_done/self._n_rows)
+
+            if on_batch is not None:
+                on_batch(n_rows_done)
+
+        def save_checkpoint(offset: int, partial_consumers: Dict[str, Consumer]) -> None:
+            self._db.update_checkpoint(process_id=process_id, offset=offset, checkpoint=pickle.dumps(
+                {'signature': signature, 'n_rows_done': n_rows_done, 'consumers': partial_consumers},
+                protocol=pickle.HIGHEST_PROTOCOL))
+
+        is_bounded = all([consumer.has_bounded_state() for consumer in consumers.values()])
+        results = super().run_plan(consumers=consumers, on_batch=update_percentage, where=where,
+                                   on_checkpoint=save_checkpoint if is_bounded else None, resume_from=resume_from,
+                                   checkpoint_bytes=checkpoint_bytes)
+
+        self._db.update_percentage(process_id=process_id, percentage=100)
+        self._db.update_end_time(process_id=process_id, end_time=datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+        return results
+
+    def load_checkpoint(self, description: str,
+                        signature: Dict) -> Optional[Tuple[str, int, int, Dict[str, Consumer]]]:
+        # process id, offset, rows done and consumers of an interrupted run, None when there is none to resume
+        saved = self._db.read_checkpoint(file_path=self._fp, description=description)
+        if saved is None:
+            return None
+
+        # the checkpoints are only ever written by `run_plan` into the local database, which is trusted like the code
+        # itself: unpickling a blob can run arbitrary code
+        process_id, offset, checkpoint = saved
+        try:
+            checkpoint = pickle.loads(checkpoint)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+
+        # the plan or the file changed since
+        if checkpoint.get('signature') != signature:
+            return None
+
+        return process_id, offset, checkpoint['n_rows_done'], checkpoint['consumers']